@@ -0,0 +1,190 @@
+# import libraries
+import numpy as np
+
+
+class Augmenter(object):
+    def __init__(self, rotation_range, width_shift_range, height_shift_range, shear_range,
+                 zoom_range, cval):
+        '''
+        Init method for Augmenter class
+
+        The augmenter applies the random affine transformations of keras
+        ImageDataGenerator.random_transform, with the same ranges and the
+        same composition of rotation, shift, shear and zoom about the center
+        of the image, filling with a constant value. The parameters of a
+        whole mini-batch are drawn as arrays and the images are warped
+        together, in blocks of pixels of the whole batch, instead of one
+        image at a time.
+
+        Parameters
+        ----------
+        rotation_range: float
+            range of the random rotations, in degrees
+        width_shift_range: float
+            range of the random shifts along the columns, as a fraction of
+            the width
+        height_shift_range: float
+            range of the random shifts along the rows, as a fraction of the
+            height
+        shear_range: float
+            range of the random shear angles, in degrees
+        zoom_range: float
+            the random zooms are drawn between 1 - zoom_range and
+            1 + zoom_range, along each axis
+        cval: float
+            value of the pixels mapped from outside the image
+
+        Returns
+        -------
+        None
+        '''
+        self.rotation_range = rotation_range
+        self.width_shift_range = width_shift_range
+        self.height_shift_range = height_shift_range
+        self.shear_range = shear_range
+        self.zoom_range = zoom_range
+        self.cval = cval
+
+    def random_matrices(self, n, height, width, prng):
+        '''
+        Draws the parameters of n random transformations and composes them
+        into affine matrices, mapping the coordinates of the pixels of the
+        transformed images to the coordinates in the images to sample
+
+        Parameters
+        ----------
+        n: int
+            number of transformations
+        height: int
+            height of the images
+        width: int
+            width of the images
+        prng: RandomState
+            random number generator
+
+        Returns
+        -------
+        ndarray
+            array of matrices with shape (n, 3, 3)
+        '''
+        theta = np.deg2rad(prng.uniform(-self.rotation_range, self.rotation_range, n))
+        tx = prng.uniform(-self.height_shift_range, self.height_shift_range, n) * height
+        ty = prng.uniform(-self.width_shift_range, self.width_shift_range, n) * width
+        shear = np.deg2rad(prng.uniform(-self.shear_range, self.shear_range, n))
+        zx, zy = prng.uniform(1 - self.zoom_range, 1 + self.zoom_range, (2, n))
+
+        matrices = np.zeros((n, 3, 3))
+        matrices[:, 2, 2] = 1
+        # rotation, shift, shear and zoom, composed in this order
+        cos, sin = np.cos(theta), np.sin(theta)
+        matrices[:, 0, 0] = cos * zx
+        matrices[:, 0, 1] = (cos * -np.sin(shear) - sin * np.cos(shear)) * zy
+        matrices[:, 0, 2] = cos * tx - sin * ty
+        matrices[:, 1, 0] = sin * zx
+        matrices[:, 1, 1] = (sin * -np.sin(shear) + cos * np.cos(shear)) * zy
+        matrices[:, 1, 2] = sin * tx + cos * ty
+        # about the center of the image
+        center = np.array([[1, 0, height / 2.0 + 0.5], [0, 1, width / 2.0 + 0.5], [0, 0, 1]])
+        reset = np.array([[1, 0, -(height / 2.0 + 0.5)], [0, 1, -(width / 2.0 + 0.5)], [0, 0, 1]])
+        return np.matmul(np.matmul(center, matrices), reset)
+
+    def transform(self, batch, matrices, block=1 << 14):
+        '''
+        Warps every image of a batch with its affine matrix, with linear
+        interpolation, as scipy.ndimage.affine_transform does in mode
+        'constant': a pixel mapped outside the image is cval, and integer
+        images are rounded to the nearest value.
+
+        The four neighbours of every pixel are packed together, so that a
+        single gather fetches them, and the pixels of the batch are warped
+        in blocks which fit in the cache. The coordinates are computed in
+        float64 and interpolated in float32, which rounds a few pixels to
+        the next integer value.
+
+        Parameters
+        ----------
+        batch: ndarray
+            array of images with shape (n, height, width)
+        matrices: ndarray
+            array of affine matrices with shape (n, 3, 3)
+        block: int
+            number of pixels warped at once
+
+        Returns
+        -------
+        ndarray
+            array of transformed images, of the same shape and dtype
+        '''
+        n, height, width = batch.shape
+        # coordinates sampled by the first pixel of each row of the batch,
+        # and their increments along the row
+        rows = np.arange(height, dtype=np.float64)
+        first_rows = (matrices[:, 0, 0, None] * rows + matrices[:, 0, 2, None]).reshape(-1)
+        first_cols = (matrices[:, 1, 0, None] * rows + matrices[:, 1, 2, None]).reshape(-1)
+        step_rows = np.repeat(matrices[:, 0, 1], height)
+        step_cols = np.repeat(matrices[:, 1, 1], height)
+        offsets = np.repeat(np.arange(n) * (height * width), height)
+        cols = np.arange(width, dtype=np.float64)
+
+        # the pixel, its right, bottom and bottom right neighbours
+        quad = np.zeros((n, height, width, 4), dtype=batch.dtype)
+        quad[..., 0] = batch
+        quad[:, :, :-1, 1] = batch[:, :, 1:]
+        quad[:, :-1, :, 2] = batch[:, 1:]
+        quad[:, :-1, :-1, 3] = batch[:, 1:, 1:]
+        quad = quad.reshape((-1, 4)).view(np.dtype((np.void, 4 * batch.dtype.itemsize))).reshape(-1)
+
+        integer = np.issubdtype(batch.dtype, np.integer)
+        out = np.empty((n * height, width), dtype=batch.dtype)
+        step = max(1, block // width)
+        for start in range(0, n * height, step):
+            end = min(start + step, n * height)
+            r = first_rows[start:end, None] + step_rows[start:end, None] * cols
+            c = first_cols[start:end, None] + step_cols[start:end, None] * cols
+            outside = (r < 0) | (r > height - 1) | (c < 0) | (c > width - 1)
+            # truncating is flooring for the coordinates inside the image
+            index_rows = r.astype(np.intp)
+            index_cols = c.astype(np.intp)
+            r = (r - index_rows).astype(np.float32)
+            c = (c - index_cols).astype(np.float32)
+            np.clip(index_rows, 0, height - 1, out=index_rows)
+            np.clip(index_cols, 0, width - 1, out=index_cols)
+            index_rows *= width
+            index_rows += index_cols
+            index_rows += offsets[start:end, None]
+            values = quad[index_rows].view(batch.dtype).reshape((-1, 4)).T.astype(np.float32)
+            top, right, bottom, corner = values.reshape((4,) + r.shape)
+            right -= top
+            right *= c
+            right += top
+            corner -= bottom
+            corner *= c
+            corner += bottom
+            corner -= right
+            corner *= r
+            corner += right
+            np.copyto(corner, self.cval, where=outside)
+            if integer:
+                corner += 0.5
+                np.floor(corner, out=corner)
+            out[start:end] = corner
+        return out.reshape(batch.shape)
+
+    def random_transform(self, batch, prng):
+        '''
+        Applies a random transformation to every image of a batch
+
+        Parameters
+        ----------
+        batch: ndarray
+            array of images with shape (n, height, width)
+        prng: RandomState
+            random number generator
+
+        Returns
+        -------
+        ndarray
+            array of transformed images, of the same shape and dtype
+        '''
+        n, height, width = batch.shape
+        return self.transform(batch, self.random_matrices(n, height, width, prng))
@@ -0,0 +1,717 @@
+# import libraries
+from preprocessing import load_brats, load_normal, load_dicom, pad_resize, resize_slices
+from preprocessing import get_autoencode_files, get_classifier_files, list_classifier_volumes
+from pydicom.dataset import Dataset, FileDataset
+from timeit import default_timer as timer
+from skimage.transform import resize
+from sourceindex import scan_source
+from metadata import get_metadata_sets
+from stats import standardize
+from store import save_volume, load_volume, load_slice, load_cropped, formats
+from augment import Augmenter
+from codec import codecs
+import nibabel as nib
+import pandas as pd
+import numpy as np
+import subprocess
+import argparse
+import tempfile
+import signal
+import shutil
+import json
+import math
+import time
+import sys
+import os
+
+
+# (category, site, prefix, tag, number of '-' separated parts in file names)
+categories = [('DIPG', 'Stanford', 'ST', 'DIPG', 5), ('EP', 'Stanford', 'ST', 'PF-EP', 6),
+              ('MB', 'Stanford', 'ST', 'PF-MB', 6), ('PILO', 'Stanford', 'ST', 'PF-PILO', 6),
+              ('DIPG', 'Seattle', 'SE', 'DIPG', 5), ('EP', 'Seattle', 'SE', 'PF-EP', 6),
+              ('MB', 'Seattle', 'SE', 'PF-MB', 6)]
+
+
+def legacy_resize_slices(arrs, size):
+    '''
+    Pads and resizes the slices one at a time, converting each of them to
+    nested lists, as preprocessing.py did before resize_slices.
+
+    Parameters
+    ----------
+    arrs: list
+        list of 2D slices
+    size: int
+        dimension of the resized square slices
+
+    Returns
+    -------
+    ndarray
+        array of slices with shape (slices, size, size)
+    '''
+    img = []
+    for arr in arrs:
+        dim1 = max(arr.shape) - arr.shape[0]
+        dim2 = max(arr.shape) - arr.shape[1]
+        if dim1 != 0 or dim2 != 0:
+            arr = np.pad(arr, ((math.ceil(dim1 / 2.0), math.floor(dim1 / 2.0)),
+                               (math.ceil(dim2 / 2.0), math.floor(dim2 / 2.0))),
+                         mode='constant', constant_values=0)
+        img.append(resize(arr, (size, size), mode='constant',
+                          clip=True, preserve_range=True, anti_aliasing=False).tolist())
+    return np.asarray(img)
+
+
+def time_function(function, args, repeat):
+    '''
+    Returns the best wall clock time of a function over a number of runs
+
+    Parameters
+    ----------
+    function: function
+        function to be timed
+    args: tuple
+        arguments to call the function with
+    repeat: int
+        number of runs
+
+    Returns
+    -------
+    tuple
+        (best time in seconds, result of the last run)
+    '''
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = timer()
+        result = function(*args)
+        best = min(best, timer() - start)
+    return (best, result)
+
+
+def benchmark_resize(slices, height, width, repeat):
+    '''
+    Compares the batched resize of a synthetic DICOM series against the
+    per-slice resize, and checks that both give the same output.
+
+    Parameters
+    ----------
+    slices: int
+        number of slices in the series
+    height: int
+        number of rows of each slice
+    width: int
+        number of columns of each slice
+    repeat: int
+        number of runs to take the best time of
+
+    Returns
+    -------
+    None
+    '''
+    prng = np.random.RandomState(42)
+    arrs = [(prng.rand(height, width) * 4095).astype('uint16') for _ in range(slices)]
+    legacy_time, legacy = time_function(legacy_resize_slices, (arrs, 256), repeat)
+    batched_time, batched = time_function(resize_slices, (arrs, 256), repeat)
+    print('Resize of {} slices of {}x{} to 256x256'.format(slices, height, width))
+    print('  per-slice: {:8.3f} s'.format(legacy_time))
+    print('  batched:   {:8.3f} s ({:.1f}x)'.format(batched_time, legacy_time / batched_time))
+    print('  max abs difference: {}'.format(np.abs(legacy - batched).max()))
+
+
+def benchmark_augment(batch, height, width, repeat):
+    '''
+    Compares the augmentation of a mini-batch with Augmenter against the
+    per-image keras ImageDataGenerator.random_transform of the generators,
+    and checks the warp against keras apply_transform with the same matrices.
+
+    Parameters
+    ----------
+    batch: int
+        number of images in the mini-batch
+    height: int
+        number of rows of each image
+    width: int
+        number of columns of each image
+    repeat: int
+        number of runs to take the best time of
+
+    Returns
+    -------
+    None
+    '''
+    from keras.preprocessing.image import ImageDataGenerator, apply_transform
+    ranges = {'rotation_range': 45, 'width_shift_range': 0.15, 'height_shift_range': 0.15,
+              'shear_range': 0.01, 'zoom_range': 0.1, 'cval': 0}
+    datagen = ImageDataGenerator(fill_mode='constant', **ranges)
+    augmenter = Augmenter(**ranges)
+    prng = np.random.RandomState(42)
+    imgs = (phantom((height, width, batch), prng) * 255).astype('uint8').transpose((2, 0, 1)).copy()
+
+    def per_image(imgs):
+        return np.asarray([datagen.random_transform(np.expand_dims(img, axis=-1), seed=prng.randint(0, 1000))
+                           for img in imgs])
+
+    legacy_time, _ = time_function(per_image, (imgs,), repeat)
+    batched_time, _ = time_function(augmenter.random_transform, (imgs, prng), repeat)
+    matrices = augmenter.random_matrices(batch, height, width, prng)
+    legacy = np.asarray([apply_transform(np.expand_dims(img, axis=0), matrix, channel_axis=0,
+                                         fill_mode='constant', cval=0)[0]
+                         for img, matrix in zip(imgs, matrices)])
+    batched = augmenter.transform(imgs, matrices)
+    diff = np.abs(legacy.astype('int') - batched.astype('int'))
+    print('Augmentation of {} images of {}x{}'.format(batch, height, width))
+    print('  per-image: {:8.3f} s'.format(legacy_time))
+    print('  batched:   {:8.3f} s ({:.1f}x)'.format(batched_time, legacy_time / batched_time))
+    print('  pixels differing: {} of {}, max abs difference: {}'.format(
+        np.count_nonzero(diff), diff.size, diff.max()))
+
+
+def phantom(shape, prng):
+    '''
+    Returns a synthetic scan, an ellipse of noisy tissue on a zero background
+
+    Parameters
+    ----------
+    shape: tuple
+        shape of the scan, the ellipse spans the first two dimensions
+    prng: RandomState
+        random number generator
+
+    Returns
+    -------
+    ndarray
+        array of the given shape with values in [0, 1)
+    '''
+    rows = np.linspace(-1, 1, shape[0]).reshape((-1, 1))
+    cols = np.linspace(-1, 1, shape[1]).reshape((1, -1))
+    mask = (rows / 0.8) ** 2 + (cols / 0.7) ** 2 < 1
+    mask = mask.reshape(mask.shape + (1,) * (len(shape) - 2))
+    return prng.rand(*shape) * mask
+
+
+def write_dicom(path, arr, patient, series, instance):
+    '''
+    Writes a single slice as a DICOM file
+
+    Parameters
+    ----------
+    path: str
+        path of the DICOM file
+    arr: ndarray
+        uint16 slice
+    patient: str
+        patient ID
+    series: int
+        series number
+    instance: int
+        instance number
+
+    Returns
+    -------
+    None
+    '''
+    file_meta = Dataset()
+    file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.4'
+    file_meta.MediaStorageSOPInstanceUID = '1.2.826.0.1.3680043.2.1125.{}.{}.{}'.format(
+        abs(hash(patient)) % 100000, series, instance)
+    file_meta.TransferSyntaxUID = '1.2.840.10008.1.2.1'
+    ds = FileDataset(path, {}, file_meta=file_meta, preamble=b'\0' * 128)
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.Modality = 'MR'
+    ds.PatientID = patient
+    ds.SeriesNumber = series
+    ds.InstanceNumber = instance
+    ds.Rows, ds.Columns = arr.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.PixelData = arr.astype('uint16').tobytes()
+    ds.save_as(path, write_like_original=False)
+
+
+def make_fixtures(root, series, slices, height, width, brats, normals):
+    '''
+    Generates a synthetic source directory with the same layout and file
+    naming as the private data: DICOM series and metadata workbooks for each
+    category and site, BRATS-like 4D NIfTI volumes, and Normal cohort .npz
+    volumes with their metadata CSV.
+
+    Parameters
+    ----------
+    root: str
+        directory to create the source directory in
+    series: int
+        number of DICOM series per category and site
+    slices: int
+        number of slices per DICOM series and Normal volume
+    height: int
+        number of rows of each DICOM slice
+    width: int
+        number of columns of each DICOM slice
+    brats: int
+        number of BRATS volumes, split between imagesTr and imagesTs
+    normals: int
+        number of Normal cohort volumes
+
+    Returns
+    -------
+    None
+    '''
+    prng = np.random.RandomState(42)
+    source = os.path.join(root, 'source')
+    metadata = os.path.join(source, 'katie_annotated_metadata')
+    os.makedirs(metadata)
+
+    for category, site, prefix, tag, parts in categories:
+        path = os.path.join(source, category, site, '{}_{}_T2_Axial'.format(prefix, tag), 'no_roi')
+        os.makedirs(path)
+        rows = []
+        for i in range(series):
+            patient = '{}{:04d}'.format(prefix, i) if parts == 5 else '{}-{:04d}'.format(prefix, i)
+            img = (phantom((height, width, slices), prng) * 4095).astype('uint16')
+            for k in range(slices):
+                filename = 'IM-{:04d}-{:04d}.dcm'.format(i + 1, k + 1)
+                write_dicom(os.path.join(path, '{}-{:02d}-{}'.format(patient, 1, filename)),
+                            img[:, :, k], patient, i + 1, k + 1)
+                rows.append({'Series': 'T2', 'Plane': 'Axial', 'ModelFilter': 'T2_Axial',
+                             'PID': patient, 'SID': 1, 'FileName_df': filename})
+        pd.DataFrame(rows).to_excel(os.path.join(metadata, '{}_{}_private_all_metadata_with_roi_annotated.xlsx'
+                                                 .format(prefix, tag)), index=False)
+
+    path = os.path.join(source, 'Task01_BrainTumour')
+    for i in range(brats):
+        subset = os.path.join(path, 'imagesTr' if i % 2 == 0 else 'imagesTs')
+        if not os.path.exists(subset):
+            os.makedirs(subset)
+        img = (phantom((240, 240, 155, 4), prng) * 1000).astype('int16')
+        nib.save(nib.Nifti1Image(img, np.eye(4)), os.path.join(subset, 'BRATS_{:03d}.nii.gz'.format(i)))
+
+    path = os.path.join(source, 'Normal')
+    os.makedirs(path)
+    rows = []
+    for i in range(normals):
+        np.savez_compressed(os.path.join(path, 'N{:04d}.npz'.format(i)),
+                            **{'T2 ax': phantom((256, 224, slices), prng) * 1000})
+        rows.append({'Series': 'T2', 'Plane': 'Axial', 'ModelFilter': 'T2 ax',
+                     'SeriesDescription': 'AX T2 FRFSE', 'is_Duplicate': 'NO',
+                     'Patient_ID': 'N{:04d}'.format(i)})
+    pd.DataFrame(rows).to_csv(os.path.join(source, 'flipped_clinical_NormalPedBrainAge_StanfordCohort.csv'),
+                              index=False)
+
+
+def export_series(source, category, number, slices, height, width, prng, delay):
+    '''
+    Exports a DICOM series into the source directory the way a PACS does, one
+    slice every delay seconds, and then lists it in the metadata workbook of
+    its category.
+
+    Parameters
+    ----------
+    source: str
+        path to the source directory
+    category: tuple
+        (category, site, prefix, tag, number of parts in file names), an
+        element of categories
+    number: int
+        number of the patient and series, past those of make_fixtures
+    slices: int
+        number of slices of the series
+    height: int
+        number of rows of each slice
+    width: int
+        number of columns of each slice
+    prng: RandomState
+        random number generator
+    delay: float
+        number of seconds between two slices
+
+    Returns
+    -------
+    str
+        path to the first DICOM file of the series
+    '''
+    name, site, prefix, tag, parts = category
+    path = os.path.join(source, name, site, '{}_{}_T2_Axial'.format(prefix, tag), 'no_roi')
+    patient = '{}{:04d}'.format(prefix, number) if parts == 5 else '{}-{:04d}'.format(prefix, number)
+    img = (phantom((height, width, slices), prng) * 4095).astype('uint16')
+    rows = []
+    for k in range(slices):
+        filename = 'IM-{:04d}-{:04d}.dcm'.format(number + 1, k + 1)
+        write_dicom(os.path.join(path, '{}-{:02d}-{}'.format(patient, 1, filename)),
+                    img[:, :, k], patient, number + 1, k + 1)
+        rows.append({'Series': 'T2', 'Plane': 'Axial', 'ModelFilter': 'T2_Axial',
+                     'PID': patient, 'SID': 1, 'FileName_df': filename})
+        time.sleep(delay)
+    workbook = os.path.join(source, 'katie_annotated_metadata',
+                            '{}_{}_private_all_metadata_with_roi_annotated.xlsx'.format(prefix, tag))
+    meta = pd.concat([pd.read_excel(workbook), pd.DataFrame(rows)], ignore_index=True, sort=False)
+    meta.to_excel(workbook + '.tmp.xlsx', index=False)
+    os.replace(workbook + '.tmp.xlsx', workbook)
+    return os.path.join(path, '{}-{:02d}-IM-{:04d}-{:04d}.dcm'.format(patient, 1, number + 1, 1))
+
+
+def wait_ingested(paths, ingest):
+    '''
+    Waits until the volumes of source files are recorded in the manifest
+
+    Parameters
+    ----------
+    paths: set
+        set of paths to a source file of each volume
+    ingest: Popen
+        the ingest.py process
+
+    Returns
+    -------
+    None
+    '''
+    while True:
+        sources = set()
+        if os.path.exists(os.path.join('meta', 'manifest.jsonl')):
+            with open(os.path.join('meta', 'manifest.jsonl'), 'r') as fp:
+                for line in fp:
+                    try:
+                        sources.update(x['path'] for x in json.loads(line)['sources'])
+                    except ValueError:
+                        # line being written
+                        continue
+        if paths <= sources:
+            return
+        if ingest.poll() is not None:
+            raise RuntimeError('ingest.py exited with code {}'.format(ingest.returncode))
+        time.sleep(0.1)
+
+
+def benchmark_ingest(root, series, new, slices, height, width, workers, interval, settle):
+    '''
+    Runs ingest.py on the source directory in root, and reports the time it
+    takes to ingest the volumes already there, and the latency from the
+    export of the last slice of each new series to its ingestion, while new
+    series are exported one slice at a time.
+
+    Parameters
+    ----------
+    root: str
+        directory containing the source directory
+    series: int
+        number of DICOM series per category and site already there
+    new: int
+        number of DICOM series to export
+    slices: int
+        number of slices per DICOM series
+    height: int
+        number of rows of each DICOM slice
+    width: int
+        number of columns of each DICOM slice
+    workers: int
+        number of worker processes of ingest.py
+    interval: float
+        number of seconds between two polls of ingest.py
+    settle: float
+        settling time of ingest.py
+
+    Returns
+    -------
+    None
+    '''
+    cwd = os.getcwd()
+    os.chdir(root)
+    ingest = None
+    try:
+        volumes, _, _ = list_classifier_volumes(get_metadata_sets(os.path.join(root, 'cache')),
+                                                scan_source(os.path.join(root, 'cache'), 1),
+                                                os.path.join(root, 'cache'), 1)
+        backlog = set(x[0] if isinstance(x, list) else x for x in volumes)
+        start = timer()
+        ingest = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                'ingest.py'),
+                                   '--workers', str(workers), '--interval', str(interval),
+                                   '--settle', str(settle)], stdout=subprocess.DEVNULL)
+        wait_ingested(backlog, ingest)
+        report('ingest (backlog)', timer() - start, len(backlog), 0)
+
+        prng = np.random.RandomState(7)
+        latencies = []
+        for i in range(new):
+            first = export_series('source', categories[i % len(categories)], series + i,
+                                  slices, height, width, prng, 0.01)
+            end = timer()
+            wait_ingested(set([first]), ingest)
+            latencies.append(timer() - end)
+        print('Latency of {} series of {} slices, polled every {} s, settled for {} s'.format(
+            new, slices, interval, settle))
+        print('  mean: {:8.3f} s'.format(np.mean(latencies)))
+        print('  max:  {:8.3f} s'.format(np.max(latencies)))
+    finally:
+        if ingest is not None:
+            ingest.send_signal(signal.SIGINT)
+            ingest.wait()
+        os.chdir(cwd)
+
+
+def benchmark_codecs(paths, volumes, slices, reads):
+    '''
+    Compares the storage formats and codecs on preprocessed volumes: the
+    footprint on disk, the encode and decode MB/s of whole volumes, and the
+    number of random single slices read per second, as the generators do.
+
+    Parameters
+    ----------
+    paths: list
+        list of paths to preprocessed volumes, synthetic standardized
+        volumes are generated if empty
+    volumes: int
+        number of synthetic volumes
+    slices: int
+        number of slices of each synthetic volume
+    reads: int
+        number of random slices read from each volume
+
+    Returns
+    -------
+    None
+    '''
+    prng = np.random.RandomState(42)
+    if paths:
+        imgs = [load_cropped(x)[0] for x in paths]
+    else:
+        imgs = [standardize(phantom((slices, 256, 256), prng) * 1000)[0] for _ in range(volumes)]
+    nbytes = sum(x.nbytes for x in imgs)
+    print('{} volumes, {:.1f} MB of {}'.format(len(imgs), nbytes / 2 ** 20, imgs[0].dtype))
+    print('{:<20} {:>8} {:>12} {:>12} {:>12}'.format('format', 'ratio', 'encode MB/s', 'decode MB/s',
+                                                     'slices/s'))
+
+    specs = ['npz', 'npy'] + ['vol:{}{}'.format(name, filt) for name in sorted(codecs.keys())
+                              for filt in ['', '+shuffle']]
+    output = tempfile.mkdtemp()
+    try:
+        for spec in specs:
+            start = timer()
+            files = [save_volume(os.path.join(output, '{:04d}'.format(i)), img, spec) for i, img in enumerate(imgs)]
+            encode = timer() - start
+            disk = sum(os.path.getsize(x) for x in files)
+            start = timer()
+            for filepath in files:
+                load_volume(filepath)
+            decode = timer() - start
+            planes = [(filepath, k) for filepath, img in zip(files, imgs)
+                      for k in prng.randint(0, len(img), reads)]
+            start = timer()
+            for filepath, k in planes:
+                load_slice(filepath, k)
+            read = timer() - start
+            print('{:<20} {:8.2f} {:12.1f} {:12.1f} {:12.1f}'.format(
+                spec, nbytes / float(disk), nbytes / encode / 2 ** 20, nbytes / decode / 2 ** 20,
+                len(planes) / read))
+            for filepath in files:
+                os.remove(filepath)
+    finally:
+        shutil.rmtree(output)
+
+
+def report(stage, seconds, volumes, nbytes):
+    '''
+    Prints the time, volumes/s and MB/s of a preprocessing stage
+
+    Parameters
+    ----------
+    stage: str
+        name of the stage
+    seconds: float
+        wall clock time of the stage
+    volumes: int
+        number of volumes processed by the stage
+    nbytes: int
+        number of bytes processed by the stage
+
+    Returns
+    -------
+    None
+    '''
+    print('{:<20} {:9.3f} s {:9.2f} volumes/s {:9.1f} MB/s'.format(
+        stage, seconds, volumes / seconds, nbytes / seconds / 2 ** 20))
+
+
+def benchmark_preprocessing(root):
+    '''
+    Times each stage of preprocessing.py on the source directory in root,
+    volume by volume in a single process: metadata filtering, source scan,
+    selection, decode, pad and resize, standardize, and save in each storage
+    format.
+
+    Parameters
+    ----------
+    root: str
+        directory containing the source directory
+
+    Returns
+    -------
+    None
+    '''
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        cache = os.path.join(root, 'cache')
+        paths = [os.path.join(dirpath, x) for dirpath, _, files in os.walk('source') for x in files]
+        # the metadata stages report files/s instead of volumes/s
+        metadata = [x for x in paths if x.endswith(('.xlsx', '.csv'))]
+        nbytes = sum(os.path.getsize(x) for x in metadata)
+        start = timer()
+        sets = get_metadata_sets(cache)
+        report('metadata (parse)', timer() - start, len(metadata), nbytes)
+        start = timer()
+        sets = get_metadata_sets(cache)
+        report('metadata (cached)', timer() - start, len(metadata), nbytes)
+
+        # the scan stages report files/s instead of volumes/s
+        start = timer()
+        index = scan_source(cache, 1)
+        report('scan (list)', timer() - start, len(index), 0)
+        start = timer()
+        index = scan_source(cache, 1)
+        report('scan (cached)', timer() - start, len(index), 0)
+
+        start = timer()
+        train_path, valid_path, train_type, valid_type = get_autoencode_files(sets['normal'], index)
+        autoencode = list(zip(train_path + valid_path, train_type + valid_type))
+        classifier = get_classifier_files(sets, index, cache, 1)
+        classifier = list(zip(classifier[0] + classifier[1] + classifier[2],
+                              classifier[3] + classifier[4] + classifier[5]))
+        volumes = [('autoencode', path, method) for path, method in autoencode]
+        volumes += [('classifier', path, method) for path, method in classifier]
+        report('select', timer() - start, len(volumes), 0)
+
+        timings = dict((stage, [0.0, 0]) for stage in ['decode', 'pad + resize', 'standardize'] +
+                       ['save ({})'.format(fmt) for fmt in sorted(formats.keys())])
+        output = tempfile.mkdtemp(dir=root)
+        for cnt, (pipeline, path, method) in enumerate(volumes):
+            sources = path if isinstance(path, list) else [path]
+            start = timer()
+            if pipeline == 'autoencode' and method == 1:
+                img = load_brats(path)
+            elif isinstance(path, list):
+                img = load_dicom(path)
+            else:
+                img = load_normal(path)
+            timings['decode'][0] += timer() - start
+            timings['decode'][1] += sum(os.path.getsize(x) for x in sources)
+
+            nbytes = sum(x.nbytes for x in img) if isinstance(img, list) else img.nbytes
+            start = timer()
+            if pipeline == 'autoencode' and method == 1:
+                img = resize(img, (256, 256), mode='constant', clip=True, preserve_range=True,
+                             anti_aliasing=False)
+            elif isinstance(img, list):
+                img = resize_slices(img, 256).transpose((1, 2, 0))
+            else:
+                img = pad_resize(img, 256)
+            timings['pad + resize'][0] += timer() - start
+            timings['pad + resize'][1] += nbytes
+
+            start = timer()
+            img = np.rot90(img.transpose((2, 0, 1)), axes=(2, 1))
+            img, _, _ = standardize(img)
+            timings['standardize'][0] += timer() - start
+            timings['standardize'][1] += img.nbytes
+
+            for fmt in sorted(formats.keys()):
+                start = timer()
+                filepath = save_volume(os.path.join(output, '{:04d}'.format(cnt)), img, fmt)
+                timings['save ({})'.format(fmt)][0] += timer() - start
+                timings['save ({})'.format(fmt)][1] += os.path.getsize(filepath)
+        shutil.rmtree(output)
+
+        for stage in ['decode', 'pad + resize', 'standardize'] + \
+                ['save ({})'.format(fmt) for fmt in sorted(formats.keys())]:
+            report(stage, timings[stage][0], len(volumes), timings[stage][1])
+    finally:
+        os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the preprocessing steps.')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    parser_resize = subparsers.add_parser('resize', help='batched against per-slice resize')
+    parser_resize.add_argument('--slices', type=int, default=60)
+    parser_resize.add_argument('--height', type=int, default=512)
+    parser_resize.add_argument('--width', type=int, default=448)
+    parser_resize.add_argument('--repeat', type=int, default=3)
+    parser_augment = subparsers.add_parser('augment', help='batched against per-image augmentation, '
+                                           'requires keras')
+    parser_augment.add_argument('--batch', type=int, default=48)
+    parser_augment.add_argument('--height', type=int, default=256)
+    parser_augment.add_argument('--width', type=int, default=256)
+    parser_augment.add_argument('--repeat', type=int, default=3)
+    parser_preprocessing = subparsers.add_parser('preprocessing', help='stages of preprocessing.py '
+                                                 'on synthetic DICOM, NIfTI and Normal volumes')
+    parser_preprocessing.add_argument('--series', type=int, default=10,
+                                      help='number of DICOM series per category and site, at least 10 '
+                                           'for the stratified splits to have every class')
+    parser_preprocessing.add_argument('--slices', type=int, default=30)
+    parser_preprocessing.add_argument('--height', type=int, default=512)
+    parser_preprocessing.add_argument('--width', type=int, default=448)
+    parser_preprocessing.add_argument('--brats', type=int, default=4)
+    parser_preprocessing.add_argument('--normals', type=int, default=10)
+    parser_preprocessing.add_argument('--root', default=None,
+                                      help='directory to keep the synthetic data in, '
+                                           'reused if it already contains a source directory')
+    parser_codecs = subparsers.add_parser('codecs', help='footprint and decode speed of the storage '
+                                          'formats and codecs')
+    parser_codecs.add_argument('paths', nargs='*',
+                               help='preprocessed volumes to compare the codecs on, such as '
+                                    'data/classifier/train/*.npz, synthetic volumes if none')
+    parser_codecs.add_argument('--volumes', type=int, default=8)
+    parser_codecs.add_argument('--slices', type=int, default=60)
+    parser_codecs.add_argument('--reads', type=int, default=20,
+                               help='number of random slices read from each volume')
+    parser_ingest = subparsers.add_parser('ingest', help='latency of ingest.py on synthetic DICOM series '
+                                          'exported one slice at a time')
+    parser_ingest.add_argument('--series', type=int, default=2,
+                               help='number of DICOM series per category and site already there')
+    parser_ingest.add_argument('--new', type=int, default=7, help='number of DICOM series to export')
+    parser_ingest.add_argument('--slices', type=int, default=30)
+    parser_ingest.add_argument('--height', type=int, default=512)
+    parser_ingest.add_argument('--width', type=int, default=448)
+    parser_ingest.add_argument('--workers', type=int, default=2)
+    parser_ingest.add_argument('--interval', type=float, default=1)
+    parser_ingest.add_argument('--settle', type=float, default=2)
+    parser_ingest.add_argument('--root', default=None,
+                               help='directory to keep the synthetic data in, '
+                                    'reused if it already contains a source directory')
+    args = parser.parse_args()
+
+    if args.benchmark == 'resize':
+        benchmark_resize(args.slices, args.height, args.width, args.repeat)
+    elif args.benchmark == 'augment':
+        benchmark_augment(args.batch, args.height, args.width, args.repeat)
+    elif args.benchmark == 'preprocessing':
+        root = args.root if args.root is not None else tempfile.mkdtemp()
+        root = os.path.abspath(root)
+        if not os.path.exists(os.path.join(root, 'source')):
+            print('Generating synthetic source data in {}'.format(root))
+            make_fixtures(root, args.series, args.slices, args.height, args.width,
+                          args.brats, args.normals)
+        benchmark_preprocessing(root)
+        if args.root is None:
+            shutil.rmtree(root)
+    elif args.benchmark == 'codecs':
+        benchmark_codecs(args.paths, args.volumes, args.slices, args.reads)
+    elif args.benchmark == 'ingest':
+        root = args.root if args.root is not None else tempfile.mkdtemp()
+        root = os.path.abspath(root)
+        if not os.path.exists(os.path.join(root, 'source')):
+            print('Generating synthetic source data in {}'.format(root))
+            make_fixtures(root, args.series, args.slices, args.height, args.width, 0, 2)
+        benchmark_ingest(root, args.series, args.new, args.slices, args.height, args.width,
+                         args.workers, args.interval, args.settle)
+        if args.root is None:
+            shutil.rmtree(root)
+    else:
+        parser.print_help()
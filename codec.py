@@ -0,0 +1,211 @@
+# import libraries
+import numpy as np
+import struct
+import zlib
+import json
+
+# fast codecs, only offered if installed
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+
+# compress and decompress function of each available codec
+codecs = {'none': (bytes, lambda x: x), 'zlib': (zlib.compress, zlib.decompress)}
+if lz4 is not None:
+    codecs['lz4'] = (lz4.compress, lz4.decompress)
+if zstd is not None:
+    codecs['zstd'] = (lambda x: zstd.ZstdCompressor(level=3).compress(x),
+                      lambda x: zstd.ZstdDecompressor().decompress(x))
+
+# first bytes of a .vol file, followed by the length of the header
+magic = b'BTCVOL1\n'
+
+
+def shuffle(buf, itemsize):
+    '''
+    Groups the bytes of the items of a buffer by their position in the item,
+    so that the sign and exponent bytes, which vary slowly, end up next to
+    each other and compress better.
+
+    Parameters
+    ----------
+    buf: bytes
+        buffer of items
+    itemsize: int
+        number of bytes of each item
+
+    Returns
+    -------
+    bytes
+        the shuffled buffer
+    '''
+    return np.frombuffer(buf, dtype=np.uint8).reshape((-1, itemsize)).T.tobytes()
+
+
+def unshuffle(buf, itemsize):
+    '''
+    Reverts shuffle
+
+    Parameters
+    ----------
+    buf: bytes
+        shuffled buffer of items
+    itemsize: int
+        number of bytes of each item
+
+    Returns
+    -------
+    bytes
+        the buffer of items
+    '''
+    return np.frombuffer(buf, dtype=np.uint8).reshape((itemsize, -1)).T.tobytes()
+
+
+def parse_codec(spec):
+    '''
+    Parses a codec specification, the name of the codec optionally followed
+    by '+shuffle', such as 'zstd+shuffle'
+
+    Parameters
+    ----------
+    spec: str
+        codec specification
+
+    Returns
+    -------
+    tuple
+        (name of the codec, whether to shuffle the bytes)
+    '''
+    name, _, filt = spec.partition('+')
+    if name not in codecs:
+        raise ValueError('codec {} is not available, the available codecs are {}'.format(
+            name, ', '.join(sorted(codecs.keys()))))
+    if filt not in ['', 'shuffle']:
+        raise ValueError('unknown filter {}'.format(filt))
+    return (name, filt == 'shuffle')
+
+
+def write_vol(path, img, spec, extra=None):
+    '''
+    Writes an array in the .vol container: a header recording the codec,
+    filter, dtype, shape and the offsets of the chunks, followed by each
+    slice along the first axis compressed separately, so that a single slice
+    is read and decompressed without touching the others.
+
+    Parameters
+    ----------
+    path: str
+        path to the .vol file
+    img: ndarray
+        array to write, chunked along its first axis
+    spec: str
+        codec specification
+    extra: dict or None
+        additional entries of the header, as python objects
+
+    Returns
+    -------
+    None
+    '''
+    name, shuffled = parse_codec(spec)
+    compress = codecs[name][0]
+    img = np.ascontiguousarray(img)
+    chunks = []
+    for k in range(img.shape[0]):
+        buf = img[k].tobytes()
+        if shuffled:
+            buf = shuffle(buf, img.dtype.itemsize)
+        chunks.append(compress(buf))
+    offsets = np.concatenate([[0], np.cumsum([len(x) for x in chunks])]).tolist()
+    header = dict(extra or {}, codec=name, shuffle=shuffled, dtype=img.dtype.str,
+                  shape=list(img.shape), offsets=offsets)
+    header = json.dumps(header).encode('utf-8')
+    with open(path, 'wb') as fp:
+        fp.write(magic)
+        fp.write(struct.pack('<I', len(header)))
+        fp.write(header)
+        for chunk in chunks:
+            fp.write(chunk)
+
+
+def read_header(fp):
+    '''
+    Reads the header of an opened .vol file
+
+    Parameters
+    ----------
+    fp: file
+        the .vol file opened in binary mode, at its start
+
+    Returns
+    -------
+    tuple
+        (header, position of the first chunk in the file)
+    '''
+    if fp.read(len(magic)) != magic:
+        raise IOError('{} is not a .vol file'.format(fp.name))
+    size, = struct.unpack('<I', fp.read(4))
+    return (json.loads(fp.read(size).decode('utf-8')), len(magic) + 4 + size)
+
+
+def decode_chunk(buf, header):
+    '''
+    Decompresses a chunk of a .vol file into its slice
+
+    Parameters
+    ----------
+    buf: bytes
+        the compressed chunk
+    header: dict
+        header of the .vol file
+
+    Returns
+    -------
+    ndarray
+        the slice
+    '''
+    dtype = np.dtype(header['dtype'])
+    buf = codecs[header['codec']][1](buf)
+    if header['shuffle']:
+        buf = unshuffle(buf, dtype.itemsize)
+    return np.frombuffer(buf, dtype=dtype).reshape(header['shape'][1:])
+
+
+def read_vol(path, k=None):
+    '''
+    Reads an array, or a single slice of it, from a .vol file
+
+    Parameters
+    ----------
+    path: str
+        path to the .vol file
+    k: int or None
+        index of the slice to read, None to read the whole array
+
+    Returns
+    -------
+    tuple
+        (array or slice, header of the .vol file)
+    '''
+    with open(path, 'rb') as fp:
+        header, start = read_header(fp)
+        offsets = header['offsets']
+        if k is not None:
+            fp.seek(start + offsets[k])
+            return (decode_chunk(fp.read(offsets[k + 1] - offsets[k]), header).copy(), header)
+        if header['codec'] == 'none' and not header['shuffle']:
+            # the chunks are the slices of the array, one after the other
+            img = np.fromfile(fp, dtype=np.dtype(header['dtype']), count=int(np.prod(header['shape'])))
+            return (img.reshape(header['shape']), header)
+        # chunks are sliced from the file without copying them
+        data = memoryview(fp.read())
+    img = np.empty(header['shape'], dtype=np.dtype(header['dtype']))
+    for i in range(len(img)):
+        img[i] = decode_chunk(data[offsets[i]:offsets[i + 1]], header)
+    return (img, header)
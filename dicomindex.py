@@ -0,0 +1,164 @@
+# import libraries
+from multiprocessing import Pool
+from metadata import read_cache, write_cache
+import pydicom as pdc
+import pandas as pd
+import numpy as np
+import os
+
+
+columns = ['path', 'size', 'mtime', 'valid', 'patient', 'series', 'instance',
+           'rows', 'cols', 'dtype', 'nbytes']
+
+
+def read_header(path):
+    '''
+    Reads the header of a DICOM file, without its pixel data
+
+    A file is valid if its header can be parsed and describes the pixel data
+    well enough to be decoded (rows, columns and bits allocated).
+
+    Parameters
+    ----------
+    path: str
+        path to the DICOM file
+
+    Returns
+    -------
+    tuple
+        (path, size, mtime, valid, patient ID, series instance UID,
+         instance number, rows, columns, dtype of the pixels, number of
+         bytes of pixel data)
+    '''
+    stat = os.stat(path)
+    try:
+        ds = pdc.dcmread(path, stop_before_pixels=True)
+        rows, cols, bits = int(ds.Rows), int(ds.Columns), int(ds.BitsAllocated)
+    except Exception:
+        return (path, stat.st_size, stat.st_mtime, False, '', '', 0, 0, 0, '', 0)
+    samples = int(ds.get('SamplesPerPixel', 1))
+    dtype = '{}int{}'.format('' if ds.get('PixelRepresentation', 0) == 1 else 'u', bits)
+    return (path, stat.st_size, stat.st_mtime, True, str(ds.get('PatientID', '')),
+            str(ds.get('SeriesInstanceUID', '')), int(ds.get('InstanceNumber', 0) or 0),
+            rows, cols, dtype, rows * cols * samples * bits // 8)
+
+
+def index_dicom(paths, cache_path, workers):
+    '''
+    Builds the index of the headers of DICOM files
+
+    Headers are read in a pool of worker processes, and the index is cached
+    in cache_path, so only files which are new or modified since the last
+    run have their header read. The files which no longer exist are removed
+    from the cache, which is only written when it changed.
+
+    Parameters
+    ----------
+    paths: list
+        list of paths to the DICOM files
+    cache_path: str
+        directory to store the index in
+    workers: int
+        number of worker processes
+
+    Returns
+    -------
+    DataFrame
+        index of the DICOM files with the columns in dicomindex.columns,
+        one row per path, in the order of paths
+    '''
+    cache = os.path.join(cache_path, 'dicom_index.pkl')
+    index = read_cache(cache)
+    changed = index is None
+    if index is None:
+        index = pd.DataFrame(columns=columns)
+    index = index.set_index('path', drop=False)
+
+    # keep the cached headers of the files which are not modified
+    stats = [os.stat(x) for x in paths]
+    stats = pd.DataFrame({'size': [x.st_size for x in stats], 'mtime': [x.st_mtime for x in stats]},
+                         index=pd.Index(paths, name='path'))
+    cached = index.reindex(stats.index)
+    fresh = (cached['size'] == stats['size']) & (cached['mtime'] == stats['mtime'])
+    pending = stats.index[~fresh.values].tolist()
+    # forget the files which were removed
+    others = index.index[~index.index.isin(stats.index)]
+    removed = [x for x in others if not os.path.exists(x)]
+
+    if workers > 1 and len(pending) > 1:
+        pool = Pool(workers)
+        headers = pool.map(read_header, pending, chunksize=64)
+        pool.close()
+        pool.join()
+    else:
+        headers = [read_header(x) for x in pending]
+
+    if pending or removed or changed:
+        index = pd.concat([index.drop(pending + removed, errors='ignore'),
+                           pd.DataFrame(headers, columns=columns).set_index('path', drop=False)])
+        write_cache(index.reset_index(drop=True), cache)
+    return index.loc[list(paths)].reset_index(drop=True)
+
+
+def group_volumes(files, index, order):
+    '''
+    Groups DICOM files in volumes by the patient ID and series instance UID
+    of their headers, and orders the slices of each volume by their
+    instance number
+
+    A file with an unreadable header has no patient ID or series to tell
+    its volume, so the volumes are dropped which share a file with the
+    category and file name group (patient ID and series key parsed from
+    the name) of an unreadable file, before any pixel data is decoded.
+
+    Parameters
+    ----------
+    files: DataFrame
+        DICOM files to group, with the path, the category and the file name
+        group of each file
+    index: DataFrame
+        index of the DICOM files, one row per file, in the order of files
+    order: list
+        list of categories, in the order to list their volumes in
+
+    Returns
+    -------
+    tuple
+        (list of volumes, each a list of paths to DICOM files ordered by
+         instance number, list of the categories of the volumes), the
+         volumes ordered by category then by file name group
+    '''
+    files = files[['path', 'category', 'group']].reset_index(drop=True)
+    files = files.assign(valid=index['valid'].astype(bool).values, patient=index['patient'].values,
+                         series=index['series'].values, instance=index['instance'].astype(int).values)
+    key = ['category', 'patient', 'series']
+    names = files['category'] + '/' + files['group']
+    broken = names.isin(names[~files['valid']])
+    files = files[files['valid']]
+    files = files[~broken[files.index].groupby([files[x] for x in key]).transform('any')]
+    files = files.assign(rank=files['category'].map(dict((x, i) for i, x in enumerate(order))),
+                         first=files.groupby(key)['group'].transform('min'))
+    files = files.sort_values(['rank', 'first', 'patient', 'series', 'instance', 'path'])
+    volumes = files.groupby(key, sort=False)['path'].agg(list)
+    return (volumes.tolist(), volumes.index.get_level_values('category').tolist())
+
+
+def estimate(volumes, index):
+    '''
+    Counts the volumes, slices and bytes of pixel data to decode
+
+    Parameters
+    ----------
+    volumes: list
+        list of volumes, each a list of paths to DICOM files
+    index: DataFrame
+        index of the DICOM files, containing every file of the volumes
+
+    Returns
+    -------
+    tuple
+        (number of volumes, number of slices, number of bytes)
+    '''
+    paths = [x for volume in volumes for x in volume]
+    nbytes = index.loc[index['path'].isin(paths), 'nbytes'].astype(int).sum()
+    return (len(volumes), len(paths), int(nbytes))
@@ -1,41 +1,135 @@
 # import libraries
-from keras.preprocessing.image import ImageDataGenerator
 from keras.preprocessing.sequence import pad_sequences
 from keras.utils import Sequence, to_categorical
+from lazy import materialize
+from store import load_volume, pyramid_path, levels
+from sliceindex import SliceIndex
+from volumecache import VolumeCache
+from sampler import volume_ids, block_shuffle
+from augment import Augmenter
 import numpy as np
+import itertools
 import os
 
 
+def lookup_table(pre):
+    '''
+    Returns the input of the network for each of the 256 grayscale levels,
+    the level broadcast to the 3 channels and passed through the
+    preprocessing function, so that a uint8 slice is turned into the input
+    of the network with a single lookup
+
+    The keras preprocess_input functions (caffe mean subtraction, tf
+    scaling to [-1, 1] and torch normalization) map each value of each
+    channel independently, so the table gives the same values as
+    preprocessing the slices themselves.
+
+    Parameters
+    ----------
+    pre: function
+        preprocessing function of the transfer learning layers
+
+    Returns
+    -------
+    ndarray
+        float32 array with shape (256, 3)
+    '''
+    levels = np.repeat(np.arange(256, dtype=np.float32).reshape((1, 1, 256, 1)), 3, axis=-1)
+    return np.ascontiguousarray(pre(levels), dtype=np.float32).reshape((256, 3))
+
+
 # AutoEncoder Generator
+def check_level(files, img_size, recipe):
+    '''
+    Checks that the slices of every volume can be read at img_size, before
+    a worker process fails to open a level of the slice pyramid which was
+    never saved
+
+    Parameters
+    ----------
+    files: list or SliceIndex
+        rows of the meta file of the slices
+    img_size: int
+        size of the slices to read, one of levels
+    recipe: dict or None
+        recipe of the volumes preprocessed lazily, None if all the
+        volumes are preprocessed
+
+    Returns
+    -------
+    None
+    '''
+    if img_size == levels[0]:
+        return
+    if recipe is not None:
+        raise ValueError('the volumes are preprocessed lazily, with slices of size {} only, '
+                         'run preprocessing.py --pyramid without --lazy to read slices of '
+                         'size {}'.format(levels[0], img_size))
+    if isinstance(files, SliceIndex):
+        paths = files.paths
+    else:
+        paths = sorted(set(row[0] for row in files))
+    missing = [path for path in paths if not os.path.exists(pyramid_path(path, img_size))]
+    if missing:
+        raise ValueError('{} of {} volumes have no slices of size {}, such as {}, '
+                         'run preprocessing.py --pyramid to save them'.format(
+                             len(missing), len(paths), img_size, missing[0]))
+
+
 class AutoEncoderGenerator(Sequence):
-    def __init__(self, pre, files, min_max, batch_size, img_size, shuffle, augment):
+    def __init__(self, pre, files, min_max, batch_size, img_size, shuffle, augment, recipe=None,
+                 cache_size=0, window=0, buffers=0):
         '''
         Init method for AutoEncoderGenerator class
 
         Parameters
         ----------
         pre: function
-            preprocessing function to be applied to each input
-        files: list
-            list of files to be read and fed in batches to the models
+            preprocessing function to be applied to each input,
+            which must map each value of each channel independently,
+            as the keras preprocess_input functions do
+        files: list or SliceIndex
+            rows of the meta file of the slices to be read and fed in
+            batches to the models
         min_max: dict
             dictionary of the min and max of training dataset.
             Used for Normalization.
         batch_size: int
             size of the mini-batches
         img_size: int
-            size of the square image to feed the network
+            size of the square image to feed the network, the slices
+            are read from the level of the slice pyramid of that size,
+            which raises ValueError if the level was not saved
         shuffle: boolean
             whether to shuffle the files after each epoch
         augment: boolean
             whether to augment the individual images before
             feeding them to the models
+        recipe: dict or None
+            recipe of the volumes preprocessed lazily, on their
+            first read, None if all the volumes are preprocessed
+        cache_size: int
+            number of bytes of decoded volumes to keep in memory in each
+            process, so that their slices are read without decoding the
+            volume again, 0 to read every slice from its file
+        window: int
+            number of volumes whose slices are shuffled together, after
+            shuffling the order of the volumes, so that a mini-batch
+            reads a few volumes, 0 to shuffle all the slices together
+        buffers: int
+            number of mini-batch arrays reused in turn, 0 to allocate
+            new arrays for every mini-batch. A mini-batch is overwritten
+            once its arrays come round again, so there must be more
+            buffers than the mini-batches held at once by the caller: 1
+            when fit_generator runs the generator in worker processes,
+            max_queue_size + 2 when it runs it in threads
 
         Returns
         -------
         None
         '''
-        self.preprocess = pre
+        check_level(files, img_size, recipe)
+        self.lut = lookup_table(pre)
         self.files = files
         self.batch_size = batch_size
         self.img_size = img_size
@@ -44,19 +138,29 @@ class AutoEncoderGenerator(Sequence):
         # random seed
         self.prng = np.random.RandomState(42)
         # data augmentation object
-        self.datagen = ImageDataGenerator(rotation_range=45,
-                                          width_shift_range=0.15,
-                                          height_shift_range=0.15,
-                                          shear_range=0.01,
-                                          fill_mode='constant', cval=0,
-                                          zoom_range=0.1)
+        self.datagen = Augmenter(rotation_range=45,
+                                 width_shift_range=0.15,
+                                 height_shift_range=0.15,
+                                 shear_range=0.01,
+                                 cval=0,
+                                 zoom_range=0.1)
         self.min = min_max['min']
         self.max = min_max['max']
+        self.recipe = recipe
+        self.cache = VolumeCache(cache_size)
+        self.window = window
+        self.volumes = volume_ids(files) if window > 0 else None
+        # float32 inputs and targets, reused across the mini-batches
+        shape = (batch_size, img_size, img_size)
+        self.buffers = [(np.empty(shape + (3,), dtype=np.float32), np.empty(shape + (1,), dtype=np.float32))
+                        for _ in range(buffers)]
+        self.turn = itertools.count()
         self.on_epoch_end()
 
     def on_epoch_end(self):
         '''
-        Shuffles the index to files if shuffle is True
+        Shuffles the index to files if shuffle is True, by windows
+        of volumes if window is given
 
         Parameters
         ----------
@@ -67,7 +171,9 @@ class AutoEncoderGenerator(Sequence):
         None
         '''
         self.indexes = np.arange(len(self.files))
-        if self.shuffle == True:
+        if self.shuffle == True and self.window > 0:
+            self.indexes = block_shuffle(self.volumes, self.window, self.prng)
+        elif self.shuffle == True:
             self.prng.shuffle(self.indexes)
 
     def __len__(self):
@@ -103,70 +209,117 @@ class AutoEncoderGenerator(Sequence):
         list_files_temp = [self.files[k] for k in indexes]
         return self.__data_generation(list_files_temp)
 
+    def __buffer(self):
+        if not self.buffers:
+            shape = (self.batch_size, self.img_size, self.img_size)
+            return (np.empty(shape + (3,), dtype=np.float32), np.empty(shape + (1,), dtype=np.float32))
+        return self.buffers[next(self.turn) % len(self.buffers)]
+
     def __data_generation(self, files):
-        X = np.empty((self.batch_size, self.img_size, self.img_size, 3))
-        Y = np.empty((self.batch_size, self.img_size, self.img_size, 1))
+        X, Y = self.__buffer()
+        imgs = np.empty((self.batch_size, self.img_size, self.img_size), dtype='uint8')
         for i, row in enumerate(files):
-            img = np.load(row[0])['data'][row[1]]
-            img = (img - self.min) * 255.0 / (self.max - self.min)
-            img = np.expand_dims(img, axis=-1).astype('uint8')
-            if self.augment:
-                seed = self.prng.randint(0, 1000)
-                img = self.datagen.random_transform(img, seed=seed)
-            Y[i] = img / 255.0
-            X[i] = np.repeat(img, 3, axis=-1)
-        return (self.preprocess(X), Y)
+            materialize(row[0], self.recipe)
+            img = self.cache.load_slice(pyramid_path(row[0], self.img_size), row[1])
+            if img.dtype != np.uint8:
+                # slices quantized in preprocessing are already scaled
+                img = (img - self.min) * 255.0 / (self.max - self.min)
+            if self.recipe is not None:
+                # the minima and maxima are only estimated in lazy mode
+                img = np.clip(img, 0, 255)
+            imgs[i] = img.astype('uint8')
+        if self.augment:
+            # the slices of the mini-batch are augmented at once
+            imgs = self.datagen.random_transform(imgs, self.prng)
+        # the slices are preprocessed and broadcast to the 3 channels
+        np.take(self.lut, imgs, axis=0, out=X, mode='clip')
+        np.divide(np.expand_dims(imgs, axis=-1), np.float32(255.0), out=Y)
+        return (X, Y)
 
 
 # Classifier Generator
 class ClassifierGenerator(Sequence):
-    def __init__(self, pre, files, min_max, batch_size, img_size, shuffle, augment):
+    def __init__(self, pre, files, min_max, batch_size, img_size, shuffle, augment, recipe=None,
+                 cache_size=0, window=0, buffers=0):
         '''
         Init method for AutoEncoderGenerator class
 
         Parameters
         ----------
         pre: function
-            preprocessing function to be applied to each input
-        files: list
-            list of files to be read and fed in batches to the models
+            preprocessing function to be applied to each input,
+            which must map each value of each channel independently,
+            as the keras preprocess_input functions do
+        files: list or SliceIndex
+            rows of the meta file of the slices to be read and fed in
+            batches to the models
         min_max: dict
             dictionary of the min and max of training dataset.
             Used for Normalization.
         batch_size: int
             size of the mini-batches
         img_size: int
-            size of the square image to feed the network
+            size of the square image to feed the network, the slices
+            are read from the level of the slice pyramid of that size,
+            which raises ValueError if the level was not saved
         shuffle: boolean
             whether to shuffle the files after each epoch
         augment: boolean
             whether to augment the individual images before
             feeding them to the models
+        recipe: dict or None
+            recipe of the volumes preprocessed lazily, on their
+            first read, None if all the volumes are preprocessed
+        cache_size: int
+            number of bytes of decoded volumes to keep in memory in each
+            process, so that their slices are read without decoding the
+            volume again, 0 to read every slice from its file
+        window: int
+            number of volumes whose slices are shuffled together, after
+            shuffling the order of the volumes, so that a mini-batch
+            reads a few volumes, 0 to shuffle all the slices together
+        buffers: int
+            number of mini-batch arrays reused in turn, 0 to allocate
+            new arrays for every mini-batch. A mini-batch is overwritten
+            once its arrays come round again, so there must be more
+            buffers than the mini-batches held at once by the caller: 1
+            when fit_generator runs the generator in worker processes,
+            max_queue_size + 2 when it runs it in threads
 
         Returns
         -------
         None
         '''
-        self.preprocess = pre
+        check_level(files, img_size, recipe)
+        self.lut = lookup_table(pre)
         self.files = files
         self.batch_size = batch_size
         self.img_size = img_size
         self.shuffle = shuffle
         self.augment = augment
         self.prng = np.random.RandomState(42)
-        self.datagen = ImageDataGenerator(rotation_range=45,
-                                          width_shift_range=0.15,
-                                          height_shift_range=0.15,
-                                          shear_range=0.01,
-                                          fill_mode='constant', cval=0,
-                                          zoom_range=0.1)
+        self.datagen = Augmenter(rotation_range=45,
+                                 width_shift_range=0.15,
+                                 height_shift_range=0.15,
+                                 shear_range=0.01,
+                                 cval=0,
+                                 zoom_range=0.1)
         self.min = min_max['min']
         self.max = min_max['max']
+        self.recipe = recipe
+        self.cache = VolumeCache(cache_size)
+        self.window = window
+        self.volumes = volume_ids(files) if window > 0 else None
+        # float32 inputs, reused across the mini-batches
+        shape = (batch_size, img_size, img_size, 3)
+        self.buffers = [np.empty(shape, dtype=np.float32) for _ in range(buffers)]
+        self.turn = itertools.count()
         self.on_epoch_end()
 
     def on_epoch_end(self):
         '''
-        Shuffles the index to files if shuffle is True
+        Shuffles the index to files if shuffle is True, by windows
+        of volumes if window is given
 
         Parameters
         ----------
@@ -177,7 +330,9 @@ class ClassifierGenerator(Sequence):
         None
         '''
         self.indexes = np.arange(len(self.files))
-        if self.shuffle == True:
+        if self.shuffle == True and self.window > 0:
+            self.indexes = block_shuffle(self.volumes, self.window, self.prng)
+        elif self.shuffle == True:
             self.prng.shuffle(self.indexes)
 
     def __len__(self):
@@ -213,19 +368,32 @@ class ClassifierGenerator(Sequence):
         list_files_temp = [self.files[k] for k in indexes]
         return self.__data_generation(list_files_temp)
 
+    def __buffer(self):
+        if not self.buffers:
+            return np.empty((self.batch_size, self.img_size, self.img_size, 3), dtype=np.float32)
+        return self.buffers[next(self.turn) % len(self.buffers)]
+
     def __data_generation(self, files):
-        X = np.empty((self.batch_size, self.img_size, self.img_size, 3))
+        X = self.__buffer()
         Y = np.empty((self.batch_size))
+        imgs = np.empty((self.batch_size, self.img_size, self.img_size), dtype='uint8')
         for i, row in enumerate(files):
-            img = np.load(row[0])['data'][row[1]]
-            img = (img - self.min) * 255.0 / (self.max - self.min)
-            img = np.expand_dims(img, axis=-1).astype('uint8')
-            if self.augment:
-                seed = self.prng.randint(0, 1000)
-                img = self.datagen.random_transform(img, seed=seed)
-            X[i] = np.repeat(img, 3, axis=-1)
+            materialize(row[0], self.recipe)
+            img = self.cache.load_slice(pyramid_path(row[0], self.img_size), row[1])
+            if img.dtype != np.uint8:
+                # slices quantized in preprocessing are already scaled
+                img = (img - self.min) * 255.0 / (self.max - self.min)
+            if self.recipe is not None:
+                # the minima and maxima are only estimated in lazy mode
+                img = np.clip(img, 0, 255)
+            imgs[i] = img.astype('uint8')
             Y[i] = row[2]
-        return (self.preprocess(X), to_categorical(Y, num_classes=5))
+        if self.augment:
+            # the slices of the mini-batch are augmented at once
+            imgs = self.datagen.random_transform(imgs, self.prng)
+        # the slices are preprocessed and broadcast to the 3 channels
+        np.take(self.lut, imgs, axis=0, out=X, mode='clip')
+        return (X, to_categorical(Y, num_classes=5))
 
 
 # Paraclassifier Generator
@@ -310,7 +478,7 @@ class ParaclassifierGenerator(Sequence):
         Y = np.empty((self.batch_size))
         if self.key != 'ensemble':
             for i, row in enumerate(files):
-                X.append(np.load(row[0].format(self.key))['data'].tolist())
+                X.append(load_volume(row[0].format(self.key)).tolist())
                 Y[i] = row[1]
         else:
             keys = ['densenet', 'inceptionresnet', 'inception',
@@ -319,9 +487,9 @@ class ParaclassifierGenerator(Sequence):
                 T = None
                 for key in keys:
                     if T is None:
-                        T = np.load(row[0].format(key))['data']
+                        T = load_volume(row[0].format(key))
                     else:
-                        T += np.load(row[0].format(key))['data']
+                        T += load_volume(row[0].format(key))
                 T /= len(keys)
                 X.append(T.tolist())
                 Y[i] = row[1]
@@ -0,0 +1,395 @@
+# import libraries
+from preprocessing import list_classifier_volumes, materialize_volume, prepare_folders
+from preprocessing import read_classifier, meta_lines, pyramid_split, classifier_path
+from metadata import get_metadata_sets
+from sourceindex import scan_source
+from sliceindex import index_meta
+from manifest import Manifest, record_key
+from stats import combine, empty, save_stats
+from multiprocessing import Pool
+from store import formats, store_format, extension, levels
+from codec import codecs, parse_codec
+import pandas as pd
+import argparse
+import hashlib
+import shutil
+import time
+import json
+import os
+
+
+meta_path = 'meta'
+cache_path = os.path.join('data', 'cache')
+lock_path = os.path.join(meta_path, 'ingest.lock')
+
+# partitions and their share of the tenths of the hash of a volume, the same
+# 80-10-10 split as preprocessing.py
+splits = [('train', 8), ('valid', 1), ('test', 1)]
+
+
+def assign_split(sources):
+    '''
+    Assigns a volume to a partition from the hash of the paths to its source
+    files, so that a volume always lands in the same partition whatever the
+    order in which the volumes arrive.
+
+    Parameters
+    ----------
+    sources: list
+        list of paths to the source files of the volume
+
+    Returns
+    -------
+    str
+        name of the partition
+    '''
+    digest = hashlib.sha1('\n'.join(sorted(sources)).encode('utf-8')).hexdigest()
+    tenth = int(digest[:8], 16) % 10
+    for split, share in splits:
+        if tenth < share:
+            return split
+        tenth -= share
+
+
+def ingest_volume(task):
+    '''
+    Preprocesses a volume in a worker process, catching the errors of
+    unreadable source files so that they do not stop the ingestion.
+
+    Parameters
+    ----------
+    task: tuple
+        the task of materialize_volume
+
+    Returns
+    -------
+    tuple
+        (result of materialize_volume or None, error message or None)
+    '''
+    try:
+        return (materialize_volume(task), None)
+    except Exception as e:
+        return (None, '{}: {}'.format(type(e).__name__, e))
+
+
+def append_meta(path, lines):
+    '''
+    Appends lines to a meta file, by writing the whole file anew and renaming
+    it over the old one, so that readers never see a partially written line,
+    and indexes it again.
+
+    Parameters
+    ----------
+    path: str
+        path to the meta file
+    lines: list
+        list of lines to append
+
+    Returns
+    -------
+    None
+    '''
+    with open(path + '.tmp', 'w') as fp:
+        if os.path.exists(path):
+            with open(path, 'r') as src:
+                shutil.copyfileobj(src, fp)
+        else:
+            fp.write('filepath, plane, class\n')
+        fp.writelines(lines)
+    os.replace(path + '.tmp', path)
+    index_meta(path)
+
+
+class Ingester(object):
+    def __init__(self, options):
+        '''
+        Init method for Ingester class
+
+        The ingester polls the source directories for new Classifier volumes,
+        preprocesses each volume once its files stopped changing, and appends
+        it to its partition. It is the single writer of the Classifier meta
+        files and of the manifest while it runs.
+
+        Parameters
+        ----------
+        options: Namespace
+            command line options, the number of worker processes, the storage
+            format, whether to crop the volumes, whether to save their slice
+            pyramid, the minimum fraction of foreground pixels of the slices
+            and the settling time
+
+        Returns
+        -------
+        None
+        '''
+        self.options = options
+        prepare_folders(meta_path)
+        self.manifest = Manifest(os.path.join(meta_path, 'manifest.jsonl'))
+
+        # outputs already listed in the meta files
+        listed = dict((split, []) for split, _ in splits)
+        for split, _ in splits:
+            path = os.path.join(meta_path, 'clf_{}.csv'.format(split))
+            if os.path.exists(path):
+                listed[split] = pd.read_csv(path).iloc[:, 0].unique().tolist()
+        if any(x.endswith('.u8.npy') for outputs in listed.values() for x in outputs):
+            raise ValueError('the meta files list quantized volumes, run preprocessing.py again '
+                             'without --quantize before ingesting')
+        records = [self.manifest.records[x] for outputs in listed.values() for x in outputs
+                   if x in self.manifest.records]
+        # the Classifier volumes whose slices were all dropped as blank are
+        # only in the manifest
+        directories = [os.path.join(classifier_path, split) for split, _ in splits]
+        records += [record for output, record in self.manifest.records.items()
+                    if os.path.dirname(output) in directories and 'reader' in record['params']]
+        # source files of the volumes already ingested or preprocessed
+        self.known = set(frozenset(x['path'] for x in record['sources']) for record in records)
+
+        self.stats = empty()
+        for output in listed['train']:
+            if output in self.manifest.records:
+                self.stats = combine(self.stats, self.manifest.records[output]['stats'])
+
+        # next number of the volumes of each partition
+        self.numbers = {}
+        for split, _ in splits:
+            names = [x.split('.')[0] for x in os.listdir(os.path.join(classifier_path, split))]
+            self.numbers[split] = max([int(x) + 1 for x in names if x.isdigit()] + [0])
+
+        # signatures of the new volumes at the last poll
+        self.seen = {}
+        # signatures of the volumes which failed, retried once modified
+        self.failed = {}
+        # volumes being preprocessed
+        self.running = {}
+        self.pool = Pool(options.workers)
+
+    def poll(self):
+        '''
+        Lists the new Classifier volumes with the same metadata filter and
+        grouping as preprocessing.py, and returns those whose files did not
+        change since the last poll and for at least the settling time.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list
+            list of (path, type, source paths, signature) of the volumes
+            ready to be preprocessed
+        '''
+        sets = get_metadata_sets(cache_path)
+        index = scan_source(cache_path, self.options.workers)
+        # the DICOM volumes with an unreadable header are left out
+        volumes, types, _ = list_classifier_volumes(sets, index, cache_path, 1)
+
+        seen = {}
+        ready = []
+        now = time.time()
+        for path, method in zip(volumes, types):
+            sources = path if isinstance(path, list) else [path]
+            key = frozenset(sources)
+            if key in self.known or key in self.running:
+                continue
+            try:
+                signature = tuple((os.stat(x).st_size, os.stat(x).st_mtime) for x in sources)
+            except OSError:
+                # removed since the source directories were listed
+                continue
+            if self.failed.get(key) == signature:
+                continue
+            seen[key] = signature
+            if self.seen.get(key) == signature and now - max(x[1] for x in signature) >= self.options.settle:
+                ready.append((path, method, sources, signature))
+        self.seen = seen
+        return ready
+
+    def submit(self, ready):
+        '''
+        Numbers the volumes ready to be preprocessed in their partitions and
+        hands them over to the worker processes.
+
+        Parameters
+        ----------
+        ready: list
+            list of (path, type, source paths, signature) of the volumes
+
+        Returns
+        -------
+        None
+        '''
+        ext = extension(self.options.store)
+        for path, method, sources, signature in ready:
+            split = assign_split(sources)
+            filepath = os.path.join(classifier_path, split, '{:04d}'.format(self.numbers[split]))
+            self.numbers[split] += 1
+            params = {'reader': read_classifier.__name__, 'method': int(method), 'store': self.options.store}
+            if self.options.crop:
+                params['crop'] = True
+            task = (read_classifier, path, method, filepath, self.options.store, self.options.crop)
+            self.running[frozenset(sources)] = (self.pool.apply_async(ingest_volume, (task,)), split,
+                                                filepath + ext, sources, params, signature)
+
+    def collect(self):
+        '''
+        Appends the volumes preprocessed by the worker processes to the meta
+        files and the manifest, and updates the minima, maxima and statistics
+        of the training partition.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int
+            number of volumes appended
+        '''
+        appended = 0
+        for key in [x for x in self.running if self.running[x][0].ready()]:
+            result, split, output, sources, params, signature = self.running.pop(key)
+            result, error = result.get()
+            if error is not None:
+                print('Skipping {}: {}'.format(sources[0], error))
+                self.failed[key] = signature
+                continue
+            slices, stats, signatures, fractions = result
+            record = {'output': output, 'key': record_key(sources, params),
+                      'sources': signatures, 'params': params,
+                      'slices': slices, 'min': stats['min'], 'max': stats['max'],
+                      'stats': stats, 'foreground': fractions}
+            self.manifest.add(record)
+            if self.options.pyramid:
+                # the levels are in place before the slices are listed
+                pyramid_split([record], self.options, self.manifest)
+            append_meta(os.path.join(meta_path, 'clf_{}.csv'.format(split)),
+                        meta_lines([record], [params['method']], True, self.options.drop_blank))
+            if split == 'train':
+                self.stats = combine(self.stats, stats)
+                self.save_meta()
+            self.known.add(key)
+            appended += 1
+            print('Ingested {} as {} ({} slices)'.format(sources[0], output, slices))
+        return appended
+
+    def save_meta(self):
+        '''
+        Saves the minima and maxima of the training partition in
+        clf_meta.json and its statistics in clf_stats.json, replacing the
+        files at once.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        path = os.path.join(meta_path, 'clf_meta.json')
+        with open(path + '.tmp', 'w') as fp:
+            json.dump({'min': self.stats['min'], 'max': self.stats['max']}, fp)
+        os.replace(path + '.tmp', path)
+        path = os.path.join(meta_path, 'clf_stats.json')
+        save_stats(path + '.tmp', self.stats)
+        os.replace(path + '.tmp', path)
+
+    def run(self, interval, once):
+        '''
+        Polls the source directories every interval seconds until
+        interrupted, or until no new volume is left if once is True.
+
+        Parameters
+        ----------
+        interval: float
+            number of seconds between two polls
+        once: boolean
+            whether to stop once every new volume is ingested
+
+        Returns
+        -------
+        None
+        '''
+        while True:
+            self.collect()
+            try:
+                self.submit(self.poll())
+            except Exception as e:
+                # metadata or source files being written, retried next poll
+                print('Poll failed: {}: {}'.format(type(e).__name__, e))
+            if once and not self.seen and not self.running:
+                break
+            time.sleep(interval)
+
+    def close(self):
+        '''
+        Waits for the volumes being preprocessed, appends them, and stops
+        the worker processes.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        self.pool.close()
+        self.pool.join()
+        self.collect()
+        self.manifest.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Watch the source directories and preprocess the new '
+                                                 'Classifier volumes as they arrive.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes to preprocess the volumes with')
+    parser.add_argument('--store', choices=sorted(formats.keys()), default='npz',
+                        help='storage format of the preprocessed volumes')
+    parser.add_argument('--codec', default='zlib',
+                        help='codec of the vol storage format, one of {}, optionally followed by '
+                             '+shuffle to shuffle the bytes before compressing them'
+                             .format(', '.join(sorted(codecs.keys()))))
+    parser.add_argument('--crop', action='store_true',
+                        help='save only the box of each volume outside which every slice is zero')
+    parser.add_argument('--pyramid', action='store_true',
+                        help='also save every volume with slices of {}, next to it'
+                             .format(' and '.join('{0}x{0}'.format(x) for x in levels[1:])))
+    parser.add_argument('--drop-blank', type=float, default=None, metavar='FRACTION',
+                        help='leave the slices with a smaller fraction of foreground pixels out of '
+                             'the meta files')
+    parser.add_argument('--interval', type=float, default=10,
+                        help='number of seconds between two polls of the source directories')
+    parser.add_argument('--settle', type=float, default=30,
+                        help='number of seconds the files of a volume must be left unchanged for '
+                             'before it is ingested')
+    parser.add_argument('--once', action='store_true',
+                        help='stop once every new volume is ingested instead of watching')
+    args = parser.parse_args()
+    try:
+        parse_codec(args.codec)
+    except ValueError as e:
+        parser.error(str(e))
+    args.store = store_format(args.store, args.codec)
+
+    if not os.path.exists(meta_path):
+        os.makedirs(meta_path)
+    try:
+        lock = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        parser.error('{} exists, another ingest.py is running or was killed, in which case '
+                     'remove the file'.format(lock_path))
+    os.write(lock, str(os.getpid()).encode('utf-8'))
+    os.close(lock)
+    try:
+        ingester = Ingester(args)
+        try:
+            ingester.run(args.interval, args.once)
+        except KeyboardInterrupt:
+            pass
+        ingester.close()
+    finally:
+        os.remove(lock_path)
@@ -0,0 +1,52 @@
+# import libraries
+import json
+import os
+
+
+def load_recipe(recipe_path):
+    '''
+    Loads the recipe file written by preprocessing.py in lazy mode
+
+    Parameters
+    ----------
+    recipe_path: str
+        path to the recipe file
+
+    Returns
+    -------
+    dict or None
+        the recipe of each lazily preprocessed volume, keyed by its path,
+        None if preprocessing.py did not run in lazy mode
+    '''
+    if not os.path.exists(recipe_path):
+        return None
+    with open(recipe_path, 'r') as fp:
+        return json.load(fp)
+
+
+def materialize(path, recipe):
+    '''
+    Preprocesses a volume from its recipe, unless it is already preprocessed,
+    and persists it at its path, so it is preprocessed only once across
+    epochs, generators and worker processes.
+
+    Parameters
+    ----------
+    path: str
+        path to the volume
+    recipe: dict or None
+        the recipe of each lazily preprocessed volume, keyed by its path
+
+    Returns
+    -------
+    None
+    '''
+    if recipe is None or path not in recipe or os.path.exists(path):
+        return
+    # the preprocessing stack is only imported once a volume is preprocessed,
+    # not by every script which builds a generator
+    from preprocessing import materialize_volume, read_autoencode, read_classifier
+    readers = {'read_autoencode': read_autoencode, 'read_classifier': read_classifier}
+    volume = recipe[path]
+    materialize_volume((readers[volume['reader']], volume['sources'], volume['method'],
+                        os.path.splitext(path)[0], volume['store'], volume['crop']))
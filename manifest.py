@@ -0,0 +1,216 @@
+# import libraries
+import hashlib
+import json
+import os
+
+
+def file_hash(path):
+    '''
+    Returns the SHA-1 digest of the contents of a file
+
+    Parameters
+    ----------
+    path: str
+        path to the file
+
+    Returns
+    -------
+    str
+        hexadecimal SHA-1 digest of the file
+    '''
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def file_signature(path):
+    '''
+    Returns the size, modification time and SHA-1 digest of a source file
+
+    Parameters
+    ----------
+    path: str
+        path to the file
+
+    Returns
+    -------
+    dict
+        dictionary with the path, size, mtime and sha1 of the file
+    '''
+    stat = os.stat(path)
+    return {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'sha1': file_hash(path)}
+
+
+def record_key(sources, params):
+    '''
+    Returns the key identifying a preprocessed volume by its source files
+    and preprocessing parameters
+
+    Parameters
+    ----------
+    sources: list
+        list of paths to the source files of the volume
+    params: dict
+        preprocessing parameters of the volume
+
+    Returns
+    -------
+    str
+        key of the volume
+    '''
+    return json.dumps([sorted(sources), params], sort_keys=True)
+
+
+class Manifest(object):
+    def __init__(self, path):
+        '''
+        Init method for Manifest class
+
+        The manifest records, for each preprocessed output file, the
+        signatures of its source files, the preprocessing parameters and
+        the number of slices, minima and maxima of the volume. Records are
+        appended one JSON object per line as soon as a volume is saved, so
+        a crashed run can resume from the volumes already completed.
+
+        Parameters
+        ----------
+        path: str
+            path to the manifest file
+
+        Returns
+        -------
+        None
+        '''
+        self.path = path
+        # output path -> record
+        self.records = {}
+        # record key -> record
+        self.keys = {}
+        lines = []
+        if os.path.exists(path):
+            with open(path, 'r') as fp:
+                lines = fp.read().split('\n')
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # empty or partially written line of a crashed run
+                continue
+            self.__index(record)
+        self.fp = open(path, 'a')
+        if lines and lines[-1] != '':
+            self.fp.write('\n')
+
+    def __index(self, record):
+        old = self.records.get(record['output'])
+        if old is not None and self.keys.get(old['key']) is old:
+            del self.keys[old['key']]
+        self.records[record['output']] = record
+        self.keys[record['key']] = record
+
+    def lookup(self, sources, params):
+        '''
+        Returns the record of an existing output file preprocessed from the
+        same, unchanged, source files with the same parameters
+
+        A source file is unchanged if its size and mtime match the record,
+        or if only its mtime changed and its SHA-1 digest still matches. The
+        output file must not have been written since it was recorded.
+
+        Parameters
+        ----------
+        sources: list
+            list of paths to the source files of the volume
+        params: dict
+            preprocessing parameters of the volume
+
+        Returns
+        -------
+        dict or None
+            the record if the volume can be reused, None otherwise
+        '''
+        record = self.keys.get(record_key(sources, params))
+        if record is None or not os.path.exists(record['output']):
+            return None
+        mtime = os.stat(record['output']).st_mtime
+        if record.get('mtime', mtime) != mtime:
+            # overwritten since it was recorded
+            return None
+        for source in record['sources']:
+            if not os.path.exists(source['path']):
+                return None
+            stat = os.stat(source['path'])
+            if stat.st_size != source['size']:
+                return None
+            if stat.st_mtime != source['mtime'] and file_hash(source['path']) != source['sha1']:
+                return None
+        return record
+
+    def add(self, record):
+        '''
+        Appends a record to the manifest, along with the modification time
+        of its output file
+
+        Parameters
+        ----------
+        record: dict
+            dictionary with the output, key, sources, params, slices,
+            min and max of a preprocessed volume
+
+        Returns
+        -------
+        None
+        '''
+        if os.path.exists(record['output']):
+            record['mtime'] = os.stat(record['output']).st_mtime
+        self.__index(record)
+        self.fp.write(json.dumps(record) + '\n')
+        self.fp.flush()
+
+    def move(self, record, output):
+        '''
+        Renames the output file of a record, along with its .json sidecar
+        file if any, and records the new location
+
+        Parameters
+        ----------
+        record: dict
+            record of the output file to be moved
+        output: str
+            new path of the output file
+
+        Returns
+        -------
+        dict
+            the record of the moved output file
+        '''
+        os.replace(record['output'], output)
+        if os.path.exists(record['output'] + '.json'):
+            os.replace(record['output'] + '.json', output + '.json')
+        del self.records[record['output']]
+        record = dict(record, output=output)
+        self.add(record)
+        return record
+
+    def close(self):
+        '''
+        Rewrites the manifest with only the current record of each output
+        file and closes it
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        self.fp.close()
+        with open(self.path + '.tmp', 'w') as fp:
+            for output in sorted(self.records.keys()):
+                if os.path.exists(output):
+                    fp.write(json.dumps(self.records[output]) + '\n')
+        os.replace(self.path + '.tmp', self.path)
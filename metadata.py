@@ -0,0 +1,162 @@
+# import libraries
+import pandas as pd
+import os
+
+
+metadata_path = os.path.join('source', 'katie_annotated_metadata')
+normal_path = os.path.join('source', 'flipped_clinical_NormalPedBrainAge_StanfordCohort.csv')
+
+# (category key, workbook, number of '-' separated parts in the file names,
+#  exclusive upper limit on the number of files in a group)
+workbooks = [('dipg', 'ST_DIPG_private_all_metadata_with_roi_annotated.xlsx', 5, 51),
+             ('ep', 'ST_PF-EP_private_all_metadata_with_roi_annotated.xlsx', 6, 55),
+             ('mb', 'ST_PF-MB_private_all_metadata_with_roi_annotated.xlsx', 6, 40),
+             ('pilo', 'ST_PF-PILO_private_all_metadata_with_roi_annotated.xlsx', 6, 68),
+             ('se_dipg', 'SE_DIPG_private_all_metadata_with_roi_annotated.xlsx', 5, 51),
+             ('se_ep', 'SE_PF-EP_private_all_metadata_with_roi_annotated.xlsx', 6, 68),
+             ('se_mb', 'SE_PF-MB_private_all_metadata_with_roi_annotated.xlsx', 6, 68)]
+
+workbook_columns = ['Series', 'Plane', 'ModelFilter', 'PID', 'SID', 'FileName_df']
+normal_columns = ['Series', 'Plane', 'ModelFilter', 'SeriesDescription',
+                  'is_Duplicate', 'Patient_ID']
+
+
+def read_cache(cache):
+    '''
+    Reads a pickled cache file
+
+    A cache which is missing, or cannot be unpickled, e.g. because it was
+    written by an older version or is corrupted, is a cache miss.
+
+    Parameters
+    ----------
+    cache: str
+        path to the cache file
+
+    Returns
+    -------
+    object or None
+        the cached object, None on a cache miss
+    '''
+    if not os.path.exists(cache):
+        return None
+    try:
+        return pd.read_pickle(cache)
+    except Exception:
+        return None
+
+
+def write_cache(obj, cache):
+    '''
+    Pickles an object into a cache file
+
+    The object is written to a temporary file of the process, then moved
+    over the cache file, so that the shards running concurrently on the
+    same data directory never read a partially written cache.
+
+    Parameters
+    ----------
+    obj: object
+        object to cache
+    cache: str
+        path to the cache file
+
+    Returns
+    -------
+    None
+    '''
+    cache_path = os.path.dirname(cache)
+    if cache_path and not os.path.exists(cache_path):
+        os.makedirs(cache_path, exist_ok=True)
+    tmp = '{}.tmp{}'.format(cache, os.getpid())
+    pd.to_pickle(obj, tmp)
+    os.replace(tmp, cache)
+
+
+def read_metadata(path, columns, cache_path):
+    '''
+    Reads the columns of a metadata workbook or CSV, through a cache
+
+    The parsed columns are pickled in the cache directory along with the
+    modification time of the source file, and are read from there as long
+    as the source file is not modified.
+
+    Parameters
+    ----------
+    path: str
+        path to the .xlsx workbook or .csv file
+    columns: list
+        list of columns to keep
+    cache_path: str
+        directory to store the parsed metadata in
+
+    Returns
+    -------
+    DataFrame
+        the metadata restricted to the columns
+    '''
+    mtime = os.stat(path).st_mtime
+    cache = os.path.join(cache_path, os.path.basename(path) + '.pkl')
+    cached = read_cache(cache)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    if path.endswith('.csv'):
+        meta = pd.read_csv(path, usecols=columns)
+    else:
+        meta = pd.read_excel(path, usecols=columns)
+    write_cache((mtime, meta), cache)
+    return meta
+
+
+def get_metadata_sets(cache_path):
+    '''
+    Reads all the metadata associated with each category and generates a set
+    of files to be considered for each category.
+
+    The T2 Axial filter, and the grouping of the files in volumes, run once
+    over the metadata of all the workbooks concatenated together.
+
+    Parameters
+    ----------
+    cache_path: str
+        directory to store the parsed metadata in
+
+    Returns
+    -------
+    dict
+        dictionary of the set of files to be considered, keyed by category
+    '''
+    # Normal Brain MRI T2 Axial Only
+    healthy_path = os.path.join('source', 'Normal')
+    meta = read_metadata(normal_path, normal_columns, cache_path)
+    meta = meta[(meta['Series'] == 'T2') & (meta['Plane'] == 'Axial') &
+                (meta['ModelFilter'] == 'T2 ax') &
+                (meta['SeriesDescription'] == 'AX T2 FRFSE') &
+                (meta['is_Duplicate'] == 'NO')]
+    sets = {'normal': set(os.path.join(healthy_path, '{}.npz'.format(x))
+                          for x in meta['Patient_ID'].unique())}
+
+    # Stanford and Seattle T2 Axial Only
+    frames = []
+    for key, workbook, _, _ in workbooks:
+        meta = read_metadata(os.path.join(metadata_path, workbook), workbook_columns, cache_path)
+        frames.append(meta.assign(Key=key))
+    meta = pd.concat(frames, ignore_index=True)
+    meta = meta[(meta['Series'] == 'T2') & (meta['Plane'] == 'Axial') &
+                (meta['ModelFilter'] == 'T2_Axial')]
+    meta = meta.assign(Filenames=meta['PID'] + '-' + meta['SID'].map('{:02d}'.format) + '-' + meta['FileName_df'],
+                       Group=meta['PID'] + '_' + meta['FileName_df'].str.split('-').str[1])
+
+    # keep the groups in which every file name has the expected number of
+    # parts and which have fewer files than the limit of the category
+    parts = meta['Key'].map(dict((key, x) for key, _, x, _ in workbooks))
+    limit = meta['Key'].map(dict((key, x) for key, _, _, x in workbooks))
+    meta = meta.assign(Valid=meta['Filenames'].str.count('-') + 1 == parts)
+    groups = meta.groupby(['Key', 'Group'])
+    keep = groups['Valid'].transform('all') & (groups['Filenames'].transform('count') < limit)
+    for key, files in meta.loc[keep].groupby('Key')['Filenames']:
+        sets[key] = set(files)
+    for key, _, _, _ in workbooks:
+        sets.setdefault(key, set())
+    return sets
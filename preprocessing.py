@@ -1,585 +1,1468 @@
 # Import Libraries
+from manifest import Manifest, file_signature, record_key
 from progressbar import ProgressBar, Bar, Percentage
 from sklearn.model_selection import train_test_split
 from skimage.transform import resize
-from functools import reduce
+from dicomindex import index_dicom, group_volumes, estimate
+from sourceindex import scan_source
+from sliceindex import index_meta
+from metadata import get_metadata_sets
+from stats import standardize, combine, empty, save_stats, load_stats
+from multiprocessing import Pool
+from store import save_volume, load_cropped, quantize, formats, store_format, extension
+from store import uncrop, levels, pyramid_path, volume_format
+from codec import codecs, parse_codec
 import nibabel as nib
 import pydicom as pdc
 import pandas as pd
 import numpy as np
+import argparse
+import hashlib
+import zipfile
 import math
 import json
-import sys
 import os
 
 
-# Prepare data and meta folder
-if not os.path.exists('meta'):
-    os.mkdir('meta')
-
-if not os.path.exists('data'):
-    os.mkdir('data')
-
-autoencode_path = os.path.join('data', 'autoencode')
-classifier_path = os.path.join('data', 'classifier')
-
-if not os.path.exists(autoencode_path):
-    os.mkdir(autoencode_path)
-    os.mkdir(os.path.join(autoencode_path, 'train'))
-    os.mkdir(os.path.join(autoencode_path, 'valid'))
-if not os.path.exists(classifier_path):
-    os.mkdir(classifier_path)
-    os.mkdir(os.path.join(classifier_path, 'train'))
-    os.mkdir(os.path.join(classifier_path, 'valid'))
-    os.mkdir(os.path.join(classifier_path, 'test'))
-
-
 # Seed
 seed = 42
 
+autoencode_path = os.path.join('data', 'autoencode')
+classifier_path = os.path.join('data', 'classifier')
+lazy_path = os.path.join('data', 'lazy')
+store_path = os.path.join('data', 'store')
 
-# Metadata Processing
-# Reads all the metadata associated with each category and generates a set
-# of files to be considered for each category.
-
-# Normal Brain MRI T2 Axial Only
-healthy_path = os.path.join('source', 'Normal')
-meta = pd.read_csv(os.path.join('source', 'flipped_clinical_NormalPedBrainAge_StanfordCohort.csv'))
-meta = meta[meta['Series'] == 'T2']
-meta = meta[meta['Plane'] == 'Axial']
-meta = meta[meta['ModelFilter'] == 'T2 ax']
-meta = meta[meta['SeriesDescription'] == 'AX T2 FRFSE']
-meta = meta[meta['is_Duplicate'] == 'NO']
-normal_set = set(map(lambda x: os.path.join(healthy_path, '{}.npz').format(x),
-                     meta['Patient_ID'].unique().tolist()))
-
-
-# Stanford
-# DIPG T2 Axial Only
-meta = pd.read_excel(os.path.join(os.path.join('source', 'katie_annotated_metadata'),
-                                  'ST_DIPG_private_all_metadata_with_roi_annotated.xlsx'))
-meta = meta[meta['Series'] == 'T2']
-meta = meta[meta['Plane'] == 'Axial']
-meta = meta[meta['ModelFilter'] == 'T2_Axial']
-meta['Filenames'] = meta['PID'] + '-' + meta['SID'].apply(lambda x: '{:02d}'.format(x)) + '-' + meta['FileName_df']
-meta['Group'] = meta['PID'] + '_' + meta['FileName_df'].apply(lambda x: x.split('-')[1])
-groups = meta[['Group', 'Filenames']].groupby('Group')['Filenames'].apply(sorted).values.tolist()
-groups = list(filter(lambda x: all([len(y.split('-')) == 5 for y in x]) and len(x) < 51, groups))
-dipg_set = set(reduce(lambda x, y: x + y, groups))
-
-
-# EP T2 Axial Only
-meta = pd.read_excel(os.path.join(os.path.join('source', 'katie_annotated_metadata'),
-                                  'ST_PF-EP_private_all_metadata_with_roi_annotated.xlsx'))
-meta = meta[meta['Series'] == 'T2']
-meta = meta[meta['Plane'] == 'Axial']
-meta = meta[meta['ModelFilter'] == 'T2_Axial']
-meta['Filenames'] = meta['PID'] + '-' + meta['SID'].apply(lambda x: '{:02d}'.format(x)) + '-' + meta['FileName_df']
-meta['Group'] = meta['PID'] + '_' + meta['FileName_df'].apply(lambda x: x.split('-')[1])
-groups = meta[['Group', 'Filenames']].groupby('Group')['Filenames'].apply(sorted).values.tolist()
-groups = list(filter(lambda x: all([len(y.split('-')) == 6 for y in x]) and len(x) < 55, groups))
-ep_set = set(reduce(lambda x, y: x + y, groups))
-
-
-# MB T2 Axial Only
-meta = pd.read_excel(os.path.join(os.path.join('source', 'katie_annotated_metadata'),
-                                  'ST_PF-MB_private_all_metadata_with_roi_annotated.xlsx'))
-meta = meta[meta['Series'] == 'T2']
-meta = meta[meta['Plane'] == 'Axial']
-meta = meta[meta['ModelFilter'] == 'T2_Axial']
-meta['Filenames'] = meta['PID'] + '-' + meta['SID'].apply(lambda x: '{:02d}'.format(x)) + '-' + meta['FileName_df']
-meta['Group'] = meta['PID'] + '_' + meta['FileName_df'].apply(lambda x: x.split('-')[1])
-groups = meta[['Group', 'Filenames']].groupby('Group')['Filenames'].apply(sorted).values.tolist()
-groups = list(filter(lambda x: all([len(y.split('-')) == 6 for y in x]) and len(x) < 40, groups))
-mb_set = set(reduce(lambda x, y: x + y, groups))
-
-
-# PILO T2 Axial Only
-meta = pd.read_excel(os.path.join(os.path.join('source', 'katie_annotated_metadata'),
-                                  'ST_PF-PILO_private_all_metadata_with_roi_annotated.xlsx'))
-meta = meta[meta['Series'] == 'T2']
-meta = meta[meta['Plane'] == 'Axial']
-meta = meta[meta['ModelFilter'] == 'T2_Axial']
-meta['Filenames'] = meta['PID'] + '-' + meta['SID'].apply(lambda x: '{:02d}'.format(x)) + '-' + meta['FileName_df']
-meta['Group'] = meta['PID'] + '_' + meta['FileName_df'].apply(lambda x: x.split('-')[1])
-groups = meta[['Group', 'Filenames']].groupby('Group')['Filenames'].apply(sorted).values.tolist()
-groups = list(filter(lambda x: all([len(y.split('-')) == 6 for y in x]) and len(x) < 68, groups))
-pilo_set = set(reduce(lambda x, y: x + y, groups))
-
-
-# Seattle
-# DIPG T2 Axial Only
-meta = pd.read_excel(os.path.join(os.path.join('source', 'katie_annotated_metadata'),
-                                  'SE_DIPG_private_all_metadata_with_roi_annotated.xlsx'))
-meta = meta[meta['Series'] == 'T2']
-meta = meta[meta['Plane'] == 'Axial']
-meta = meta[meta['ModelFilter'] == 'T2_Axial']
-meta['Filenames'] = meta['PID'] + '-' + meta['SID'].apply(lambda x: '{:02d}'.format(x)) + '-' + meta['FileName_df']
-meta['Group'] = meta['PID'] + '_' + meta['FileName_df'].apply(lambda x: x.split('-')[1])
-groups = meta[['Group', 'Filenames']].groupby('Group')['Filenames'].apply(sorted).values.tolist()
-groups = list(filter(lambda x: all([len(y.split('-')) == 5 for y in x]) and len(x) < 51, groups))
-se_dipg_set = set(reduce(lambda x, y: x + y, groups))
-
-
-# EP T2 Axial Only
-meta = pd.read_excel(os.path.join(os.path.join('source', 'katie_annotated_metadata'),
-                                  'SE_PF-EP_private_all_metadata_with_roi_annotated.xlsx'))
-meta = meta[meta['Series'] == 'T2']
-meta = meta[meta['Plane'] == 'Axial']
-meta = meta[meta['ModelFilter'] == 'T2_Axial']
-meta['Filenames'] = meta['PID'] + '-' + meta['SID'].apply(lambda x: '{:02d}'.format(x)) + '-' + meta['FileName_df']
-meta['Group'] = meta['PID'] + '_' + meta['FileName_df'].apply(lambda x: x.split('-')[1])
-groups = meta[['Group', 'Filenames']].groupby('Group')['Filenames'].apply(sorted).values.tolist()
-groups = list(filter(lambda x: all([len(y.split('-')) == 6 for y in x]) and len(x) < 68, groups))
-se_ep_set = set(reduce(lambda x, y: x + y, groups))
-
-
-# MB T2 Axial Only
-meta = pd.read_excel(os.path.join(os.path.join('source', 'katie_annotated_metadata'),
-                                  'SE_PF-MB_private_all_metadata_with_roi_annotated.xlsx'))
-meta = meta[meta['Series'] == 'T2']
-meta = meta[meta['Plane'] == 'Axial']
-meta = meta[meta['ModelFilter'] == 'T2_Axial']
-meta['Filenames'] = meta['PID'] + '-' + meta['SID'].apply(lambda x: '{:02d}'.format(x)) + '-' + meta['FileName_df']
-meta['Group'] = meta['PID'] + '_' + meta['FileName_df'].apply(lambda x: x.split('-')[1])
-groups = meta[['Group', 'Filenames']].groupby('Group')['Filenames'].apply(sorted).values.tolist()
-groups = list(filter(lambda x: all([len(y.split('-')) == 6 for y in x]) and len(x) < 68, groups))
-se_mb_set = set(reduce(lambda x, y: x + y, groups))
-
-
-# AutoEncoder Data Preprocessing
-
-# Using the BRATS public dataset and the normal healthy brain dataset
-brats_path = os.path.join('source', 'Task01_BrainTumour')
-brats_train = os.path.join(brats_path, 'imagesTr')
-brats_valid = os.path.join(brats_path, 'imagesTs')
-healthy_path = os.path.join('source', 'Normal')
-
-autoencode_files = []
-autoencode_types = []
-
-for _, _, files in os.walk(brats_train):
-    # add files from the training directory of BRATS
-    files = sorted(map(lambda x: os.path.join(brats_train, x),
-                       filter(lambda x: not x.startswith('.'), files)))
-    autoencode_files.extend(files)
-    autoencode_types.extend([1 for _ in range(len(files))])
-
-for _, _, files in os.walk(brats_valid):
-    # add files from the validation directory of BRATS
-    files = sorted(map(lambda x: os.path.join(brats_valid, x),
-                       filter(lambda x: not x.startswith('.'), files)))
-    autoencode_files.extend(files)
-    autoencode_types.extend([1 for _ in range(len(files))])
-
-for _, _, files in os.walk(healthy_path):
-    # add files from the normal brains directory
-    files = set(map(lambda x: os.path.join(healthy_path, x),
-                    filter(lambda x: not x.startswith('.'), files)))
-    files = sorted(files.intersection(normal_set))
-    autoencode_files.extend(files)
-    autoencode_types.extend([2 for _ in range(len(files))])
-
-# split the data in train and validation with 80-20 split
-train_path, valid_path, train_type, valid_type = train_test_split(autoencode_files,
-                                                                  autoencode_types,
-                                                                  test_size=0.2,
-                                                                  random_state=seed,
-                                                                  stratify=autoencode_types)
-
-
-# dictionary to store the minima and maxima of Brain MRI in training subset
-autoencode_meta = {'min': float('inf'), 'max': float('-inf')}
-data_train_path = os.path.join(autoencode_path, 'train')
-
-fp = open(os.path.join('meta', 'ae_train.csv'), 'w')
-fp.write('filepath, plane\n')
-
-cnt = 0
-bar = ProgressBar(maxval=len(train_path), widgets=[Bar('=', '[', ']'), ' ', Percentage()]).start()
-
-for path, method in list(zip(train_path, train_type)):
-    # Read the files from training set, standardize them, update minima and maxima,
-    # save the numpy array for each file read as compressed zip, and generate a meta
-    # file called ae_train.csv that can be referenced later to feed the models.
-    img = None
-    if method == 1:
-        img = nib.load(path).get_fdata()[:, :, 25:125, 3]
-        img = resize(img, (256, 256), mode='constant', clip=True, preserve_range=True)
-        img = img.transpose((2, 0, 1))
-    else:
-        img = np.load(path)['T2 ax']
-        dim1 = max(img.shape[:2]) - img.shape[0]
-        dim2 = max(img.shape[:2]) - img.shape[1]
-        if dim1 != 0 or dim2 != 0:
-            pad = np.pad(img, ((math.ceil(dim1 / 2.0), math.floor(dim1 / 2.0)),
-                               (math.ceil(dim2 / 2.0), math.floor(dim2 / 2.0)), (0, 0)),
-                         mode='constant', constant_values=0)
-            img = resize(pad, (256, 256), mode='constant', clip=True, preserve_range=True)
-        img = img.transpose((2, 0, 1))
-        img = np.rot90(img, axes=(2, 1))
-
-    img = (img - img.mean()) / img.std()
-
-    min_img = img.min()
-    max_img = img.max()
-    if min_img < autoencode_meta['min']:
-        autoencode_meta['min'] = min_img
-    if max_img > autoencode_meta['max']:
-        autoencode_meta['max'] = max_img
+# fraction of the maximum of a volume above which a pixel is foreground
+foreground = 0.05
 
-    np.savez_compressed(os.path.join(data_train_path, '{:04d}'.format(cnt)), data=img)
-    for k in range(img.shape[0]):
-        fp.write('{}, {}\n'.format(os.path.join(data_train_path, '{:04d}.npz'.format(cnt)), k))
-    cnt += 1
-    bar.update(cnt)
+# meta files written by each pipeline, in this order
+meta_files = {'ae': ['ae_train.csv', 'ae_valid.csv', 'ae_meta.json', 'ae_stats.json'],
+              'clf': ['clf_train.csv', 'clf_valid.csv', 'clf_test.csv', 'clf_meta.json', 'clf_stats.json']}
 
-bar.finish()
-fp.close()
 
-# save the minima and maxima dictionary in meta directory.
-autoencode_meta['min'] = float(autoencode_meta['min'])
-autoencode_meta['max'] = float(autoencode_meta['max'])
-with open(os.path.join('meta', 'ae_meta.json'), 'w') as fp:
-    json.dump(autoencode_meta, fp)
+def prepare_folders(meta_path):
+    '''
+    Creates the data and meta folders along with the partition subfolders,
+    if they do not exist.
 
+    Parameters
+    ----------
+    meta_path: str
+        directory to write the meta files in
 
-data_valid_path = os.path.join(autoencode_path, 'valid')
+    Returns
+    -------
+    None
+    '''
+    # shards running concurrently create the same directories
+    os.makedirs(meta_path, exist_ok=True)
 
-fp = open(os.path.join('meta', 'ae_valid.csv'), 'w')
-fp.write('filepath, plane\n')
+    os.makedirs(os.path.join(autoencode_path, 'train'), exist_ok=True)
+    os.makedirs(os.path.join(autoencode_path, 'valid'), exist_ok=True)
+    os.makedirs(lazy_path, exist_ok=True)
+    os.makedirs(store_path, exist_ok=True)
+    os.makedirs(os.path.join(classifier_path, 'train'), exist_ok=True)
+    os.makedirs(os.path.join(classifier_path, 'valid'), exist_ok=True)
+    os.makedirs(os.path.join(classifier_path, 'test'), exist_ok=True)
 
-cnt = 0
-bar = ProgressBar(maxval=len(valid_path), widgets=[Bar('=', '[', ']'), ' ', Percentage()]).start()
 
-for path, method in list(zip(valid_path, valid_type)):
-    # Read the files from validation set, standardize them, save the numpy array
-    # for each file read as compressed zip, and generate a meta file called
-    # ae_train.csv that can be referenced later to feed the models.
+# AutoEncoder Data Preprocessing
+def get_autoencode_files(normal_set, index):
+    '''
+    Lists the BRATS public dataset and the normal healthy brain dataset and
+    splits them in train and validation partitions.
+
+    Parameters
+    ----------
+    normal_set: set
+        set of normal brain files to be considered
+    index: DataFrame
+        index of the source files
+
+    Returns
+    -------
+    tuple
+        (train paths, validation paths, train types, validation types)
+    '''
+    # add files from the training and validation directories of BRATS
+    brats = index[index['category'].isin(['brats_train', 'brats_valid'])]
+    # add files from the normal brains directory
+    normal = index[(index['category'] == 'normal') & index['path'].isin(normal_set)]
+    normal = normal.sort_values('path')
+
+    autoencode_files = brats['path'].tolist() + normal['path'].tolist()
+    autoencode_types = [1 for _ in range(len(brats))] + [2 for _ in range(len(normal))]
+
+    # split the data in train and validation with 80-20 split
+    train_path, valid_path, train_type, valid_type = train_test_split(autoencode_files,
+                                                                      autoencode_types,
+                                                                      test_size=0.2,
+                                                                      random_state=seed,
+                                                                      stratify=autoencode_types)
+    return (train_path, valid_path, train_type, valid_type)
+
+
+def load_brats(path):
+    '''
+    Reads the 100 central slices of the fourth modality of a BRATS volume.
+
+    Parameters
+    ----------
+    path: str
+        path to the NIfTI volume
+
+    Returns
+    -------
+    ndarray
+        array with shape (height, width, 100)
+    '''
+    # slice the array proxy, so that only the slab of the fourth modality
+    # is read from disk, and cast it to float64 like get_fdata does
+    return np.asarray(nib.load(path).dataobj[:, :, 25:125, 3]).astype(np.float64)
+
+
+def load_normal(path):
+    '''
+    Reads the T2 axial volume of a normal brain.
+
+    Parameters
+    ----------
+    path: str
+        path to the .npz volume
+
+    Returns
+    -------
+    ndarray
+        array with shape (height, width, slices)
+    '''
+    return np.load(path)['T2 ax']
+
+
+def load_dicom(paths):
+    '''
+    Decodes the pixel data of the DICOM files forming a volume.
+
+    Parameters
+    ----------
+    paths: list
+        list of paths to the DICOM files
+
+    Returns
+    -------
+    list
+        list of 2D slices
+    '''
+    return [pdc.dcmread(filename).pixel_array for filename in paths]
+
+
+def axis_weights(length, offset, padded, size):
+    '''
+    Computes the linear interpolation of one axis of a slice padded with
+    zeros and resized, as indices into and weights of the unpadded axis.
+
+    Output pixel i samples the padded axis at (i + 0.5) * padded / size - 0.5,
+    between the two nearest pixels. A neighbour in the padding or outside the
+    padded axis is zero, so it gets a weight of zero instead of being read.
+
+    Parameters
+    ----------
+    length: int
+        length of the unpadded axis
+    offset: int
+        number of zeros padded before the axis
+    padded: int
+        length of the padded axis
+    size: int
+        length of the resized axis
+
+    Returns
+    -------
+    tuple
+        (indices of the first neighbours, indices of the second neighbours,
+         weights of the first neighbours, weights of the second neighbours)
+    '''
+    coords = (np.arange(size) + 0.5) * (padded / float(size)) - 0.5
+    first = np.floor(coords)
+    weight = coords - first
+    first = first.astype(np.intp) - offset
+    second = first + 1
+    first_weight = np.where((first >= 0) & (first < length), 1 - weight, 0.0)
+    second_weight = np.where((second >= 0) & (second < length), weight, 0.0)
+    return (np.clip(first, 0, length - 1), np.clip(second, 0, length - 1), first_weight, second_weight)
+
+
+def resample(img, size):
+    '''
+    Pads a stack of slices to a square, centered, and resizes it to
+    size x size with linear interpolation, in a single resampling which
+    never allocates the padded stack. This is equivalent to np.pad followed
+    by skimage resize with order 1, mode 'constant' and anti_aliasing=False,
+    before clipping, as every resize of the pipeline is done. It does not
+    smooth the slices before downsampling them, which skimage 0.15 and later
+    do by default.
+
+    Parameters
+    ----------
+    img: ndarray
+        array with shape (height, width, slices)
+    size: int
+        dimension of the resized square slices
+
+    Returns
+    -------
+    ndarray
+        array with shape (size, size, slices)
+    '''
+    height, width = img.shape[:2]
+    padded = max(height, width)
+    rows = axis_weights(height, int(math.ceil((padded - height) / 2.0)), padded, size)
+    cols = axis_weights(width, int(math.ceil((padded - width) / 2.0)), padded, size)
+    # interpolate along the columns, then along the rows
+    img = img[:, cols[0]] * cols[2][:, None] + img[:, cols[1]] * cols[3][:, None]
+    return img[rows[0]] * rows[2][:, None, None] + img[rows[1]] * rows[3][:, None, None]
+
+
+def pad_resize(img, size):
+    '''
+    Pads a volume which is not square to a square and resizes it to
+    size x size. Square volumes are returned as they are.
+
+    Parameters
+    ----------
+    img: ndarray
+        array with shape (height, width, slices)
+    size: int
+        dimension of the resized square slices
+
+    Returns
+    -------
+    ndarray
+        array with shape (size, size, slices), or the input if square
+    '''
+    if img.shape[0] != img.shape[1]:
+        # clip to the range of the padded volume, as skimage resize does
+        out = resample(img, size)
+        img = np.clip(out, min(img.min(), 0), max(img.max(), 0), out=out)
+    return img
+
+
+def read_autoencode(path, method):
+    '''
+    Reads a BRATS (method 1) or normal brain (method 2) volume and resizes
+    it to slices of 256x256.
+
+    Parameters
+    ----------
+    path: str
+        path to the volume
+    method: int
+        type of the volume
+
+    Returns
+    -------
+    ndarray
+        array of slices with shape (slices, 256, 256)
+    '''
     img = None
     if method == 1:
-        img = nib.load(path).get_fdata()[:, :, 25:125, 3]
-        img = resize(img, (256, 256), mode='constant', clip=True, preserve_range=True)
+        img = resize(load_brats(path), (256, 256), mode='constant', clip=True, preserve_range=True,
+                     anti_aliasing=False)
         img = img.transpose((2, 0, 1))
     else:
-        img = np.load(path)['T2 ax']
-        dim1 = max(img.shape[:2]) - img.shape[0]
-        dim2 = max(img.shape[:2]) - img.shape[1]
-        if dim1 != 0 or dim2 != 0:
-            pad = np.pad(img, ((math.ceil(dim1 / 2.0), math.floor(dim1 / 2.0)),
-                               (math.ceil(dim2 / 2.0), math.floor(dim2 / 2.0)), (0, 0)),
-                         mode='constant', constant_values=0)
-            img = resize(pad, (256, 256), mode='constant', clip=True, preserve_range=True)
+        img = pad_resize(load_normal(path), 256)
         img = img.transpose((2, 0, 1))
         img = np.rot90(img, axes=(2, 1))
-
-    img = (img - img.mean()) / img.std()
-
-    np.savez_compressed(os.path.join(data_valid_path, '{:04d}'.format(cnt)), data=img)
-    for k in range(img.shape[0]):
-        fp.write('{}, {}\n'.format(os.path.join(data_valid_path, '{:04d}.npz'.format(cnt)), k))
-    cnt += 1
-    bar.update(cnt)
-
-bar.finish()
-fp.close()
+    return img
 
 
 # Classifier Data Preprocessing
+def list_classifier_volumes(sets, index, cache_path, workers):
+    '''
+    Lists the Stanford dataset, Seattle datasets and Normal brain dataset,
+    and groups the DICOM files in volumes.
+
+    The DICOM files are grouped by the patient ID and series of their
+    headers, read into an index of the headers of every DICOM file, and the
+    slices of each volume are ordered by instance number. The volumes with
+    an unreadable header are dropped before decoding any pixel data.
+
+    Parameters
+    ----------
+    sets: dict
+        dictionary of the set of files to be considered, keyed by category
+    index: DataFrame
+        index of the source files
+    cache_path: str
+        directory to store the index of the DICOM headers in
+    workers: int
+        number of worker processes to read the DICOM headers with
+
+    Returns
+    -------
+    tuple
+        (list of paths to the volumes, each a list of paths to DICOM files or
+         the path to a Normal volume, list of types of the volumes, index of
+         the headers of the DICOM files)
+    '''
+    methods = [('dipg', 0), ('se_dipg', 0), ('ep', 1), ('se_ep', 1),
+               ('mb', 2), ('se_mb', 2), ('pilo', 3)]
+    # files from the Stanford and Seattle directories of each tumor type
+    files = []
+    for key, _ in methods:
+        selected = index[(index['category'] == key) & index['name'].isin(sets[key])]
+        if key in ['dipg', 'se_dipg']:
+            # keep the DIPG volumes in which every file name has 5 parts
+            selected = selected[(selected['parts'] == 5).groupby(selected['group']).transform('all')]
+        files.append(selected)
+    files = pd.concat(files, ignore_index=True)
+    headers = index_dicom(files['path'].tolist(), cache_path, workers)
+    class_files, categories = group_volumes(files, headers, [key for key, _ in methods])
+    class_types = [dict(methods)[x] for x in categories]
 
-# Using the Stanford dataset and Seattle datasets and Normal brain dataset
-st_path = os.path.join(os.path.join('source', '{}'), 'Stanford')
-se_path = os.path.join(os.path.join('source', '{}'), 'Seattle')
-
-st_path = os.path.join(os.path.join(st_path, 'ST_{}_T2_Axial'), 'no_roi')
-se_path = os.path.join(os.path.join(se_path, 'SE_{}_T2_Axial'), 'no_roi')
-healthy_path = os.path.join('source', 'Normal')
-
-class_files = []
-class_types = []
-
-dipg_path = st_path.format('DIPG', 'DIPG')
-for _, _, files in os.walk(dipg_path):
-    # add files from the Stanford DIPG directory
-    files = set(filter(lambda x: not x.startswith('.'), files))
-    files = sorted(files.intersection(dipg_set))
-    iids = {}
-    for filename in files:
-        key = '{}_{}'.format(filename.split('-')[0][-4:], filename.split('-')[3])
-        if key not in iids:
-            iids[key] = []
-        iids[key].append(os.path.join(dipg_path, filename))
-    files = [sorted(iids[key]) for key in sorted(iids.keys())]
-    files = list(filter(lambda x: all([len(y.split('-')) == 5 for y in x]), files))
-    class_files.extend(files)
-    class_types.extend([0 for _ in range(len(files))])
-
-dipg_path = se_path.format('DIPG', 'DIPG')
-for _, _, files in os.walk(dipg_path):
-    # add files from the Seattle DIPG directory
-    files = set(filter(lambda x: not x.startswith('.'), files))
-    files = sorted(files.intersection(se_dipg_set))
-    iids = {}
-    for filename in files:
-        key = '{}_{}'.format(filename.split('-')[0][-4:], filename.split('-')[3])
-        if key not in iids:
-            iids[key] = []
-        iids[key].append(os.path.join(dipg_path, filename))
-    files = [sorted(iids[key]) for key in sorted(iids.keys())]
-    files = list(filter(lambda x: all([len(y.split('-')) == 5 for y in x]), files))
-    class_files.extend(files)
-    class_types.extend([0 for _ in range(len(files))])
-
-ep_path = st_path.format('EP', 'PF-EP')
-for _, _, files in os.walk(ep_path):
-    # add files from the Stanford EP directory
-    files = set(filter(lambda x: not x.startswith('.'), files))
-    files = sorted(files.intersection(ep_set))
-    iids = {}
-    for filename in files:
-        key = '{}_{}'.format(filename.split('-')[1][-4:], filename.split('-')[4])
-        if key not in iids:
-            iids[key] = []
-        iids[key].append(os.path.join(ep_path, filename))
-    files = [sorted(iids[key]) for key in sorted(iids.keys())]
-    class_files.extend(files)
-    class_types.extend([1 for _ in range(len(files))])
-
-ep_path = se_path.format('EP', 'PF-EP')
-for _, _, files in os.walk(ep_path):
-    # add files from the Seattle EP directory
-    files = set(filter(lambda x: not x.startswith('.'), files))
-    files = sorted(files.intersection(se_ep_set))
-    iids = {}
-    for filename in files:
-        key = '{}_{}'.format(filename.split('-')[1][-4:], filename.split('-')[4])
-        if key not in iids:
-            iids[key] = []
-        iids[key].append(os.path.join(ep_path, filename))
-    files = [sorted(iids[key]) for key in sorted(iids.keys())]
-    class_files.extend(files)
-    class_types.extend([1 for _ in range(len(files))])
-
-mb_path = st_path.format('MB', 'PF-MB')
-for _, _, files in os.walk(mb_path):
-    # add files from the Stanford MB directory
-    files = set(filter(lambda x: not x.startswith('.'), files))
-    files = sorted(files.intersection(mb_set))
-    iids = {}
-    for filename in files:
-        key = '{}_{}'.format(filename.split('-')[1][-4:], filename.split('-')[4])
-        if key not in iids:
-            iids[key] = []
-        iids[key].append(os.path.join(mb_path, filename))
-    files = [sorted(iids[key]) for key in sorted(iids.keys())]
-    class_files.extend(files)
-    class_types.extend([2 for _ in range(len(files))])
-
-mb_path = se_path.format('MB', 'PF-MB')
-for _, _, files in os.walk(mb_path):
-    # add files from the Seattle MB directory
-    files = set(filter(lambda x: not x.startswith('.'), files))
-    files = sorted(files.intersection(se_mb_set))
-    iids = {}
-    for filename in files:
-        key = '{}_{}'.format(filename.split('-')[1][-4:], filename.split('-')[4])
-        if key not in iids:
-            iids[key] = []
-        iids[key].append(os.path.join(mb_path, filename))
-    files = [sorted(iids[key]) for key in sorted(iids.keys())]
-    class_files.extend(files)
-    class_types.extend([2 for _ in range(len(files))])
-
-pilo_path = st_path.format('PILO', 'PF-PILO')
-for _, _, files in os.walk(pilo_path):
-    # add files from the Stanford PILO directory
-    files = set(filter(lambda x: not x.startswith('.'), files))
-    files = sorted(files.intersection(pilo_set))
-    iids = {}
-    for filename in files:
-        key = '{}_{}'.format(filename.split('-')[1][-4:], filename.split('-')[4])
-        if key not in iids:
-            iids[key] = []
-        iids[key].append(os.path.join(pilo_path, filename))
-    files = [sorted(iids[key]) for key in sorted(iids.keys())]
-    class_files.extend(files)
-    class_types.extend([3 for _ in range(len(files))])
-
-for _, _, files in os.walk(healthy_path):
     # add files from the normal brains directory
-    files = set(map(lambda x: os.path.join(healthy_path, x),
-                    filter(lambda x: not x.startswith('.'), files)))
-    files = sorted(files.intersection(normal_set))
+    files = index[(index['category'] == 'normal') & index['path'].isin(sets['normal'])]
+    files = sorted(files['path'])
     class_files.extend(files)
     class_types.extend([4 for _ in range(len(files))])
-
-# split the data in train, validation and test with 80-10-10 split
-train_path, valid_path, train_type, valid_type = train_test_split(class_files, class_types, test_size=0.2,
-                                                                  random_state=seed, stratify=class_types)
-valid_path, test_path, valid_type, test_type = train_test_split(valid_path, valid_type, test_size=0.5,
-                                                                random_state=seed, stratify=valid_type)
-
-# dictionary to store the minima and maxima of Brain MRI in training subset
-class_meta = {'min': float('inf'), 'max': float('-inf')}
-data_train_path = os.path.join(classifier_path, 'train')
-
-fp = open(os.path.join('meta', 'clf_train.csv'), 'w')
-fp.write('filepath, plane, class\n')
-
-cnt = 0
-bar = ProgressBar(maxval=len(train_path), widgets=[Bar('=', '[', ']'), ' ', Percentage()]).start()
-
-for path, method in list(zip(train_path, train_type)):
-    # Read the files from training set, standardize them, update minima and maxima,
-    # save the numpy array for each file read as compressed zip, and generate a meta
-    # file called ae_train.csv that can be referenced later to feed the models.
+    return (class_files, class_types, headers)
+
+
+def get_classifier_files(sets, index, cache_path, workers):
+    '''
+    Lists the volumes of the Stanford dataset, Seattle datasets and Normal
+    brain dataset, and splits them in train, validation and test partitions.
+
+    Parameters
+    ----------
+    sets: dict
+        dictionary of the set of files to be considered, keyed by category
+    index: DataFrame
+        index of the source files
+    cache_path: str
+        directory to store the index of the DICOM headers in
+    workers: int
+        number of worker processes to read the DICOM headers with
+
+    Returns
+    -------
+    tuple
+        (train paths, validation paths, test paths,
+         train types, validation types, test types)
+    '''
+    class_files, class_types, headers = list_classifier_volumes(sets, index, cache_path, workers)
+    volumes, slices, nbytes = estimate([x for x in class_files if isinstance(x, list)], headers)
+    print('{} DICOM volumes, {} slices, {:.1f} MB of pixel data to decode'.format(
+        volumes, slices, nbytes / 2 ** 20))
+
+    # split the data in train, validation and test with 80-10-10 split
+    train_path, valid_path, train_type, valid_type = train_test_split(class_files, class_types, test_size=0.2,
+                                                                      random_state=seed, stratify=class_types)
+    valid_path, test_path, valid_type, test_type = train_test_split(valid_path, valid_type, test_size=0.5,
+                                                                    random_state=seed, stratify=valid_type)
+    return (train_path, valid_path, test_path, train_type, valid_type, test_type)
+
+
+def resize_slices(arrs, size):
+    '''
+    Pads each slice to a square and resizes it to size x size.
+
+    The slices of the same shape are stacked, with the slices as channels,
+    and resampled together in a single call, which gives the same result as
+    padding and resizing them one at a time.
+
+    Parameters
+    ----------
+    arrs: list
+        list of 2D slices
+    size: int
+        dimension of the resized square slices
+
+    Returns
+    -------
+    ndarray
+        array of slices with shape (slices, size, size)
+    '''
+    img = np.empty((len(arrs), size, size))
+    for shape in set(arr.shape for arr in arrs):
+        index = [i for i, arr in enumerate(arrs) if arr.shape == shape]
+        stack = np.empty(shape + (len(index),), dtype=arrs[index[0]].dtype)
+        for j, i in enumerate(index):
+            stack[:, :, j] = arrs[i]
+        out = resample(stack, size)
+        # clip each slice to the range of the padded slice, as resizing them
+        # one at a time does, except for the constant value of the padding
+        min_arr = stack.min(axis=(0, 1))
+        max_arr = stack.max(axis=(0, 1))
+        if shape[0] != shape[1]:
+            min_arr = np.minimum(min_arr, 0)
+            max_arr = np.maximum(max_arr, 0)
+        cval = (out == 0) & ((min_arr > 0) | (max_arr < 0))
+        out = np.clip(out, min_arr, max_arr, out=out)
+        out[cval] = 0
+        img[index] = out.transpose((2, 0, 1))
+    return img
+
+
+def read_classifier(path, method):
+    '''
+    Reads a normal brain volume (method 4) or a list of DICOM files forming
+    a volume and resizes it to slices of 256x256.
+
+    Parameters
+    ----------
+    path: str or list
+        path to the volume, or list of paths to the DICOM files
+    method: int
+        class of the volume
+
+    Returns
+    -------
+    ndarray
+        array of slices with shape (slices, 256, 256)
+    '''
     img = None
     if method == 4:
-        img = np.load(path)['T2 ax']
-        dim1 = max(img.shape[:2]) - img.shape[0]
-        dim2 = max(img.shape[:2]) - img.shape[1]
-        if dim1 != 0 or dim2 != 0:
-            pad = np.pad(img, ((math.ceil(dim1 / 2.0), math.floor(dim1 / 2.0)),
-                               (math.ceil(dim2 / 2.0), math.floor(dim2 / 2.0)), (0, 0)),
-                         mode='constant', constant_values=0)
-            img = resize(pad, (256, 256), mode='constant', clip=True, preserve_range=True)
+        img = pad_resize(load_normal(path), 256)
         img = img.transpose((2, 0, 1))
     else:
-        img = []
-        for filename in path:
-            arr = pdc.dcmread(filename).pixel_array
-            dim1 = max(arr.shape) - arr.shape[0]
-            dim2 = max(arr.shape) - arr.shape[1]
-            if dim1 != 0 or dim2 != 0:
-                arr = np.pad(arr, ((math.ceil(dim1 / 2.0), math.floor(dim1 / 2.0)),
-                                   (math.ceil(dim2 / 2.0), math.floor(dim2 / 2.0))),
-                             mode='constant', constant_values=0)
-            img.append(resize(arr, (256, 256), mode='constant',
-                              clip=True, preserve_range=True).tolist())
-        img = np.asarray(img)
-
+        img = resize_slices(load_dicom(path), 256)
     img = np.rot90(img, axes=(2, 1))
-    img = (img - img.mean()) / img.std()
-
-    min_img = img.min()
-    max_img = img.max()
-    if min_img < class_meta['min']:
-        class_meta['min'] = min_img
-    if max_img > class_meta['max']:
-        class_meta['max'] = max_img
-
-    np.savez_compressed(os.path.join(data_train_path, '{:04d}'.format(cnt)), data=img)
-    for k in range(img.shape[0]):
-        fp.write('{}, {}, {}\n'.format(os.path.join(data_train_path, '{:04d}.npz'.format(cnt)), k, method))
-    cnt += 1
-    bar.update(cnt)
-
-bar.finish()
-fp.close()
-
-
-# save the minima and maxima dictionary in meta directory.
-class_meta['min'] = float(class_meta['min'])
-class_meta['max'] = float(class_meta['max'])
-with open(os.path.join('meta', 'clf_meta.json'), 'w') as fp:
-    json.dump(class_meta, fp)
-
-
-data_valid_path = os.path.join(classifier_path, 'valid')
-
-fp = open(os.path.join('meta', 'clf_valid.csv'), 'w')
-fp.write('filepath, plane, class\n')
-
-cnt = 0
-bar = ProgressBar(maxval=len(valid_path), widgets=[Bar('=', '[', ']'), ' ', Percentage()]).start()
-
-for path, method in list(zip(valid_path, valid_type)):
-    # Read the files from validation set, standardize them, save the numpy array
-    # for each file read as compressed zip, and generate a meta file called
-    # ae_train.csv that can be referenced later to feed the models.
-    img = None
-    if method == 4:
-        img = np.load(path)['T2 ax']
-        dim1 = max(img.shape[:2]) - img.shape[0]
-        dim2 = max(img.shape[:2]) - img.shape[1]
-        if dim1 != 0 or dim2 != 0:
-            pad = np.pad(img, ((math.ceil(dim1 / 2.0), math.floor(dim1 / 2.0)),
-                               (math.ceil(dim2 / 2.0), math.floor(dim2 / 2.0)), (0, 0)),
-                         mode='constant', constant_values=0)
-            img = resize(pad, (256, 256), mode='constant', clip=True, preserve_range=True)
-        img = img.transpose((2, 0, 1))
+    return img
+
+
+def get_meta_path(options):
+    '''
+    Returns the directory to write the meta files in, which is meta/shards/i
+    for the i'th of several shards and meta otherwise.
+
+    Parameters
+    ----------
+    options: Namespace
+        command line options, the shard index and number of shards
+
+    Returns
+    -------
+    str
+        directory to write the meta files in
+    '''
+    if options.num_shards > 1:
+        return os.path.join('meta', 'shards', str(options.shard_index))
+    return 'meta'
+
+
+def shard(items, options):
+    '''
+    Selects the items of a partition which belong to the shard, every
+    num_shards'th item starting at the shard index, so that the shards are
+    disjoint and do not depend on where or when they run.
+
+    Parameters
+    ----------
+    items: list
+        list of items of the partition, in order
+    options: Namespace
+        command line options, the shard index and number of shards
+
+    Returns
+    -------
+    list
+        list of items of the shard, in order
+    '''
+    return items[options.shard_index::options.num_shards]
+
+
+def imap(function, tasks, workers):
+    '''
+    Applies a function to every task, in a pool of worker processes if more
+    than one worker is requested, and yields the results in order.
+
+    Parameters
+    ----------
+    function: function
+        function to apply to each task
+    tasks: list
+        list of tasks
+    workers: int
+        number of worker processes
+
+    Returns
+    -------
+    generator
+        results of the function, in the order of the tasks
+    '''
+    if workers > 1 and len(tasks) > 1:
+        pool = Pool(workers)
+        try:
+            for result in pool.imap(function, tasks):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
     else:
-        img = []
-        for filename in path:
-            arr = pdc.dcmread(filename).pixel_array
-            dim1 = max(arr.shape) - arr.shape[0]
-            dim2 = max(arr.shape) - arr.shape[1]
-            if dim1 != 0 or dim2 != 0:
-                arr = np.pad(arr, ((math.ceil(dim1 / 2.0), math.floor(dim1 / 2.0)),
-                                   (math.ceil(dim2 / 2.0), math.floor(dim2 / 2.0))),
-                             mode='constant', constant_values=0)
-            img.append(resize(arr, (256, 256), mode='constant',
-                              clip=True, preserve_range=True).tolist())
-        img = np.asarray(img)
-
-    img = np.rot90(img, axes=(2, 1))
-    img = (img - img.mean()) / img.std()
-
-    np.savez_compressed(os.path.join(data_valid_path, '{:04d}'.format(cnt)), data=img)
-    for k in range(img.shape[0]):
-        fp.write('{}, {}, {}\n'.format(os.path.join(data_valid_path, '{:04d}.npz'.format(cnt)), k, method))
-    cnt += 1
-    bar.update(cnt)
-
-bar.finish()
-fp.close()
-
-
-data_test_path = os.path.join(classifier_path, 'test')
-
-fp = open(os.path.join('meta', 'clf_test.csv'), 'w')
-fp.write('filepath, plane, class\n')
-
-cnt = 0
-bar = ProgressBar(maxval=len(test_path), widgets=[Bar('=', '[', ']'), ' ', Percentage()]).start()
-
-for path, method in list(zip(test_path, test_type)):
-    # Read the files from test set, standardize them, save the numpy array
-    # for each file read as compressed zip, and generate a meta file called
-    # ae_train.csv that can be referenced later to feed the models.
-    img = None
-    if method == 4:
-        img = np.load(path)['T2 ax']
-        dim1 = max(img.shape[:2]) - img.shape[0]
-        dim2 = max(img.shape[:2]) - img.shape[1]
-        if dim1 != 0 or dim2 != 0:
-            pad = np.pad(img, ((math.ceil(dim1 / 2.0), math.floor(dim1 / 2.0)),
-                               (math.ceil(dim2 / 2.0), math.floor(dim2 / 2.0)), (0, 0)),
-                         mode='constant', constant_values=0)
-            img = resize(pad, (256, 256), mode='constant', clip=True, preserve_range=True)
-        img = img.transpose((2, 0, 1))
+        for task in tasks:
+            yield function(task)
+
+
+def bounding_box(img):
+    '''
+    Finds the box of a volume outside which every slice is zero, which is
+    the padding to a square and the empty background around the brain.
+
+    Parameters
+    ----------
+    img: ndarray
+        array of slices with shape (slices, height, width)
+
+    Returns
+    -------
+    list or None
+        (top, bottom, left, right) of the box, None if the volume is zero
+    '''
+    rows = np.flatnonzero(img.any(axis=(0, 2)))
+    cols = np.flatnonzero(img.any(axis=(0, 1)))
+    if len(rows) == 0:
+        return None
+    return [int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1]
+
+
+def process_volume(task):
+    '''
+    Reads a volume, standardizes it and saves the numpy array in the storage
+    format. Runs inside the worker processes, so it only depends on its task.
+
+    If crop is True, only the bounding box of the volume is saved, along with
+    the standardized zero to pad it back with, so the volume loads exactly as
+    if it was not cropped.
+
+    Parameters
+    ----------
+    task: tuple
+        (reader function, source path, type of the volume, output path
+         without extension, storage format, whether to crop the volume)
+
+    Returns
+    -------
+    tuple
+        (number of slices, statistics) of the standardized volume, the
+        signatures of the source files and the fraction of foreground pixels
+        of each slice
+    '''
+    reader, path, method, filepath, fmt, crop = task
+    sources = [file_signature(x) for x in (path if isinstance(path, list) else [path])]
+    img = reader(path, method)
+    box = bounding_box(img) if crop else None
+    img, raw, stats = standardize(img)
+    # foreground of the raw volume, in the standardized volume
+    level = (foreground * raw['max'] - raw['mean']) / np.sqrt(raw['m2'] / raw['count'])
+    fractions = [round(float(x), 4) for x in (img > level).mean(axis=(1, 2))]
+    if box is None:
+        save_volume(filepath, img, fmt)
     else:
-        img = []
-        for filename in path:
-            arr = pdc.dcmread(filename).pixel_array
-            dim1 = max(arr.shape) - arr.shape[0]
-            dim2 = max(arr.shape) - arr.shape[1]
-            if dim1 != 0 or dim2 != 0:
-                arr = np.pad(arr, ((math.ceil(dim1 / 2.0), math.floor(dim1 / 2.0)),
-                                   (math.ceil(dim2 / 2.0), math.floor(dim2 / 2.0))),
-                             mode='constant', constant_values=0)
-            img.append(resize(arr, (256, 256), mode='constant',
-                              clip=True, preserve_range=True).tolist())
-        img = np.asarray(img)
-
-    img = np.rot90(img, axes=(2, 1))
-    img = (img - img.mean()) / img.std()
-
-    np.savez_compressed(os.path.join(data_test_path, '{:04d}'.format(cnt)), data=img)
-    for k in range(img.shape[0]):
-        fp.write('{}, {}, {}\n'.format(os.path.join(data_test_path, '{:04d}.npz'.format(cnt)), k, method))
-    cnt += 1
-    bar.update(cnt)
-
-bar.finish()
-fp.close()
+        top, bottom, left, right = box
+        fill = (0 - raw['mean']) / np.sqrt(raw['m2'] / raw['count'])
+        save_volume(filepath, img[:, top:bottom, left:right], fmt,
+                    {'box': box, 'shape': list(img.shape[1:]), 'fill': float(fill)})
+    return (img.shape[0], stats, sources, fractions)
+
+
+def materialize_volume(task):
+    '''
+    Preprocesses a volume like process_volume, but into a temporary file
+    which is renamed to the output path once complete, so that other
+    processes reading the output path never see a partially written volume.
+
+    Parameters
+    ----------
+    task: tuple
+        (reader function, source path, type of the volume, output path
+         without extension, storage format, whether to crop the volume)
+
+    Returns
+    -------
+    tuple
+        the result of process_volume
+    '''
+    reader, path, method, filepath, fmt, crop = task
+    tmp = '{}.tmp{}'.format(filepath, os.getpid())
+    result = process_volume((reader, path, method, tmp, fmt, crop))
+    ext = extension(fmt)
+    # the crop is in place before the volume appears
+    if os.path.exists(tmp + ext + '.json'):
+        os.replace(tmp + ext + '.json', filepath + ext + '.json')
+    os.replace(tmp + ext, filepath + ext)
+    return result
+
+
+def count_slices(reader, path, method):
+    '''
+    Returns the number of slices of a volume from the headers of its source
+    files only, without decoding them.
+
+    Parameters
+    ----------
+    reader: function
+        function to read the volume
+    path: str or list
+        path to the volume, or list of paths to the DICOM files
+    method: int
+        type of the volume
+
+    Returns
+    -------
+    int
+        number of slices of the preprocessed volume
+    '''
+    if isinstance(path, list):
+        return len(path)
+    if reader is read_autoencode and method == 1:
+        return len(range(nib.load(path).shape[2])[25:125])
+    with zipfile.ZipFile(path) as archive:
+        with archive.open('T2 ax.npy') as fp:
+            version = np.lib.format.read_magic(fp)
+            if version == (1, 0):
+                shape, _, _ = np.lib.format.read_array_header_1_0(fp)
+            else:
+                shape, _, _ = np.lib.format.read_array_header_2_0(fp)
+    return shape[2]
+
+
+def lazy_split(reader, paths, types, options, sample):
+    '''
+    Lists the volumes of a partition to be preprocessed lazily, by the
+    generators, the first time one of their slices is read.
+
+    Each volume is named in data/lazy after the hash of the paths, sizes and
+    modification times of its source files and of its preprocessing
+    parameters, so a modified source file or parameter never reuses a stale
+    volume. The minima, maxima and statistics of the partition are estimated
+    from a random sample of its volumes, which are preprocessed right away.
+
+    Parameters
+    ----------
+    reader: function
+        function to read a single volume of the partition
+    paths: list
+        list of paths to the volumes
+    types: list
+        list of types of the volumes
+    options: Namespace
+        command line options, the number of worker processes, the storage
+        format and whether to crop the volumes
+    sample: int
+        number of volumes to estimate the minima and maxima from
+
+    Returns
+    -------
+    tuple
+        dictionary of the estimated minima and maxima of the partition, the
+        list of recipes of the volumes, in order, and the estimated
+        statistics of the partition
+    '''
+    volumes = []
+    for path, method in zip(paths, types):
+        sources = path if isinstance(path, list) else [path]
+        params = {'reader': reader.__name__, 'method': int(method), 'store': options.store,
+                  'crop': options.crop}
+        key = json.dumps([[(x, os.stat(x).st_size, os.stat(x).st_mtime) for x in sources], params],
+                         sort_keys=True)
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        volumes.append(dict(params, output=os.path.join(lazy_path, name + extension(options.store)),
+                            sources=path, slices=count_slices(reader, path, method)))
+
+    chosen = sorted(np.random.RandomState(seed).permutation(len(volumes))[:sample])
+    tasks = [(reader, volumes[i]['sources'], volumes[i]['method'], os.path.splitext(volumes[i]['output'])[0],
+              options.store, options.crop) for i in chosen]
+    split_stats = empty()
+    for _, stats, _, _ in imap(materialize_volume, tasks, options.workers):
+        split_stats = combine(split_stats, stats)
+    split_meta = {'min': split_stats['min'], 'max': split_stats['max']}
+    return (split_meta, volumes, split_stats)
+
+
+def write_recipe(recipe_path, volumes):
+    '''
+    Adds the recipes of lazily preprocessed volumes to the recipe file, which
+    the generators read to preprocess the volumes.
+
+    Parameters
+    ----------
+    recipe_path: str
+        path to the recipe file
+    volumes: list
+        list of recipes of the volumes
+
+    Returns
+    -------
+    None
+    '''
+    recipe = {}
+    if os.path.exists(recipe_path):
+        with open(recipe_path, 'r') as fp:
+            recipe = json.load(fp)
+    for volume in volumes:
+        recipe[volume['output']] = dict((key, volume[key]) for key in
+                                        ['reader', 'sources', 'method', 'store', 'crop'])
+    with open(recipe_path + '.tmp', 'w') as fp:
+        json.dump(recipe, fp)
+    os.replace(recipe_path + '.tmp', recipe_path)
+
+
+def transform(reader, method):
+    '''
+    Returns the name of the transform a reader applies to a volume of a
+    type, the same for the readers and types which preprocess a volume the
+    same way, such as the normal brain volumes of the AutoEncoder (method 2)
+    and of the Classifier (method 4).
+
+    Parameters
+    ----------
+    reader: function
+        function to read the volume
+    method: int
+        type of the volume
+
+    Returns
+    -------
+    str
+        name of the transform
+    '''
+    if reader is read_autoencode:
+        return 'brats' if method == 1 else 'normal'
+    return 'normal' if method == 4 else 'dicom'
+
+
+def volume_params(reader, method, options):
+    '''
+    Returns the preprocessing parameters of a volume recorded in the manifest
+
+    With deduplication, the reader and type are replaced by the transform,
+    so that a volume preprocessed the same way by both pipelines is only
+    preprocessed once.
+
+    Parameters
+    ----------
+    reader: function
+        function to read the volume
+    method: int
+        type of the volume
+    options: Namespace
+        command line options, the storage format, whether to crop and to
+        deduplicate the volumes
+
+    Returns
+    -------
+    dict
+        the preprocessing parameters
+    '''
+    if options.dedup:
+        params = {'transform': transform(reader, method), 'store': options.store}
+    else:
+        params = {'reader': reader.__name__, 'method': int(method), 'store': options.store}
+    if options.crop:
+        params['crop'] = True
+    return params
+
+
+def store_object(key):
+    '''
+    Returns the path of an object in the content-addressed store, without
+    extension, in a subdirectory named after the first two characters of
+    its key so that no directory grows too large.
+
+    Parameters
+    ----------
+    key: str
+        hexadecimal key of the object
+
+    Returns
+    -------
+    str
+        path to the object
+    '''
+    path = os.path.join(store_path, key[:2])
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, key)
+
+
+def content_key(task):
+    '''
+    Returns the key of a volume in the content-addressed store, the hash of
+    the contents of its source files and of its preprocessing parameters.
+    Runs inside the worker processes, so it only depends on its task.
+
+    Parameters
+    ----------
+    task: tuple
+        (source path, preprocessing parameters)
+
+    Returns
+    -------
+    tuple
+        (key of the volume, signatures of the source files)
+    '''
+    path, params = task
+    signatures = [file_signature(x) for x in (path if isinstance(path, list) else [path])]
+    key = json.dumps([[x['sha1'] for x in signatures], params], sort_keys=True)
+    return (hashlib.sha1(key.encode('utf-8')).hexdigest(), signatures)
+
+
+def preprocess_split(reader, paths, types, data_path, options, manifest):
+    '''
+    Preprocesses all the volumes of a partition and save the numpy array for
+    each volume as {:04d}.npz (or {:04d}.npy).
+
+    The volumes are farmed out to a pool of worker processes, and the results
+    are collected in order, so the numbering of the volumes does not depend
+    on the number of workers. Volumes recorded in the manifest with unchanged
+    source files are reused, and renamed if their position in the partition
+    changed, instead of being preprocessed again.
+
+    With several shards, only the volumes of the shard are preprocessed, and
+    keep their number in the whole partition. Reused volumes are not renamed,
+    since their new position may belong to another shard running meanwhile.
+
+    With deduplication, the volumes are saved in the content-addressed store
+    instead, named after the hash of the contents of their source files and
+    of their parameters, and a volume already in the store is reused
+    whichever partition, pipeline or source path it was preprocessed for.
+
+    Parameters
+    ----------
+    reader: function
+        function to read a single volume of the partition
+    paths: list
+        list of paths to the volumes
+    types: list
+        list of types of the volumes
+    data_path: str
+        directory to save the preprocessed volumes in
+    options: Namespace
+        command line options, the number of worker processes, the storage
+        format and whether to deduplicate the volumes
+    manifest: Manifest
+        manifest of the preprocessed volumes
+
+    Returns
+    -------
+    tuple
+        dictionary of the minima and maxima of the partition, the list of
+        records of the preprocessed volumes of the shard, in order, and the
+        statistics of the partition
+    '''
+    split_stats = empty()
+    ext = extension(options.store)
+    tasks = [(reader, path, method, os.path.join(data_path, '{:04d}'.format(cnt)), options.store, options.crop)
+             for cnt, (path, method) in enumerate(zip(paths, types))]
+    tasks = shard(tasks, options)
+
+    # look up the volumes which can be reused from the manifest
+    records = []
+    for (_, path, method, filepath, _, _) in tasks:
+        sources = path if isinstance(path, list) else [path]
+        params = volume_params(reader, method, options)
+        record = manifest.lookup(sources, params)
+        if record is not None and 'stats' not in record:
+            # recorded before the statistics of the volumes were gathered
+            record = None
+        if record is not None and options.num_shards > 1 and record['output'] != filepath + ext:
+            record = None
+        records.append((sources, params, record))
+
+    if options.dedup:
+        # name the other volumes after their contents, and reuse those
+        # already in the store
+        keys = imap(content_key, [(path, params) for (_, path, _, _, _, _), (_, params, record)
+                                  in zip(tasks, records) if record is None], options.workers)
+        named = []
+        for task, (sources, params, record) in zip(tasks, records):
+            if record is None:
+                key, signatures = next(keys)
+                task = task[:3] + (store_object(key),) + task[4:]
+                record = manifest.records.get(task[3] + ext)
+                if record is not None and 'stats' in record and os.path.exists(record['output']):
+                    record = dict(record, key=record_key(sources, params), sources=signatures)
+                    manifest.add(record)
+                else:
+                    record = None
+            named.append((task, (sources, params, record)))
+        tasks = [task for task, _ in named]
+        records = [record for _, record in named]
+
+    # move the reused volumes to their new position in two steps, so that
+    # swapped volumes do not overwrite each other
+    moves = [(record, filepath + ext) for (_, _, _, filepath, _, _), (_, _, record) in zip(tasks, records)
+             if record is not None and record['output'] != filepath + ext and not options.dedup]
+    moves = [(manifest.move(record, record['output'] + '.move'), output) for record, output in moves]
+    moves = dict((output, manifest.move(record, output)) for record, output in moves)
+    records = [(sources, params, moves.get(filepath + ext, record))
+               for (_, _, _, filepath, _, _), (sources, params, record) in zip(tasks, records)]
+
+    # volumes with the same contents are preprocessed once
+    pending = []
+    outputs = set()
+    for task, (_, _, record) in zip(tasks, records):
+        if record is None and task[3] not in outputs:
+            pending.append(task)
+            outputs.add(task[3])
+    results = imap(process_volume, pending, options.workers)
+
+    volumes = []
+    done = {}
+    bar = ProgressBar(maxval=len(tasks), widgets=[Bar('=', '[', ']'), ' ', Percentage()]).start()
+    for (_, _, _, filepath, _, _), (sources, params, record) in zip(tasks, records):
+        if record is None and filepath + ext in done:
+            # same contents as a volume preprocessed just before
+            record = done[filepath + ext]
+        if record is None:
+            slices, stats, signatures, fractions = next(results)
+            record = {'output': filepath + ext, 'key': record_key(sources, params),
+                      'sources': signatures, 'params': params,
+                      'slices': slices, 'min': stats['min'], 'max': stats['max'],
+                      'stats': stats, 'foreground': fractions}
+            manifest.add(record)
+            done[record['output']] = record
+        # combine the statistics of each volume into the partition's
+        split_stats = combine(split_stats, record['stats'])
+        volumes.append(record)
+        bar.update(len(volumes))
+    bar.finish()
+    split_meta = {'min': split_stats['min'], 'max': split_stats['max']}
+    return (split_meta, volumes, split_stats)
+
+
+def quantize_volume(task):
+    '''
+    Scales a preprocessed volume to uint8 with the minima and maxima of the
+    training partition and saves it as .u8.npy, keeping the crop of the
+    volume. Runs inside the worker processes, so it only depends on its task.
+
+    Parameters
+    ----------
+    task: tuple
+        (path to the preprocessed volume, path to save the uint8 volume at
+         without extension, dictionary of the minima and maxima)
+
+    Returns
+    -------
+    dict
+        signature of the preprocessed volume
+    '''
+    path, filepath, min_max = task
+    source = file_signature(path)
+    img, crop = load_cropped(path)
+    if crop is not None:
+        crop = dict(crop, fill=int(quantize(np.float64(crop['fill']), min_max)))
+    save_volume(filepath, quantize(img, min_max), 'npy', crop)
+    return source
+
+
+def quantized_path(path, params):
+    '''
+    Returns the path to save the uint8 copy of a preprocessed volume at,
+    next to the volume, or in the content-addressed store under the hash of
+    the volume and the minima and maxima, since a volume of the store can
+    be quantized with the minima and maxima of both pipelines.
+
+    Parameters
+    ----------
+    path: str
+        path to the preprocessed volume
+    params: dict
+        quantization parameters
+
+    Returns
+    -------
+    str
+        path to the uint8 volume, without the .npy extension
+    '''
+    if not path.startswith(store_path):
+        return os.path.splitext(path)[0] + '.u8'
+    key = hashlib.sha1(record_key([path], params).encode('utf-8')).hexdigest()
+    return store_object(key) + '.u8'
+
+
+def quantize_split(volumes, min_max, options, manifest):
+    '''
+    Saves a uint8 copy of every preprocessed volume of a partition, scaled
+    the same way the generators scale the slices, so that they can be fed
+    to the models without any arithmetic.
+
+    The uint8 volumes are recorded in the manifest with the preprocessed
+    volume as source and the minima and maxima as parameters, so they are
+    only generated again when either of them changes.
+
+    Parameters
+    ----------
+    volumes: list
+        list of records of the preprocessed volumes of the partition
+    min_max: dict
+        dictionary of the minima and maxima of the training partition
+    options: Namespace
+        command line options, the number of worker processes
+    manifest: Manifest
+        manifest of the preprocessed volumes
+
+    Returns
+    -------
+    list
+        list of records of the uint8 volumes, in order
+    '''
+    params = {'quantize': [min_max['min'], min_max['max']]}
+    records = [manifest.lookup([volume['output']], params) for volume in volumes]
+    tasks = [(volume['output'], quantized_path(volume['output'], params), min_max)
+             for volume, record in zip(volumes, records) if record is None]
+    results = imap(quantize_volume, tasks, options.workers)
+
+    quantized = []
+    for volume, record in zip(volumes, records):
+        if record is None:
+            record = dict(volume, output=quantized_path(volume['output'], params) + '.npy',
+                          key=record_key([volume['output']], params),
+                          sources=[next(results)], params=params)
+            manifest.add(record)
+        elif 'foreground' in volume:
+            # the volume may have been preprocessed again to detect its blank
+            # slices, without any change to its contents
+            record = dict(record, foreground=volume['foreground'])
+        quantized.append(record)
+    return quantized
+
+
+def downsample(img, factor):
+    '''
+    Shrinks the slices of a volume by an integer factor, each pixel being
+    the mean of a factor x factor block, which averages every pixel of the
+    slice instead of sampling some of them like interpolation does.
+
+    Parameters
+    ----------
+    img: ndarray
+        array of slices with shape (slices, height, width), the height and
+        width being multiples of factor
+    factor: int
+        shrinking factor
+
+    Returns
+    -------
+    ndarray
+        array of slices with shape (slices, height / factor, width / factor),
+        rounded back to uint8 if the volume is uint8
+    '''
+    slices, height, width = img.shape
+    if height % factor or width % factor:
+        raise ValueError('slices of {}x{} cannot be shrunk by {}'.format(height, width, factor))
+    out = img.reshape((slices, height // factor, factor, width // factor, factor)).mean(axis=(2, 4))
+    if img.dtype == np.uint8:
+        out = np.rint(out).astype(np.uint8)
+    return out
+
+
+def pyramid_volume(task):
+    '''
+    Saves the levels of the slice pyramid of a preprocessed volume next to
+    it, in the same storage format, keeping the crop of the volume scaled to
+    each level. Runs inside the worker processes, so it only depends on its
+    task.
+
+    Parameters
+    ----------
+    task: tuple
+        (path to the preprocessed volume, list of sizes of the levels to save)
+
+    Returns
+    -------
+    dict
+        signature of the preprocessed volume
+    '''
+    path, sizes = task
+    source = file_signature(path)
+    fmt = volume_format(path)
+    img, crop = load_cropped(path)
+    img = uncrop(img, crop)
+    for size in sizes:
+        factor = img.shape[1] // size
+        level = downsample(img, factor)
+        filepath = os.path.splitext(pyramid_path(path, size))[0]
+        if crop is None:
+            save_volume(filepath, level, fmt)
+        else:
+            # the blocks outside the scaled box only cover the fill value
+            top, bottom, left, right = crop['box']
+            box = [top // factor, -(-bottom // factor), left // factor, -(-right // factor)]
+            save_volume(filepath, level[:, box[0]:box[1], box[2]:box[3]], fmt,
+                        dict(crop, box=box, shape=list(level.shape[1:])))
+    return source
+
+
+def pyramid_split(volumes, options, manifest):
+    '''
+    Saves the lower levels of the slice pyramid of every volume of a
+    partition, so that the generators feed smaller slices to the models
+    without resizing them.
+
+    Each level is recorded in the manifest with the volume as source and its
+    size as parameter, so the levels are only generated again when the
+    volume changes.
+
+    Parameters
+    ----------
+    volumes: list
+        list of records of the volumes of the partition, as listed in the
+        meta files
+    options: Namespace
+        command line options, the number of worker processes
+    manifest: Manifest
+        manifest of the preprocessed volumes
+
+    Returns
+    -------
+    None
+    '''
+    sizes = levels[1:]
+    missing = [volume for volume in volumes
+               if any(manifest.lookup([volume['output']], {'pyramid': size}) is None for size in sizes)]
+    results = imap(pyramid_volume, [(volume['output'], sizes) for volume in missing], options.workers)
+    for volume in missing:
+        source = next(results)
+        for size in sizes:
+            params = {'pyramid': size}
+            manifest.add(dict(volume, output=pyramid_path(volume['output'], size),
+                              key=record_key([volume['output']], params),
+                              sources=[source], params=params))
+
+
+def meta_lines(volumes, types, labelled, drop_blank=None):
+    '''
+    Returns the lines of the meta file listing every slice of volumes
+
+    Parameters
+    ----------
+    volumes: list
+        list of records of the volumes
+    types: list
+        list of types of the volumes
+    labelled: boolean
+        whether to write the type of the volume as class
+    drop_blank: float or None
+        minimum fraction of foreground pixels of the slices to keep
+
+    Returns
+    -------
+    list
+        list of lines, without the header
+    '''
+    lines = []
+    for volume, method in zip(volumes, types):
+        for k in range(volume['slices']):
+            if drop_blank is not None and volume['foreground'][k] < drop_blank:
+                continue
+            if labelled:
+                lines.append('{}, {}, {}\n'.format(volume['output'], k, method))
+            else:
+                lines.append('{}, {}\n'.format(volume['output'], k))
+    return lines
+
+
+def write_meta(meta_path, volumes, types, labelled, drop_blank=None):
+    '''
+    Generates the meta file listing every slice of the volumes of a
+    partition, that can be referenced later to feed the models, along with
+    its slice index.
+
+    If drop_blank is given, the slices with a smaller fraction of foreground
+    pixels are left out of the meta file.
+
+    Parameters
+    ----------
+    meta_path: str
+        path of the meta file to generate
+    volumes: list
+        list of records of the volumes of the partition
+    types: list
+        list of types of the volumes
+    labelled: boolean
+        whether to write the type of the volume as class in the meta file
+    drop_blank: float or None
+        minimum fraction of foreground pixels of the slices to keep
+
+    Returns
+    -------
+    None
+    '''
+    with open(meta_path, 'w') as fp:
+        fp.write('filepath, plane, class\n' if labelled else 'filepath, plane\n')
+        fp.writelines(meta_lines(volumes, types, labelled, drop_blank))
+    index_meta(meta_path)
+
+
+def autoencode(sets, index, options, manifest):
+    '''
+    Preprocesses the AutoEncoder partitions, saves the minima and maxima
+    of the training partition in ae_meta.json, its statistics and histogram
+    in ae_stats.json, and generates the meta files. In lazy mode, the
+    volumes are only listed in the recipe file, and the minima and maxima
+    are estimated from a sample.
+    With several shards, the meta files only cover the volumes of the shard
+    and are merged later on.
+
+    Parameters
+    ----------
+    sets: dict
+        dictionary of the set of files to be considered, keyed by category
+    index: DataFrame
+        index of the source files
+    options: Namespace
+        command line options
+    manifest: Manifest
+        manifest of the preprocessed volumes
+
+    Returns
+    -------
+    None
+    '''
+    meta_path = get_meta_path(options)
+    train_path, valid_path, train_type, valid_type = get_autoencode_files(sets['normal'], index)
+
+    if options.lazy:
+        autoencode_meta, train_volumes, autoencode_stats = \
+            lazy_split(read_autoencode, train_path, train_type, options, options.lazy_sample)
+        _, valid_volumes, _ = lazy_split(read_autoencode, valid_path, valid_type, options, 0)
+        write_recipe(os.path.join(meta_path, 'recipe.json'), train_volumes + valid_volumes)
+    else:
+        # dictionary to store the minima and maxima of Brain MRI in training subset
+        autoencode_meta, train_volumes, autoencode_stats = \
+            preprocess_split(read_autoencode, train_path, train_type,
+                             os.path.join(autoencode_path, 'train'), options, manifest)
+        _, valid_volumes, _ = preprocess_split(read_autoencode, valid_path, valid_type,
+                                               os.path.join(autoencode_path, 'valid'),
+                                               options, manifest)
+    # save the minima and maxima dictionary in meta directory.
+    with open(os.path.join(meta_path, 'ae_meta.json'), 'w') as fp:
+        json.dump(autoencode_meta, fp)
+    save_stats(os.path.join(meta_path, 'ae_stats.json'), autoencode_stats)
+
+    if options.quantize and options.num_shards == 1:
+        train_volumes = quantize_split(train_volumes, autoencode_meta, options, manifest)
+        valid_volumes = quantize_split(valid_volumes, autoencode_meta, options, manifest)
+    if options.pyramid and options.num_shards == 1:
+        pyramid_split(train_volumes + valid_volumes, options, manifest)
+
+    write_meta(os.path.join(meta_path, 'ae_train.csv'), train_volumes, shard(train_type, options),
+               False, options.drop_blank)
+    write_meta(os.path.join(meta_path, 'ae_valid.csv'), valid_volumes, shard(valid_type, options),
+               False, options.drop_blank)
+
+
+def classify(sets, index, options, manifest):
+    '''
+    Preprocesses the Classifier partitions, saves the minima and maxima
+    of the training partition in clf_meta.json, its statistics and histogram
+    in clf_stats.json, and generates the meta files. In lazy mode, the
+    volumes are only listed in the recipe file, and the minima and maxima
+    are estimated from a sample.
+    With several shards, the meta files only cover the volumes of the shard
+    and are merged later on.
+
+    Parameters
+    ----------
+    sets: dict
+        dictionary of the set of files to be considered, keyed by category
+    index: DataFrame
+        index of the source files
+    options: Namespace
+        command line options
+    manifest: Manifest
+        manifest of the preprocessed volumes
+
+    Returns
+    -------
+    None
+    '''
+    train_path, valid_path, test_path, train_type, valid_type, test_type = \
+        get_classifier_files(sets, index, os.path.join('data', 'cache'), options.workers)
+    meta_path = get_meta_path(options)
+
+    if options.lazy:
+        class_meta, train_volumes, class_stats = \
+            lazy_split(read_classifier, train_path, train_type, options, options.lazy_sample)
+        _, valid_volumes, _ = lazy_split(read_classifier, valid_path, valid_type, options, 0)
+        _, test_volumes, _ = lazy_split(read_classifier, test_path, test_type, options, 0)
+        write_recipe(os.path.join(meta_path, 'recipe.json'), train_volumes + valid_volumes + test_volumes)
+    else:
+        # dictionary to store the minima and maxima of Brain MRI in training subset
+        class_meta, train_volumes, class_stats = \
+            preprocess_split(read_classifier, train_path, train_type,
+                             os.path.join(classifier_path, 'train'), options, manifest)
+        _, valid_volumes, _ = preprocess_split(read_classifier, valid_path, valid_type,
+                                               os.path.join(classifier_path, 'valid'),
+                                               options, manifest)
+        _, test_volumes, _ = preprocess_split(read_classifier, test_path, test_type,
+                                              os.path.join(classifier_path, 'test'),
+                                              options, manifest)
+    # save the minima and maxima dictionary in meta directory.
+    with open(os.path.join(meta_path, 'clf_meta.json'), 'w') as fp:
+        json.dump(class_meta, fp)
+    save_stats(os.path.join(meta_path, 'clf_stats.json'), class_stats)
+
+    if options.quantize and options.num_shards == 1:
+        train_volumes = quantize_split(train_volumes, class_meta, options, manifest)
+        valid_volumes = quantize_split(valid_volumes, class_meta, options, manifest)
+        test_volumes = quantize_split(test_volumes, class_meta, options, manifest)
+    if options.pyramid and options.num_shards == 1:
+        pyramid_split(train_volumes + valid_volumes + test_volumes, options, manifest)
+
+    write_meta(os.path.join(meta_path, 'clf_train.csv'), train_volumes, shard(train_type, options),
+               True, options.drop_blank)
+    write_meta(os.path.join(meta_path, 'clf_valid.csv'), valid_volumes, shard(valid_type, options),
+               True, options.drop_blank)
+    write_meta(os.path.join(meta_path, 'clf_test.csv'), test_volumes, shard(test_type, options),
+               True, options.drop_blank)
+
+
+def merge(options, manifest):
+    '''
+    Merges the meta files of the shards into the meta directory: the rows of
+    the meta files are concatenated in the order of the volumes, and the
+    minima, maxima and statistics of the training partitions are combined.
+    The manifests
+    of the shards are merged into the manifest, and the volumes are
+    quantized with the merged minima and maxima, and their slice pyramid
+    saved, if requested.
+
+    Parameters
+    ----------
+    options: Namespace
+        command line options, the number of shards
+    manifest: Manifest
+        manifest of the preprocessed volumes
+
+    Returns
+    -------
+    None
+    '''
+    shard_paths = [os.path.join('meta', 'shards', str(i)) for i in range(options.num_shards)]
+    for shard_path in shard_paths:
+        for name in meta_files['ae'] + meta_files['clf']:
+            if not os.path.exists(os.path.join(shard_path, name)):
+                raise IOError('{} is missing, the shard did not complete'.format(os.path.join(shard_path, name)))
+
+    for shard_path in shard_paths:
+        shard_manifest = Manifest(os.path.join(shard_path, 'manifest.jsonl'))
+        for output in sorted(shard_manifest.records.keys()):
+            manifest.add(shard_manifest.records[output])
+        shard_manifest.close()
+
+    for key in ['ae', 'clf']:
+        stats = empty()
+        for shard_path in shard_paths:
+            stats = combine(stats, load_stats(os.path.join(shard_path, '{}_stats.json'.format(key))))
+        min_max = {'min': stats['min'], 'max': stats['max']}
+        with open(os.path.join('meta', '{}_meta.json'.format(key)), 'w') as fp:
+            json.dump(min_max, fp)
+        save_stats(os.path.join('meta', '{}_stats.json'.format(key)), stats)
+
+        for name in [x for x in meta_files[key] if x.endswith('.csv')]:
+            header = None
+            rows = []
+            for shard_path in shard_paths:
+                with open(os.path.join(shard_path, name), 'r') as fp:
+                    header = fp.readline()
+                    rows.extend(line.rstrip('\n').split(', ') for line in fp)
+            # the volumes are numbered in the whole partition, and their
+            # names are zero-padded to 4 digits, which more volumes exceed
+            rows.sort(key=lambda x: (int(os.path.splitext(os.path.basename(x[0]))[0]), int(x[1])))
+            if options.quantize:
+                outputs = sorted(set(x[0] for x in rows))
+                volumes = quantize_split([manifest.records[x] for x in outputs], min_max, options, manifest)
+                outputs = dict(zip(outputs, [x['output'] for x in volumes]))
+                rows = [[outputs[x[0]]] + x[1:] for x in rows]
+            if options.pyramid:
+                pyramid_split([manifest.records[x] for x in sorted(set(x[0] for x in rows))],
+                              options, manifest)
+            with open(os.path.join('meta', name), 'w') as fp:
+                fp.write(header)
+                for row in rows:
+                    fp.write(', '.join(row) + '\n')
+            index_meta(os.path.join('meta', name))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Clean, resize and partition the source data.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes to preprocess the volumes with')
+    parser.add_argument('--store', choices=sorted(formats.keys()), default='npz',
+                        help='storage format of the preprocessed volumes')
+    parser.add_argument('--codec', default='zlib',
+                        help='codec of the vol storage format, one of {}, optionally followed by '
+                             '+shuffle to shuffle the bytes before compressing them'
+                             .format(', '.join(sorted(codecs.keys()))))
+    parser.add_argument('--quantize', action='store_true',
+                        help='also save the volumes as uint8, scaled with the training minima and '
+                             'maxima, and reference them in the meta files')
+    parser.add_argument('--crop', action='store_true',
+                        help='save only the box of each volume outside which every slice is zero, '
+                             'and pad the slices back when loading them')
+    parser.add_argument('--drop-blank', type=float, default=None, metavar='FRACTION',
+                        help='leave the slices with a smaller fraction of foreground pixels out of '
+                             'the meta files')
+    parser.add_argument('--pyramid', action='store_true',
+                        help='also save every volume listed in the meta files with slices of {}, '
+                             'next to it, for the generators to feed smaller slices to the models'
+                             .format(' and '.join('{0}x{0}'.format(x) for x in levels[1:])))
+    parser.add_argument('--dedup', action='store_true',
+                        help='save the volumes in a content-addressed store, data/store, named after '
+                             'the hash of their source files and parameters, so that a volume '
+                             'shared by partitions or pipelines is preprocessed and stored once')
+    parser.add_argument('--force', action='store_true',
+                        help='ignore the manifest and preprocess every volume again')
+    parser.add_argument('--rescan', action='store_true',
+                        help='list every source directory again, instead of the directories modified '
+                             'since the last run')
+    parser.add_argument('--lazy', action='store_true',
+                        help='only list the volumes in meta/recipe.json and the meta files, and let '
+                             'the generators preprocess each volume the first time it is read')
+    parser.add_argument('--lazy-sample', type=int, default=8,
+                        help='number of training volumes to preprocess right away in lazy mode, '
+                             'to estimate the minima and maxima from')
+    parser.add_argument('--num-shards', type=int, default=1,
+                        help='number of shards to split the volumes of each partition in, to '
+                             'preprocess them in separate runs, on one or several nodes')
+    parser.add_argument('--shard-index', type=int, default=0,
+                        help='index of the shard to preprocess, the meta files are written in '
+                             'meta/shards/<index> and --quantize is deferred to --merge')
+    parser.add_argument('--merge', action='store_true',
+                        help='merge the meta files of the --num-shards shards into meta')
+    args = parser.parse_args()
+    try:
+        parse_codec(args.codec)
+    except ValueError as e:
+        parser.error(str(e))
+    args.store = store_format(args.store, args.codec)
+    if not 0 <= args.shard_index < args.num_shards:
+        parser.error('--shard-index must be between 0 and --num-shards - 1')
+    if args.lazy and (args.quantize or args.pyramid or args.drop_blank is not None or args.num_shards > 1
+                      or args.merge):
+        parser.error('--lazy cannot be combined with --quantize, --pyramid, --drop-blank or sharding')
+    if args.dedup and (args.lazy or args.num_shards > 1 or args.merge):
+        parser.error('--dedup cannot be combined with --lazy or sharding')
+
+    if args.merge:
+        manifest = Manifest(os.path.join('meta', 'manifest.jsonl'))
+        merge(args, manifest)
+        manifest.close()
+    else:
+        meta_path = get_meta_path(args)
+        prepare_folders(meta_path)
+        manifest_path = os.path.join(meta_path, 'manifest.jsonl')
+        if args.force and os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        # meta files of a previous run of the shard
+        for name in meta_files['ae'] + meta_files['clf']:
+            if args.num_shards > 1 and os.path.exists(os.path.join(meta_path, name)):
+                os.remove(os.path.join(meta_path, name))
+        manifest = Manifest(manifest_path)
+        sets = get_metadata_sets(os.path.join('data', 'cache'))
+        index = scan_source(os.path.join('data', 'cache'), args.workers, args.rescan)
+        autoencode(sets, index, args, manifest)
+        classify(sets, index, args, manifest)
+        manifest.close()
@@ -0,0 +1,51 @@
+# import libraries
+from sliceindex import SliceIndex
+import pandas as pd
+import numpy as np
+
+
+def volume_ids(files):
+    '''
+    Numbers the volumes of the rows of a meta file
+
+    Parameters
+    ----------
+    files: list or SliceIndex
+        rows of the meta file
+
+    Returns
+    -------
+    ndarray
+        number of the volume of each row
+    '''
+    if isinstance(files, SliceIndex):
+        return np.asarray(files.index['volume'])
+    return pd.factorize([row[0] for row in files])[0]
+
+
+def block_shuffle(volumes, window, prng):
+    '''
+    Shuffles the order of the volumes, then the slices within each window
+    of window consecutive volumes, so that a mini-batch draws its slices
+    from a handful of volumes instead of one volume per slice, while the
+    volumes and slices are still seen in a new random order every epoch.
+
+    Parameters
+    ----------
+    volumes: ndarray
+        number of the volume of each slice
+    window: int
+        number of volumes whose slices are shuffled together
+    prng: RandomState
+        random number generator
+
+    Returns
+    -------
+    ndarray
+        the shuffled indexes of the slices
+    '''
+    rank = np.empty(volumes.max() + 1 if len(volumes) else 0, dtype=np.intp)
+    rank[prng.permutation(len(rank))] = np.arange(len(rank))
+    indexes = prng.permutation(len(volumes))
+    # stable, so the slices of a window keep their shuffled order
+    return indexes[np.argsort(rank[volumes[indexes]] // window, kind='mergesort')]
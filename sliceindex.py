@@ -0,0 +1,160 @@
+# import libraries
+import pandas as pd
+import numpy as np
+import json
+import sys
+import os
+
+
+# one row per slice, the volume is the position of its path in the path table
+# and the class is -1 in the meta files without class
+dtype = np.dtype([('volume', '<u4'), ('plane', '<u2'), ('class', 'i1')])
+
+
+def index_paths(meta_path):
+    '''
+    Returns the paths to the slice index and path table of a meta file
+
+    Parameters
+    ----------
+    meta_path: str
+        path to the meta file, meta/<name>.csv
+
+    Returns
+    -------
+    tuple
+        (path to meta/<name>.idx.npy, path to meta/<name>.paths.json)
+    '''
+    base = os.path.splitext(meta_path)[0]
+    return (base + '.idx.npy', base + '.paths.json')
+
+
+def index_meta(meta_path):
+    '''
+    Builds the slice index of a meta file: a typed array of the volume,
+    plane and class of every slice, saved as .npy to be memory mapped, and
+    the table of the paths to the volumes, each saved once.
+
+    The path table is replaced first, so that a slice index replaced
+    meanwhile only refers to volumes in the path table, the volumes of a
+    meta file being only ever appended.
+
+    Parameters
+    ----------
+    meta_path: str
+        path to the meta file, meta/<name>.csv
+
+    Returns
+    -------
+    None
+    '''
+    meta = pd.read_csv(meta_path)
+    volumes, paths = pd.factorize(meta.iloc[:, 0])
+    labelled = meta.shape[1] > 2
+    index = np.empty(len(meta), dtype=dtype)
+    index['volume'] = volumes
+    index['plane'] = meta.iloc[:, 1].values
+    index['class'] = meta.iloc[:, 2].values if labelled else -1
+
+    index_path, table_path = index_paths(meta_path)
+    with open(table_path + '.tmp', 'w') as fp:
+        json.dump({'paths': paths.tolist(), 'labelled': labelled}, fp)
+    os.replace(table_path + '.tmp', table_path)
+    with open(index_path + '.tmp', 'wb') as fp:
+        np.save(fp, index)
+    os.replace(index_path + '.tmp', index_path)
+
+
+class SliceIndex(object):
+    def __init__(self, meta_path):
+        '''
+        Init method for SliceIndex class
+
+        The slice index reads like the list of rows of its meta file, each
+        row a (filepath, plane, class) or (filepath, plane) tuple, but keeps
+        the slices in a memory mapped array. Only the path of the meta file
+        is pickled, so the worker processes of the generators map the array
+        themselves instead of receiving a copy of every row.
+
+        Parameters
+        ----------
+        meta_path: str
+            path to the meta file, meta/<name>.csv
+
+        Returns
+        -------
+        None
+        '''
+        self.meta_path = meta_path
+        self.__load()
+
+    def __load(self):
+        index_path, table_path = index_paths(self.meta_path)
+        with open(table_path, 'r') as fp:
+            table = json.load(fp)
+        self.paths = table['paths']
+        self.labelled = table['labelled']
+        self.index = np.load(index_path, mmap_mode='r')
+
+    def __getstate__(self):
+        return {'meta_path': self.meta_path}
+
+    def __setstate__(self, state):
+        self.meta_path = state['meta_path']
+        self.__load()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, k):
+        '''
+        Returns the row of the k'th slice
+
+        Parameters
+        ----------
+        k: int
+            position of the slice
+
+        Returns
+        -------
+        tuple
+            (filepath, plane, class) of the slice, or (filepath, plane) if
+            the meta file has no class
+        '''
+        row = self.index[k]
+        if self.labelled:
+            return (self.paths[row['volume']], int(row['plane']), int(row['class']))
+        return (self.paths[row['volume']], int(row['plane']))
+
+
+def load_index(meta_path):
+    '''
+    Loads the rows of a meta file from its slice index, or from the meta file
+    itself if it has no index or was written after its index.
+
+    Parameters
+    ----------
+    meta_path: str
+        path to the meta file, meta/<name>.csv
+
+    Returns
+    -------
+    SliceIndex or list
+        the rows of the meta file
+    '''
+    index_path, table_path = index_paths(meta_path)
+    if os.path.exists(index_path) and os.path.exists(table_path) and \
+            os.stat(index_path).st_mtime >= os.stat(meta_path).st_mtime:
+        return SliceIndex(meta_path)
+    return pd.read_csv(meta_path).values.tolist()
+
+
+if __name__ == '__main__':
+    # index the meta files given, or those in meta, written by a previous run
+    meta_paths = sys.argv[1:]
+    if not meta_paths:
+        meta_paths = [os.path.join('meta', x) for x in sorted(os.listdir('meta'))
+                      if x.startswith(('ae_', 'clf_')) and x.endswith('.csv')]
+    for meta_path in meta_paths:
+        index_meta(meta_path)
+        print('Indexed {} slices of {}'.format(len(SliceIndex(meta_path)), meta_path))
@@ -0,0 +1,103 @@
+# import libraries
+from multiprocessing.pool import ThreadPool
+from metadata import read_cache, write_cache
+import pandas as pd
+import os
+
+
+st_path = os.path.join('source', '{}', 'Stanford', 'ST_{}_T2_Axial', 'no_roi')
+se_path = os.path.join('source', '{}', 'Seattle', 'SE_{}_T2_Axial', 'no_roi')
+brats_path = os.path.join('source', 'Task01_BrainTumour')
+
+# (category key, directory, index of the '-' separated part of the file
+#  names holding the patient ID, index of the part holding the series key)
+directories = [('dipg', st_path.format('DIPG', 'DIPG'), 0, 3),
+               ('se_dipg', se_path.format('DIPG', 'DIPG'), 0, 3),
+               ('ep', st_path.format('EP', 'PF-EP'), 1, 4),
+               ('se_ep', se_path.format('EP', 'PF-EP'), 1, 4),
+               ('mb', st_path.format('MB', 'PF-MB'), 1, 4),
+               ('se_mb', se_path.format('MB', 'PF-MB'), 1, 4),
+               ('pilo', st_path.format('PILO', 'PF-PILO'), 1, 4),
+               ('normal', os.path.join('source', 'Normal'), None, None),
+               ('brats_train', os.path.join(brats_path, 'imagesTr'), None, None),
+               ('brats_valid', os.path.join(brats_path, 'imagesTs'), None, None)]
+
+columns = ['path', 'name', 'category', 'parts', 'pid', 'series', 'group']
+
+
+def scan_directory(path):
+    '''
+    Lists the files of a source directory, leaving out the hidden files
+
+    Parameters
+    ----------
+    path: str
+        path to the directory
+
+    Returns
+    -------
+    list
+        list of the names of the files, sorted, empty if the directory does
+        not exist
+    '''
+    if not os.path.isdir(path):
+        return []
+    return sorted(entry.name for entry in os.scandir(path)
+                  if entry.is_file() and not entry.name.startswith('.'))
+
+
+def scan_source(cache_path, workers, rescan=False):
+    '''
+    Builds the index of the files of every source directory
+
+    The directories are listed concurrently, and the listing of each
+    directory is cached in cache_path along with the modification time of
+    the directory, so only the directories in which files were added,
+    removed or renamed since the last run are listed again. The files
+    themselves are never stat'ed, as their metadata is the slow part on
+    network file systems.
+
+    Parameters
+    ----------
+    cache_path: str
+        directory to store the index in
+    workers: int
+        number of directories to list concurrently
+    rescan: boolean
+        whether to list every directory again, ignoring the cache
+
+    Returns
+    -------
+    DataFrame
+        index of the source files with the columns in sourceindex.columns,
+        the patient ID, series key and group (patient ID and series key) of
+        the DICOM files parsed from their names
+    '''
+    cache = os.path.join(cache_path, 'source_index.pkl')
+    listings = {} if rescan else read_cache(cache) or {}
+
+    mtimes = dict((path, os.stat(path).st_mtime if os.path.isdir(path) else None)
+                  for _, path, _, _ in directories)
+    # listings cached with the metadata of the files are listed again
+    pending = [path for _, path, _, _ in directories
+               if path not in listings or listings[path][0] != mtimes[path]
+               or not all(isinstance(x, str) for x in listings[path][1][:1])]
+    pool = ThreadPool(max(1, min(workers, len(pending))))
+    for path, files in zip(pending, pool.map(scan_directory, pending)):
+        listings[path] = (mtimes[path], files)
+    pool.close()
+    pool.join()
+    if pending:
+        write_cache(listings, cache)
+
+    frames = []
+    for key, path, pid, series in directories:
+        index = pd.DataFrame({'name': pd.Series(listings[path][1], dtype=object)})
+        index = index.assign(path=[os.path.join(path, x) for x in index['name']], category=key)
+        parts = index['name'].str.split('-')
+        index = index.assign(parts=parts.str.len())
+        if pid is not None:
+            index = index.assign(pid=parts.str[pid].str[-4:], series=parts.str[series])
+            index = index.assign(group=index['pid'] + '_' + index['series'])
+        frames.append(index)
+    return pd.concat(frames, ignore_index=True, sort=False).reindex(columns=columns)
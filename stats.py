@@ -0,0 +1,202 @@
+# import libraries
+import numpy as np
+import json
+
+
+# fixed bins of the histogram of the standardized intensities, so that the
+# histograms of different volumes and workers can be added together. Values
+# out of the range are counted in the first or last bin.
+hist_range = (-10.0, 40.0)
+hist_bins = 1000
+
+# percentiles saved along with the histogram, to choose the clipping range
+saved_percentiles = [0.1, 0.5, 1, 5, 50, 95, 99, 99.5, 99.9]
+
+
+def empty():
+    '''
+    Returns the statistics of no values at all, the identity of combine
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict
+        dictionary of count, mean, m2 (sum of squared deviations from the
+        mean), min, max and hist (counts of the histogram bins)
+    '''
+    return {'count': 0, 'mean': 0.0, 'm2': 0.0, 'min': float('inf'), 'max': float('-inf'),
+            'hist': [0] * hist_bins}
+
+
+def histogram(arr):
+    '''
+    Counts the values of a chunk in the fixed histogram bins
+
+    Parameters
+    ----------
+    arr: ndarray
+        chunk of values
+
+    Returns
+    -------
+    ndarray
+        counts of the histogram bins
+    '''
+    scale = hist_bins / (hist_range[1] - hist_range[0])
+    index = arr * scale
+    index -= hist_range[0] * scale
+    np.clip(index, 0, hist_bins - 1, out=index)
+    return np.bincount(index.astype(np.intp).ravel('K'), minlength=hist_bins)
+
+
+def combine(a, b):
+    '''
+    Combines the statistics of two disjoint sets of values, with the
+    pairwise update of Chan et al. for the mean and sum of squared deviations
+
+    Parameters
+    ----------
+    a: dict
+        statistics of the first set of values
+    b: dict
+        statistics of the second set of values
+
+    Returns
+    -------
+    dict
+        statistics of the union of the sets of values
+    '''
+    if a['count'] == 0:
+        return dict(b)
+    if b['count'] == 0:
+        return dict(a)
+    count = a['count'] + b['count']
+    delta = b['mean'] - a['mean']
+    stats = {'count': count,
+             'mean': a['mean'] + delta * b['count'] / count,
+             'm2': a['m2'] + b['m2'] + delta ** 2 * a['count'] * b['count'] / count,
+             'min': min(a['min'], b['min']),
+             'max': max(a['max'], b['max'])}
+    if 'hist' in a and 'hist' in b:
+        stats['hist'] = np.add(a['hist'], b['hist']).tolist()
+    return stats
+
+
+def standardize(img, chunk=1 << 18):
+    '''
+    Standardizes a volume to zero mean and unit variance, and gathers the
+    statistics of the raw and standardized volumes on the way.
+
+    The volume is read in chunks of slices small enough to stay in the
+    cache: a first pass accumulates the mean and sum of squared deviations
+    of the chunks, combined as in combine, along with the minimum and
+    maximum, and a second pass writes each standardized chunk and counts it
+    in the histogram. The minima and maxima of the standardized volume are
+    those of the raw volume mapped through the same arithmetic, which
+    preserves their order.
+
+    Parameters
+    ----------
+    img: ndarray
+        array of slices with shape (slices, height, width)
+    chunk: int
+        number of values read at once
+
+    Returns
+    -------
+    tuple
+        (standardized volume, statistics of the raw volume without
+         histogram, statistics of the standardized volume)
+    '''
+    step = max(1, chunk // img[0].size)
+    raw = empty()
+    del raw['hist']
+    for k in range(0, len(img), step):
+        part = img[k:k + step]
+        mean = part.sum(dtype=np.float64) / part.size
+        dev = (part - mean).ravel()
+        raw = combine(raw, {'count': part.size, 'mean': float(mean), 'm2': float(np.dot(dev, dev)),
+                            'min': float(part.min()), 'max': float(part.max())})
+
+    mean = np.float64(raw['mean'])
+    std = np.sqrt(raw['m2'] / raw['count'])
+    out = np.empty(img.shape, dtype=np.result_type(img, mean))
+    hist = np.zeros(hist_bins, dtype=np.int64)
+    for k in range(0, len(img), step):
+        part = out[k:k + step]
+        np.subtract(img[k:k + step], mean, out=part)
+        part /= std
+        hist += histogram(part)
+
+    stats = {'count': raw['count'], 'mean': 0.0, 'm2': float(raw['count']),
+             'min': float((raw['min'] - mean) / std), 'max': float((raw['max'] - mean) / std),
+             'hist': hist.tolist()}
+    return (out, raw, stats)
+
+
+def percentiles(stats, q):
+    '''
+    Estimates percentiles of the values from their histogram, interpolating
+    linearly inside the bins
+
+    Parameters
+    ----------
+    stats: dict
+        statistics of the values, with their histogram
+    q: list
+        list of percentiles, between 0 and 100
+
+    Returns
+    -------
+    list
+        list of the estimated values at the percentiles
+    '''
+    edges = np.linspace(hist_range[0], hist_range[1], hist_bins + 1)
+    cdf = np.concatenate([[0.0], np.cumsum(stats['hist']) / float(stats['count'])])
+    return [float(np.clip(np.interp(x / 100.0, cdf, edges), stats['min'], stats['max'])) for x in q]
+
+
+def save_stats(path, stats):
+    '''
+    Saves the statistics of a partition in a json file, along with their
+    standard deviation, histogram bins and percentiles
+
+    Parameters
+    ----------
+    path: str
+        path to the json file
+    stats: dict
+        statistics of the partition
+
+    Returns
+    -------
+    None
+    '''
+    saved = dict(stats, std=0.0, range=list(hist_range), bins=hist_bins)
+    if stats['count']:
+        saved['std'] = float(np.sqrt(stats['m2'] / stats['count']))
+        saved['percentiles'] = dict(zip(map(str, saved_percentiles), percentiles(stats, saved_percentiles)))
+    with open(path, 'w') as fp:
+        json.dump(saved, fp)
+
+
+def load_stats(path):
+    '''
+    Loads the statistics of a partition saved by save_stats
+
+    Parameters
+    ----------
+    path: str
+        path to the json file
+
+    Returns
+    -------
+    dict
+        statistics of the partition, which can be combined with others
+    '''
+    with open(path, 'r') as fp:
+        saved = json.load(fp)
+    return dict((key, saved[key]) for key in ['count', 'mean', 'm2', 'min', 'max', 'hist'])
@@ -0,0 +1,305 @@
+# import libraries
+from codec import write_vol, read_vol, read_header
+import numpy as np
+import json
+import os
+
+
+# storage formats of the preprocessed volumes, the .vol format is followed
+# by its codec specification, such as 'vol:zstd+shuffle'
+formats = {'npz': '.npz', 'npy': '.npy', 'vol': '.vol'}
+
+# sizes of the levels of the slice pyramid, the first being the size of the
+# preprocessed slices
+levels = [256, 128, 64]
+
+
+def store_format(store, codec):
+    '''
+    Returns the storage format from the command line options
+
+    Parameters
+    ----------
+    store: str
+        storage format, one of the keys of formats
+    codec: str
+        codec specification of the .vol format
+
+    Returns
+    -------
+    str
+        the storage format, along with its codec for the .vol format
+    '''
+    return 'vol:' + codec if store == 'vol' else store
+
+
+def extension(fmt):
+    '''
+    Returns the file extension of a storage format
+
+    Parameters
+    ----------
+    fmt: str
+        storage format
+
+    Returns
+    -------
+    str
+        file extension of the volumes
+    '''
+    return formats[fmt.split(':')[0]]
+
+
+def pyramid_path(path, size):
+    '''
+    Returns the path to the level of a preprocessed volume with slices of
+    size x size, saved next to the volume
+
+    Parameters
+    ----------
+    path: str
+        path to the volume
+    size: int
+        size of the slices of the level, one of levels
+
+    Returns
+    -------
+    str
+        path to the level, the path to the volume itself for the first level
+    '''
+    if size not in levels:
+        raise ValueError('no pyramid level of size {}, the levels are {}'.format(
+            size, ', '.join(str(x) for x in levels)))
+    if size == levels[0]:
+        return path
+    base, ext = os.path.splitext(path)
+    return '{}.{}{}'.format(base, size, ext)
+
+
+def volume_format(path):
+    '''
+    Returns the storage format a preprocessed volume was saved in
+
+    Parameters
+    ----------
+    path: str
+        path to the volume
+
+    Returns
+    -------
+    str
+        storage format, along with its codec for the .vol format
+    '''
+    if not path.endswith('.vol'):
+        return os.path.splitext(path)[1][1:]
+    with open(path, 'rb') as fp:
+        header = read_header(fp)[0]
+    return 'vol:' + header['codec'] + ('+shuffle' if header['shuffle'] else '')
+
+
+def save_volume(filepath, img, fmt='npz', crop=None):
+    '''
+    Saves a preprocessed volume in the given storage format
+
+    'npz' stores the volume as compressed zip, which is smaller on disk but
+    has to be decompressed entirely to read a single slice. 'npy' stores the
+    uncompressed array, which is memory mapped so that a slice is read
+    without touching the rest of the volume. 'vol' compresses each slice
+    separately with the codec given after the format, so that a slice is
+    decompressed alone.
+
+    A cropped volume is saved along with its crop, inside the .npz or the
+    .vol header, or in a .npy.json file next to the .npy, so that it is
+    padded back on loading.
+
+    Parameters
+    ----------
+    filepath: str
+        path to save the volume at, without the extension
+    img: ndarray
+        array of slices with shape (slices, height, width)
+    fmt: str
+        storage format, one of 'npz', 'npy' or 'vol:<codec>'
+    crop: dict or None
+        crop of the volume, with the box (top, bottom, left, right), the
+        shape (height, width) of the uncropped slices and the fill value
+        of the region outside the box, as python numbers
+
+    Returns
+    -------
+    str
+        path of the saved volume, with the extension
+    '''
+    filepath = filepath + extension(fmt)
+    if fmt.startswith('vol'):
+        write_vol(filepath, img, fmt.partition(':')[2] or 'zlib', {'crop': crop})
+        return filepath
+    if fmt == 'npz':
+        if crop is None:
+            np.savez_compressed(filepath, data=img)
+        else:
+            np.savez_compressed(filepath, data=img, box=crop['box'], shape=crop['shape'],
+                                fill=crop['fill'])
+        return filepath
+
+    np.save(filepath, np.ascontiguousarray(img))
+    if crop is not None:
+        with open(filepath + '.json', 'w') as fp:
+            json.dump(crop, fp)
+    elif os.path.exists(filepath + '.json'):
+        # crop of a previous volume saved at the same path
+        os.remove(filepath + '.json')
+    return filepath
+
+
+def quantize(img, min_max):
+    '''
+    Scales a preprocessed volume to uint8 with the minima and maxima of the
+    training partition, exactly as the generators scale each slice
+
+    Parameters
+    ----------
+    img: ndarray
+        preprocessed volume or slice
+    min_max: dict
+        dictionary of the min and max of training dataset.
+
+    Returns
+    -------
+    ndarray
+        the volume or slice as uint8
+    '''
+    return ((img - min_max['min']) * 255.0 / (min_max['max'] - min_max['min'])).astype('uint8')
+
+
+def load_crop(path):
+    '''
+    Loads the crop of a preprocessed volume
+
+    Parameters
+    ----------
+    path: str
+        path to the volume
+
+    Returns
+    -------
+    dict or None
+        the crop of the volume, None if it is not cropped
+    '''
+    if path.endswith('.vol'):
+        with open(path, 'rb') as fp:
+            return read_header(fp)[0]['crop']
+    if path.endswith('.npy'):
+        if not os.path.exists(path + '.json'):
+            return None
+        with open(path + '.json', 'r') as fp:
+            return json.load(fp)
+    return npz_crop(np.load(path))
+
+
+def npz_crop(data):
+    '''
+    Reads the crop of a volume from its opened .npz file
+
+    Parameters
+    ----------
+    data: NpzFile
+        the opened .npz file of the volume
+
+    Returns
+    -------
+    dict or None
+        the crop of the volume, None if it is not cropped
+    '''
+    if 'box' not in data.files:
+        return None
+    return {'box': data['box'].tolist(), 'shape': data['shape'].tolist(), 'fill': data['fill'].item()}
+
+
+def uncrop(img, crop):
+    '''
+    Pads a cropped volume or slice back to its uncropped shape
+
+    Parameters
+    ----------
+    img: ndarray
+        cropped volume or slice, with the height and width as last axes
+    crop: dict or None
+        crop of the volume
+
+    Returns
+    -------
+    ndarray
+        the uncropped volume or slice
+    '''
+    if crop is None:
+        return img
+    top, bottom, left, right = crop['box']
+    full = np.full(img.shape[:-2] + tuple(crop['shape']), crop['fill'], dtype=img.dtype)
+    full[..., top:bottom, left:right] = img
+    return full
+
+
+def load_cropped(path):
+    '''
+    Loads an entire preprocessed volume without padding it back
+
+    Parameters
+    ----------
+    path: str
+        path to the volume
+
+    Returns
+    -------
+    tuple
+        (array of slices, crop of the volume or None)
+    '''
+    if path.endswith('.vol'):
+        img, header = read_vol(path)
+        return (img, header['crop'])
+    if path.endswith('.npy'):
+        return (np.load(path), load_crop(path))
+    data = np.load(path)
+    return (data['data'], npz_crop(data))
+
+
+def load_volume(path):
+    '''
+    Loads an entire preprocessed volume
+
+    Parameters
+    ----------
+    path: str
+        path to the volume
+
+    Returns
+    -------
+    ndarray
+        array of slices with shape (slices, height, width)
+    '''
+    return uncrop(*load_cropped(path))
+
+
+def load_slice(path, k):
+    '''
+    Loads a single slice of a preprocessed volume
+
+    Parameters
+    ----------
+    path: str
+        path to the volume
+    k: int
+        index of the slice
+
+    Returns
+    -------
+    ndarray
+        the slice with shape (height, width)
+    '''
+    if path.endswith('.vol'):
+        img, header = read_vol(path, k)
+        return uncrop(img, header['crop'])
+    if path.endswith('.npy'):
+        return uncrop(np.array(np.load(path, mmap_mode='r')[k]), load_crop(path))
+    data = np.load(path)
+    return uncrop(data['data'][k], npz_crop(data))
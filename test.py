@@ -2,6 +2,8 @@ from generator import ParaclassifierGenerator
 from generator import ClassifierGenerator
 from keras.models import load_model
 from keras import backend as K
+from sliceindex import load_index
+from lazy import load_recipe
 
 import pandas as pd
 import numpy as np
@@ -88,15 +90,16 @@ def build_paraclassifier(key):
     return model
 
 
-def classifier(config):
+def classifier(config, img_size):
     # list for storing results for each type of model
     results = []
     # test files
-    test = pd.read_csv(os.path.join('meta', 'clf_test.csv')).values.tolist()
+    test = load_index(os.path.join('meta', 'clf_test.csv'))
     # load the meta data for classifiers (min and max)
     meta_file = open(os.path.join('meta', 'clf_meta.json'), 'r')
     min_max = json.load(meta_file)
-    img_size = 256
+    # recipe of the volumes, if preprocessed lazily
+    recipe = load_recipe(os.path.join('meta', 'recipe.json'))
 
     for key in config.keys():
         result = []
@@ -113,7 +116,7 @@ def classifier(config):
         model, preprocess = build_classifier(key, config[key])
         # test generator
         test_generator = ClassifierGenerator(preprocess, test, min_max,
-                                             48, img_size, True, False)
+                                             48, img_size, True, False, recipe)
         # fetch predictions
         pred = model.evaluate_generator(test_generator)
         # append test results
@@ -179,6 +182,7 @@ def paraclassifier():
 if __name__ == '__main__':
     if sys.argv[1] == 'classifier':
         config = json.load(open(os.path.join('logs', 'clf_config.json'), 'r'))
-        classifier(config)
+        # size of the slices, read from the slice pyramid
+        classifier(config, int(sys.argv[2]) if len(sys.argv) > 2 else 256)
     else:
         paraclassifier()
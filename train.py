@@ -6,17 +6,20 @@ from keras.callbacks import EarlyStopping
 from keras.callbacks import CSVLogger
 from keras.models import load_model
 from keras import backend as K
+from sliceindex import load_index
+from store import levels
+from lazy import load_recipe
 
 import pandas as pd
 import numpy as np
 import models
+import argparse
 import json
-import sys
 import os
 
 
 def get_filepaths(filepath):
-    return pd.read_csv(filepath).values.tolist()
+    return load_index(filepath)
 
 
 def build_autoencoder(key):
@@ -177,7 +180,7 @@ def build_paraclassifier(key):
     return (model, epoch)
 
 
-def autoencoder(key, batch_size):
+def autoencoder(key, batch_size, img_size, cache_size, window):
     K.clear_session()
     # fetch model, preprocessing function and epochs
     model, preprocess, epoch = build_autoencoder(key)
@@ -188,14 +191,19 @@ def autoencoder(key, batch_size):
     # load the meta data for classifiers (min and max)
     meta_file = open(os.path.join('meta', 'ae_meta.json'), 'r')
     min_max = json.load(meta_file)
-    img_size = 256
+    # recipe of the volumes, if preprocessed lazily
+    recipe = load_recipe(os.path.join('meta', 'recipe.json'))
 
+    # the worker processes send each mini-batch back as a copy, so
+    # they reuse a single buffer
     # train generator
     train_generator = AutoEncoderGenerator(preprocess, train, min_max,
-                                           batch_size, img_size, True, True)
+                                           batch_size, img_size, True, True, recipe, cache_size, window,
+                                           buffers=1)
     # validation generator
     valid_generator = AutoEncoderGenerator(preprocess, valid, min_max,
-                                           batch_size, img_size, True, False)
+                                           batch_size, img_size, True, False, recipe, cache_size, window,
+                                           buffers=1)
 
     model_path = os.path.join('weights', 'ae_{}.h5'.format(key))
     log_path = os.path.join('logs', 'ae_{}.csv'.format(key))
@@ -208,10 +216,11 @@ def autoencoder(key, batch_size):
                         validation_data=valid_generator,
                         use_multiprocessing=True, workers=4,
                         initial_epoch=epoch)
+    print('Volume cache: {hits} hits, {misses} misses'.format(**train_generator.cache.stats()))
     del model
 
 
-def classifier(key, batch_size, dropout_rate):
+def classifier(key, batch_size, dropout_rate, img_size, cache_size, window):
     K.clear_session()
     # fetch model, preprocessing function and epochs
     model, preprocess, epoch = build_classifier(key, dropout_rate)
@@ -222,14 +231,19 @@ def classifier(key, batch_size, dropout_rate):
     # load the meta data for classifiers (min and max)
     meta_file = open(os.path.join('meta', 'clf_meta.json'), 'r')
     min_max = json.load(meta_file)
-    img_size = 256
+    # recipe of the volumes, if preprocessed lazily
+    recipe = load_recipe(os.path.join('meta', 'recipe.json'))
 
+    # the worker processes send each mini-batch back as a copy, so
+    # they reuse a single buffer
     # train generator
     train_generator = ClassifierGenerator(preprocess, train, min_max,
-                                          batch_size, img_size, True, True)
+                                          batch_size, img_size, True, True, recipe, cache_size, window,
+                                          buffers=1)
     # validation generator
     valid_generator = ClassifierGenerator(preprocess, valid, min_max,
-                                          batch_size, img_size, True, False)
+                                          batch_size, img_size, True, False, recipe, cache_size, window,
+                                          buffers=1)
 
     model_path = os.path.join('weights', 'clf_{}_{}.h5'.format(key, dropout_rate))
     log_path = os.path.join('logs', 'clf_{}_{}.csv'.format(key, dropout_rate))
@@ -242,6 +256,7 @@ def classifier(key, batch_size, dropout_rate):
                         validation_data=valid_generator,
                         use_multiprocessing=True, workers=4,
                         initial_epoch=epoch)
+    print('Volume cache: {hits} hits, {misses} misses'.format(**train_generator.cache.stats()))
     del model
 
 
@@ -279,11 +294,27 @@ if __name__ == '__main__':
     if not os.path.exists('weights'):
         os.mkdir('weights')
 
-    args = sys.argv
-    if args[1] == 'autoencoder':
-        autoencoder(args[2], int(args[3]))
-    elif args[1] == 'classifier':
+    parser = argparse.ArgumentParser(description='Train the models.')
+    parser.add_argument('model', choices=['autoencoder', 'classifier', 'paraclassifier'],
+                        help='type of model to train')
+    parser.add_argument('key', help='the key to determine which transfer learning layers to use')
+    parser.add_argument('batch_size', type=int, help='size of the mini-batches')
+    parser.add_argument('--size', type=int, choices=levels, default=levels[0],
+                        help='size of the slices to feed the AutoEncoder and Classifiers, read from '
+                             'the slice pyramid saved by preprocessing.py --pyramid')
+    parser.add_argument('--cache', type=int, default=0, metavar='MB',
+                        help='megabytes of decoded volumes each generator keeps in memory in each '
+                             'worker process, 8 times this in total for the train and validation '
+                             'generators of the 4 workers, 0 to read every slice from its file')
+    parser.add_argument('--window', type=int, default=0,
+                        help='shuffle the order of the volumes, then the slices of each window of '
+                             'WINDOW volumes, so that a mini-batch reads a few volumes instead of one '
+                             'volume per slice, 0 to shuffle all the slices together')
+    args = parser.parse_args()
+    if args.model == 'autoencoder':
+        autoencoder(args.key, args.batch_size, args.size, args.cache << 20, args.window)
+    elif args.model == 'classifier':
         for i in range(1, 6):
-            classifier(args[2], int(args[3]), i / 10)
-    elif args[1] == 'paraclassifier':
-        paraclassifier(args[2], int(args[3]))
+            classifier(args.key, args.batch_size, i / 10, args.size, args.cache << 20, args.window)
+    elif args.model == 'paraclassifier':
+        paraclassifier(args.key, args.batch_size)
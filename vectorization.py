@@ -3,8 +3,12 @@ from progressbar import ProgressBar, Bar, Percentage
 from keras.models import load_model
 from keras.models import Model
 from keras import backend as K
+from store import load_volume, save_volume, formats, store_format, extension
+from lazy import load_recipe, materialize
+from codec import codecs, parse_codec
 import pandas as pd
 import numpy as np
+import argparse
 import math
 import json
 import sys
@@ -15,6 +19,20 @@ import gc
 # set seed
 seed = 42
 
+parser = argparse.ArgumentParser(description='Generate the vectors of each volume with the classifiers.')
+parser.add_argument('--store', choices=sorted(formats.keys()), default='npz',
+                    help='storage format of the vectors')
+parser.add_argument('--codec', default='zlib',
+                    help='codec of the vol storage format, one of {}, optionally followed by '
+                         '+shuffle to shuffle the bytes before compressing them'
+                         .format(', '.join(sorted(codecs.keys()))))
+args = parser.parse_args()
+try:
+    parse_codec(args.codec)
+except ValueError as e:
+    parser.error(str(e))
+store = store_format(args.store, args.codec)
+
 # config dict to store optimal hyperparameters
 config = {'resnet': None, 'inception': None, 'inceptionresnet': None,
           'densenet': None, 'xception': None, 'vgg': None}
@@ -86,6 +104,23 @@ def build_classifier(key, dropout_rate):
     return (model, get_preprocess())
 
 
+def vector_name(filepath):
+    '''
+    Returns the file name of the vectors generated for a preprocessed volume
+
+    Parameters
+    ----------
+    filepath: str
+        path to the preprocessed volume
+
+    Returns
+    -------
+    str
+        file name of the vectors, in the storage format
+    '''
+    return os.path.splitext(filepath.split(os.sep)[-1])[0] + extension(store)
+
+
 # fetch train files
 df = pd.read_csv(os.path.join('meta', 'clf_train.csv'))
 train_files = np.hstack((np.expand_dims(df.groupby(['filepath']).mean().index.values, axis=-1),
@@ -105,7 +140,7 @@ fp = open(os.path.join('meta', 'para_train.csv'), 'w')
 fp.write('filepath, class\n')
 train_path = os.path.join(os.path.join(os.path.join('data', 'paraclassifier'), '{}'), 'train')
 for i in range(len(train_files)):
-    fp.write('{}, {}\n'.format(os.path.join(train_path, train_files[i][0].split(os.sep)[-1]), train_files[i][1]))
+    fp.write('{}, {}\n'.format(os.path.join(train_path, vector_name(train_files[i][0])), train_files[i][1]))
 fp.close()
 
 # write the validation files which can be referenced for paraclassifier training
@@ -113,7 +148,7 @@ fp = open(os.path.join('meta', 'para_valid.csv'), 'w')
 fp.write('filepath, class\n')
 valid_path = os.path.join(os.path.join(os.path.join('data', 'paraclassifier'), '{}'), 'valid')
 for i in range(len(valid_files)):
-    fp.write('{}, {}\n'.format(os.path.join(valid_path, valid_files[i][0].split(os.sep)[-1]), valid_files[i][1]))
+    fp.write('{}, {}\n'.format(os.path.join(valid_path, vector_name(valid_files[i][0])), valid_files[i][1]))
 fp.close()
 
 # write the test files which can be referenced for paraclassifier training
@@ -121,13 +156,15 @@ fp = open(os.path.join('meta', 'para_test.csv'), 'w')
 fp.write('filepath, class\n')
 test_path = os.path.join(os.path.join(os.path.join('data', 'paraclassifier'), '{}'), 'test')
 for i in range(len(test_files)):
-    fp.write('{}, {}\n'.format(os.path.join(test_path, test_files[i][0].split(os.sep)[-1]), test_files[i][1]))
+    fp.write('{}, {}\n'.format(os.path.join(test_path, vector_name(test_files[i][0])), test_files[i][1]))
 fp.close()
 
 
 # fetch the classifier minima and maxima
 meta_file = open(os.path.join('meta', 'clf_meta.json'), 'r')
 min_max = json.load(meta_file)
+# recipe of the volumes, if preprocessed lazily
+recipe = load_recipe(os.path.join('meta', 'recipe.json'))
 
 # generate vectors for each type of model
 for key in config.keys():
@@ -140,12 +177,18 @@ for key in config.keys():
     cnt = 0
     bar = ProgressBar(maxval=len(train_files), widgets=[Bar('=', '[', ']'), ' ', Percentage()]).start()
     for i in range(len(train_files)):
-        img = np.load(train_files[i][0])['data']
-        img = (img - min_max['min']) * 255.0 / (min_max['max'] - min_max['min'])
-        img = np.repeat(np.expand_dims(img, axis=-1), 3, axis=-1)
+        materialize(train_files[i][0], recipe)
+        img = load_volume(train_files[i][0])
+        if img.dtype != np.uint8:
+            img = (img - min_max['min']) * 255.0 / (min_max['max'] - min_max['min'])
+        if recipe is not None:
+            # the minima and maxima are only estimated in lazy mode
+            img = np.clip(img, 0, 255)
+        # keras preprocess_input works in place, and fails on uint8 volumes
+        img = np.repeat(np.expand_dims(img.astype('float32'), axis=-1), 3, axis=-1)
         vectors = model.predict(preprocess(img))
-        np.savez_compressed(os.path.join(train_path.format(key),
-                                         train_files[i][0].split(os.sep)[-1]), data=vectors)
+        save_volume(os.path.splitext(os.path.join(train_path.format(key),
+                                                  vector_name(train_files[i][0])))[0], vectors, store)
         cnt += 1
         bar.update(cnt)
     bar.finish()
@@ -154,12 +197,18 @@ for key in config.keys():
     cnt = 0
     bar = ProgressBar(maxval=len(valid_files), widgets=[Bar('=', '[', ']'), ' ', Percentage()]).start()
     for i in range(len(valid_files)):
-        img = np.load(valid_files[i][0])['data']
-        img = (img - min_max['min']) * 255.0 / (min_max['max'] - min_max['min'])
-        img = np.repeat(np.expand_dims(img, axis=-1), 3, axis=-1)
+        materialize(valid_files[i][0], recipe)
+        img = load_volume(valid_files[i][0])
+        if img.dtype != np.uint8:
+            img = (img - min_max['min']) * 255.0 / (min_max['max'] - min_max['min'])
+        if recipe is not None:
+            # the minima and maxima are only estimated in lazy mode
+            img = np.clip(img, 0, 255)
+        # keras preprocess_input works in place, and fails on uint8 volumes
+        img = np.repeat(np.expand_dims(img.astype('float32'), axis=-1), 3, axis=-1)
         vectors = model.predict(preprocess(img))
-        np.savez_compressed(os.path.join(valid_path.format(key),
-                                         valid_files[i][0].split(os.sep)[-1]), data=vectors)
+        save_volume(os.path.splitext(os.path.join(valid_path.format(key),
+                                                  vector_name(valid_files[i][0])))[0], vectors, store)
         cnt += 1
         bar.update(cnt)
     bar.finish()
@@ -168,12 +217,18 @@ for key in config.keys():
     cnt = 0
     bar = ProgressBar(maxval=len(test_files), widgets=[Bar('=', '[', ']'), ' ', Percentage()]).start()
     for i in range(len(test_files)):
-        img = np.load(test_files[i][0])['data']
-        img = (img - min_max['min']) * 255.0 / (min_max['max'] - min_max['min'])
-        img = np.repeat(np.expand_dims(img, axis=-1), 3, axis=-1)
+        materialize(test_files[i][0], recipe)
+        img = load_volume(test_files[i][0])
+        if img.dtype != np.uint8:
+            img = (img - min_max['min']) * 255.0 / (min_max['max'] - min_max['min'])
+        if recipe is not None:
+            # the minima and maxima are only estimated in lazy mode
+            img = np.clip(img, 0, 255)
+        # keras preprocess_input works in place, and fails on uint8 volumes
+        img = np.repeat(np.expand_dims(img.astype('float32'), axis=-1), 3, axis=-1)
         vectors = model.predict(preprocess(img))
-        np.savez_compressed(os.path.join(test_path.format(key),
-                                         test_files[i][0].split(os.sep)[-1]), data=vectors)
+        save_volume(os.path.splitext(os.path.join(test_path.format(key),
+                                                  vector_name(test_files[i][0])))[0], vectors, store)
         cnt += 1
         bar.update(cnt)
     bar.finish()
@@ -0,0 +1,125 @@
+# import libraries
+from store import load_cropped, load_slice, uncrop
+from collections import OrderedDict
+import multiprocessing
+import threading
+import os
+
+
+class VolumeCache(object):
+    def __init__(self, budget):
+        '''
+        Init method for VolumeCache class
+
+        The cache keeps the volumes decoded by a generator, least recently
+        used first, within a budget of bytes, so that the slices of a volume
+        sampled in the same epoch decode it only once. The volumes are kept
+        cropped, as saved.
+
+        Each process has its own cache: the worker processes of
+        fit_generator start with a copy of the generator, and the cache is
+        emptied in a process which did not fill it. keras starts new worker
+        processes every epoch, so the caches of the workers start empty at
+        every epoch, and save the decoding of the volumes within an epoch.
+
+        The hits and misses are counted in shared memory, so they add up the
+        lookups of every worker process forked from the process which
+        created the cache, as fit_generator does on Linux. Shared counters
+        cannot be pickled, so a cache pickled into a spawned process counts
+        its own lookups only.
+
+        Parameters
+        ----------
+        budget: int
+            maximum number of bytes of the decoded volumes kept in each
+            process, 0 to read every slice from its file
+
+        Returns
+        -------
+        None
+        '''
+        self.budget = budget
+        self.hits = multiprocessing.Value('l', 0)
+        self.misses = multiprocessing.Value('l', 0)
+        self.__reset()
+
+    def __reset(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.volumes = OrderedDict()
+        self.size = 0
+
+    def __getstate__(self):
+        return {'budget': self.budget}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.hits = multiprocessing.Value('l', 0)
+        self.misses = multiprocessing.Value('l', 0)
+        self.__reset()
+
+    def __count(self, counter):
+        with counter.get_lock():
+            counter.value += 1
+
+    def load_slice(self, path, k):
+        '''
+        Loads a single slice of a preprocessed volume, from the cache if the
+        volume is in it, otherwise decoding the entire volume and caching it
+
+        Parameters
+        ----------
+        path: str
+            path to the volume
+        k: int
+            index of the slice
+
+        Returns
+        -------
+        ndarray
+            the slice with shape (height, width)
+        '''
+        if self.budget <= 0:
+            return load_slice(path, k)
+        if self.pid != os.getpid():
+            # forked with the volumes, and maybe the lock, of another process
+            self.__reset()
+
+        with self.lock:
+            volume = self.volumes.get(path)
+            if volume is not None:
+                self.volumes.move_to_end(path)
+        if volume is not None:
+            self.__count(self.hits)
+            # a copy, so that the caller cannot modify the cached volume
+            return uncrop(volume[0][k].copy(), volume[1])
+
+        self.__count(self.misses)
+        img, crop = load_cropped(path)
+        if img.nbytes > self.budget:
+            return uncrop(img[k], crop)
+        with self.lock:
+            if path not in self.volumes:
+                self.volumes[path] = (img, crop)
+                self.size += img.nbytes
+            while self.size > self.budget:
+                _, (old, _) = self.volumes.popitem(last=False)
+                self.size -= old.nbytes
+        return uncrop(img[k].copy(), crop)
+
+    def stats(self):
+        '''
+        Returns the hits and misses of every process, and the volumes and
+        bytes cached in this process
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict
+            dictionary of the hits, misses, volumes and bytes
+        '''
+        return {'hits': self.hits.value, 'misses': self.misses.value,
+                'volumes': len(self.volumes), 'bytes': self.size}